@@ -0,0 +1,71 @@
+'''
+benchmark of record encode/decode time and stored size per codec
+
+uses typical COMPILED and DEPLOYED records.  COMPILED* is the COMPILED record as stored, without
+the source and bytecode blobs.  run from the ezo package directory:
+
+    python -m bench.bench_codec [count]
+'''
+
+from core.lib import DB, JsonCodec, PickleCodec
+from core.helpers import get_hash
+from datetime import datetime
+from hexbytes import HexBytes
+import os, pickle, sys, time
+
+
+def compiled_record():
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "contracts", "time_oracle.sol")
+    with open(path, "r") as fh:
+        source = fh.read()
+
+    abi = [{"anonymous": False, "inputs": [{"indexed": False, "name": "rtemp", "type": "uint256"}],
+            "name": "FilledRequest", "type": "event"},
+           {"constant": False, "inputs": [], "name": "request", "outputs": [], "payable": False,
+            "stateMutability": "nonpayable", "type": "function"}] * 4
+
+    return {"name": "<stdin>:TimestampRequestOracle", "abi": abi, "bin": "6080604052" * 600,
+            "source": source, "hash": get_hash(source), "timestamp": datetime.utcnow(),
+            "te-map": {"0x" + "ab" * 32: "/handlers/timestamp_request_oracle/filled_request_handler.py"}}
+
+
+def deployed_record():
+    return {"contract-name": "<stdin>:TimestampRequestOracle", "hash": "b0d4e8f1a2c3d4e5",
+            "tx-hash": HexBytes("0x" + "cd" * 32), "address": "0x5fbb5ef69d971CC59bD0B9cFf414dc908A440035",
+            "gas-used": 312345, "target": "test", "timestamp": datetime.utcnow()}
+
+
+def run(encode, decode, record, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        v = encode(record)
+    enc = (time.perf_counter() - start) / count * 1e6
+
+    start = time.perf_counter()
+    for _ in range(count):
+        decode(v)
+    dec = (time.perf_counter() - start) / count * 1e6
+
+    return enc, dec, len(v)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    codecs = [("pickle (legacy)", pickle.dumps),
+              ("pickle", PickleCodec.encode),
+              ("json", JsonCodec.encode)]
+
+    compiled = compiled_record()
+    # source and bytecode are stored apart from the COMPILED record, as SOURCE/BIN blobs
+    stored = {k: v for k, v in compiled.items() if k not in ("source", "bin")}
+
+    for rname, record in [("COMPILED", compiled), ("COMPILED*", stored), ("DEPLOYED", deployed_record())]:
+        for cname, encode in codecs:
+            enc, dec, size = run(encode, DB.decode, record, count)
+            print("{:9s} {:16s} encode: {:8.1f} us  decode: {:8.1f} us  size: {:6d} bytes".
+                  format(rname, cname, enc, dec, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''
+concurrency benchmark: one writer process and several reader processes sharing one ezo DB
+
+reports completed operations and errors (lock failures) per backend.  LevelDB runs in the
+default open-on-demand mode, since that is the only mode that lets processes share it.
+run from the ezo package directory:
+
+    python -m bench.bench_concurrency [readers] [seconds]
+'''
+
+from core.lib import DB
+from multiprocessing import Process, Queue
+import shutil, sys, tempfile, time
+
+
+def writer(backend, dbpath, seconds, q):
+    db = DB("bench", dbpath, backend=backend)
+    ops = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        _, err = db.save("key:{}".format(ops % 100), {"n": ops}, overwrite=True)
+        if err:
+            errors += 1
+        else:
+            ops += 1
+    q.put(("writer", ops, errors))
+
+
+def reader(backend, dbpath, seconds, q):
+    db = DB("bench", dbpath, backend=backend)
+    ops = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        DB.cache.clear()
+        _, err = db.get("key:{}".format(ops % 100))
+        if err:
+            errors += 1
+        else:
+            ops += 1
+    q.put(("reader", ops, errors))
+
+
+def run(backend, readers, seconds):
+    dbpath = tempfile.mkdtemp(prefix="ezobench")
+    db = DB("bench", dbpath, backend=backend)
+    db.save("key:0", {"n": 0}, overwrite=True)
+
+    q = Queue()
+    procs = [Process(target=writer, args=(backend, dbpath, seconds, q))]
+    procs += [Process(target=reader, args=(backend, dbpath, seconds, q)) for _ in range(readers)]
+    for p in procs:
+        p.start()
+    results = [q.get() for _ in procs]
+    for p in procs:
+        p.join()
+    shutil.rmtree(dbpath, ignore_errors=True)
+
+    w = [r for r in results if r[0] == "writer"]
+    r = [r for r in results if r[0] == "reader"]
+    return (sum(x[1] for x in w), sum(x[2] for x in w), sum(x[1] for x in r), sum(x[2] for x in r))
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    for backend in ["leveldb", "sqlite"]:
+        wops, werr, rops, rerr = run(backend, readers, seconds)
+        print("{:8s} 1 writer: {:8.0f} writes/s ({} errors)   {} readers: {:8.0f} reads/s ({} errors)".
+              format(backend, wops / seconds, werr, readers, rops / seconds, rerr))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+micro-benchmark for DB save/get throughput
+
+compares the default open-on-demand mode against the persistent handle mode.
+run from the ezo package directory:
+
+    python -m bench.bench_db [count]
+'''
+
+from core.lib import DB
+import shutil, sys, tempfile, time
+
+
+def run(persistent, count):
+    dbpath = tempfile.mkdtemp(prefix="ezobench")
+    db = DB("bench", dbpath, persistent=persistent)
+    value = {"address": "0x5fbb5ef69d971CC59bD0B9cFf414dc908A440035", "gas-used": 21000}
+
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            _, err = db.save("key:{}".format(i), value, overwrite=True)
+            if err:
+                return None, err
+        save_time = time.perf_counter() - start
+
+        # bypass the cache so every get hits leveldb
+        DB.cache.clear()
+        start = time.perf_counter()
+        for i in range(count):
+            _, err = db.get("key:{}".format(i))
+            if err:
+                return None, err
+            DB.cache.clear()
+        get_time = time.perf_counter() - start
+    finally:
+        db.shutdown()
+        DB.cache.clear()
+        shutil.rmtree(dbpath, ignore_errors=True)
+
+    return (count / save_time, count / get_time), None
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for label, persistent in [("on-demand", False), ("persistent", True)]:
+        res, err = run(persistent, count)
+        if err:
+            print("{}: error: {}".format(label, err))
+            continue
+        saves, gets = res
+        print("{:12s} save: {:10.0f} ops/s   get: {:10.0f} ops/s".format(label, saves, gets))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+event latency benchmark against a local stand-in node
+
+the stand-in node is a websocket server that answers eth_subscribe and pushes a log at random
+intervals; each log carries the time it was emitted.  the same emission schedule is used to
+measure fixed-interval polling and adaptive polling of an in-process filter, so the polling
+numbers reflect the interval only and leave out the RPC round trip.
+run from the ezo package directory:
+
+    python -m bench.bench_listen_latency [events]
+'''
+
+from core.lib import AdaptiveInterval, subscribe_logs
+import asyncio, json, random, statistics, sys, time, websockets
+
+PORT = 8765
+TOPIC = "0x" + "ab" * 32
+
+
+def make_log(n):
+    return {"address": "0x5fbb5ef69d971cc59bd0b9cff414dc908a440035", "blockNumber": hex(n), "logIndex": "0x0",
+            "transactionIndex": "0x0", "transactionHash": "0x" + "cd" * 32, "blockHash": "0x" + "ef" * 32,
+            "topics": [TOPIC], "data": str(time.perf_counter())}
+
+
+def schedule(count):
+    random.seed(7)
+    return [random.uniform(0.05, 0.6) for _ in range(count)]
+
+
+async def stand_in_node(ws, path=None):
+    req = json.loads(await ws.recv())
+    await ws.send(json.dumps({"jsonrpc": "2.0", "id": req["id"], "result": "0x1"}))
+    for n, gap in enumerate(schedule(COUNT)):
+        await asyncio.sleep(gap)
+        await ws.send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription",
+                                  "params": {"subscription": "0x1", "result": make_log(n)}}))
+
+
+async def measure_subscription():
+    latencies = list()
+    async for log in subscribe_logs("ws://127.0.0.1:{}".format(PORT), {"address": "0x5fbb"}):
+        latencies.append(time.perf_counter() - float(log["data"]))
+        if len(latencies) == COUNT:
+            break
+    return latencies
+
+
+async def measure_polling(interval):
+    pending = list()
+
+    async def emit():
+        for gap in schedule(COUNT):
+            await asyncio.sleep(gap)
+            pending.append(time.perf_counter())
+
+    emitter = asyncio.ensure_future(emit())
+    latencies = list()
+    while len(latencies) < COUNT:
+        events, pending[:] = list(pending), []
+        now = time.perf_counter()
+        latencies += [now - t for t in events]
+        if events:
+            interval.busy()
+        else:
+            interval.idle()
+        await asyncio.sleep(interval.interval)
+    await emitter
+    return latencies
+
+
+def report(label, latencies):
+    print("{:22s} mean: {:7.1f} ms   p50: {:7.1f} ms   max: {:7.1f} ms".format(
+        label, statistics.mean(latencies) * 1000, statistics.median(latencies) * 1000, max(latencies) * 1000))
+
+
+async def main():
+    server = await websockets.serve(stand_in_node, "127.0.0.1", PORT)
+    try:
+        report("subscription (ws)", await measure_subscription())
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    report("polling, fixed 1s", await measure_polling(AdaptiveInterval(1, 1, 1)))
+    report("polling, adaptive", await measure_polling(AdaptiveInterval(1, 0.1, 10)))
+
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -11,8 +11,8 @@ from cement.core.controller import CementBaseController, expose
 from core.lib import Contract, EZO
 from core.helpers import get_contract_path, red, green, cyan, yellow, blue, bright, reset, magenta
 from core.generators import create_ethereum_account, Source
-from core.views import get_contracts, view_contracts, get_deploys, view_deploys
-import os
+from core.views import iter_contracts, view_contract, iter_deploys, view_deploy
+import os, json
 
 
 class EZOBaseController(CementBaseController):
@@ -29,6 +29,10 @@ class EZOBaseController(CementBaseController):
              dict(action='store_true', help="force overwriting of existing record (contract, deployment)")),
             (['-p', '--password'],
              dict(action='store', help='password to unlock local node account')),
+            (['--dry-run'],
+             dict(action='store_true', help="report what would change without writing")),
+            (['--keep'],
+             dict(action='store', type=int, default=0, help="number of the latest compiled versions to keep on delete")),
             (['extra_args'],
              dict(action='store', nargs='*'))
         ]
@@ -37,36 +41,75 @@ class EZOBaseController(CementBaseController):
     def default(self):
         print(magenta("Ezo needs more words to work.  Try 'ezo --help'"))
 
+    @expose(help="rewrite stored records with the configured record format")
+    def migrate(self):
+        ezo = self.app.ezo
+        log = self.app.log
+
+        res, err = ezo.db.migrate(dry_run=self.app.pargs.dry_run)
+        if err:
+            log.error(red("error migrating database: {}".format(err)))
+            return err
+
+        count, before, after = res
+        action = "would rewrite" if self.app.pargs.dry_run else "rewrote"
+        log.info(cyan("{} {} records: {} bytes -> {} bytes".format(action, count, before, after)))
+        return
+
     @expose(help="compile smart contracts")
     def compile(self):
         ezo = self.app.ezo
         log = self.app.log
 
+        # compile every file first -- the build cache reads the DB, which the batch below holds open
+        sources = list()
         for filename in self.app.pargs.extra_args:
             log.info(cyan("compiling contracts in {}".format(filename)))
 
-            filename = get_contract_path(self.app.config["ezo"], filename)
-            contracts_source, err = Contract.load(filename)
+            path = get_contract_path(self.app.config["ezo"], filename)
+            contracts_source, err = Contract.load(path)
             if err:
                 log.error(red("error loading contracts file: {}".format(err)))
                 return err
+            sources.append((filename, contracts_source))
 
-            contracts, err = Contract.compile(contracts_source, ezo)
-            if err:
-                log.error(red("error compiling contracts source: {}".format(err)))
-                return err
+        workers = self.app.config["ezo"].get("compile-workers")
+        compiled, err = Contract.compile_many(sources, ezo, workers=workers)
+        if err:
+            log.error(red("error compiling contracts source: {}".format(err)))
+            return err
 
-            # persist the compiled contract
-            for contract in contracts:
-                contract.source = contracts_source
-                iid, err = contract.save(overwrite=self.app.pargs.overwrite)
+        builds = list()
+        for (filename, contracts, seconds), (_, contracts_source) in zip(compiled, sources):
+            log.info(cyan("compiled {} in {:.2f}s".format(filename, seconds)))
+            builds.append((contracts_source, contracts))
+
+        # every contract compiled in this run is committed in a single write
+        with ezo.db.batch() as batch:
+            for contracts_source, contracts in builds:
+
+                # persist the compiled contract
+                for contract in contracts:
+                    contract.source = contracts_source
+                    iid, err = contract.save(overwrite=self.app.pargs.overwrite, batch=batch)
+                    if err:
+                        log.error(red("error while persisting Contract to datastore: {}".format(err)))
+                        batch.discard()
+                        return err
+                    else:
+                        log.info(cyan("contract saved: {}".format(iid)))
+                        print("pytest>>CONTRACT_SAVED")
+
+                # remember the build so unchanged source is not compiled again
+                _, err = Contract.save_build(batch, contracts)
                 if err:
-                    log.error(red("error while persisting Contract to datastore: {}".format(err)))
+                    log.error(red("error while persisting build to datastore: {}".format(err)))
+                    batch.discard()
                     return err
-                else:
-                    log.info(cyan("contract saved: {}".format(iid)))
-                    print("pytest>>CONTRACT_SAVED")
-            return
+
+        if batch.err:
+            log.error(red("error while persisting Contract to datastore: {}".format(batch.err)))
+            return batch.err
 
     @expose(help="deploy smart contracts")
     def deploy(self):
@@ -115,9 +158,30 @@ class EZOBaseController(CementBaseController):
         return
 
 
-    @expose(help="delete contracts or deployments")
+    @expose(help="delete contracts or deployments: delete contract|deploy <name> [--keep N] [-t target] [--dry-run]")
     def delete(self):
-        self.app.log.info("delete contracts/deployments")
+        ezo = self.app.ezo
+        log = self.app.log
+        args = self.app.pargs
+
+        if len(args.extra_args) != 2 or args.extra_args[0] not in ("contract", "deploy"):
+            log.error(red("usage: ezo delete contract|deploy <name>"))
+            return
+
+        kind, name = args.extra_args
+        if kind == "contract":
+            res, err = Contract.delete(ezo, name, keep=args.keep, dry_run=args.dry_run)
+        else:
+            res, err = Contract.delete_deployments(ezo, name, target=args.target, dry_run=args.dry_run)
+        if err:
+            log.error(red("error deleting {} {}: {}".format(kind, name, err)))
+            return err
+
+        action = "would delete" if args.dry_run else "deleted"
+        for key, size in res:
+            log.info(cyan("{} {} ({} bytes)".format(action, key, size)))
+        log.info(cyan("{} {} keys, {} bytes reclaimed".format(action, len(res), sum(size for _, size in res))))
+        return
 
 
     @expose(help="start ezo")
@@ -211,7 +275,11 @@ class EZOViewController(CementBaseController):
         description = "view contracts and deployments"
         arguments = [
             (['term'],
-             dict(action='store', nargs="?"))
+             dict(action='store', nargs="?")),
+            (['--limit'],
+             dict(action='store', type=int, help="maximum number of records to show")),
+            (['--start'],
+             dict(action='store', help="resume listing after this key (printed at the end of a page)"))
         ]
 
     @expose(help="default")
@@ -224,19 +292,23 @@ class EZOViewController(CementBaseController):
 
         ezo = self.app.ezo
         log = self.app.log
-        res, err = get_contracts(self.app.pargs.term, ezo)
+        args = self.app.pargs
+        res, err = iter_contracts(args.term, ezo, start=args.start, limit=args.limit)
         if err:
             log.error(red("error viewing contracts"))
             log.error(red(err))
             return err
 
-        v = view_contracts(res)
         print()
         print(bright(blue("+-------+")))
-        for vs in v:
-            print(yellow(vs))
+        count, last = 0, None
+        for key, value in res:
+            print(yellow(view_contract(key, value)))
+            count, last = count + 1, key
         print(blue("+------------+"))
-        print(yellow("ezo contracts: {}".format(len(res))))
+        print(yellow("ezo contracts: {}".format(count)))
+        if args.limit and count == args.limit:
+            print(yellow("next page: --start {}".format(last)))
         print(reset(""))
         return
 
@@ -244,20 +316,25 @@ class EZOViewController(CementBaseController):
     def deploys(self):
         ezo = self.app.ezo
         log = self.app.log
-        res, err = get_deploys(self.app.pargs.term, ezo)
+        args = self.app.pargs
+        res, err = iter_deploys(args.term, ezo, start=args.start, limit=args.limit)
         if err:
             log.error(red("error viewing deployments"))
             log.error(red(err))
             return err
-        v = view_deploys(res)
+
         print()
         print(bright(blue("+-------+")))
-        for vs in v:
-            print(yellow(vs))
+        count, last = 0, None
+        for key, value in res:
+            print(yellow(view_deploy(key, value)))
+            count, last = count + 1, key
         print(blue("+--------------+"))
-        print(yellow("ezo deployments: {}".format(bright(len(res)))))
+        print(yellow("ezo deployments: {}".format(bright(count))))
+        if args.limit and count == args.limit:
+            print(yellow("next page: --start {}".format(last)))
         print(reset(""))
-        return len(res)
+        return count
 
 
 class EZOCreateController(CementBaseController):
@@ -308,7 +385,13 @@ class EZOTestClientController(CementBaseController):
             (['-t', '--target'],
              dict(action='store', help='deployment target node (set in configuration')),
             (['-p', '--password'],
-             dict(action='store', help='password to unlock local node account'))
+             dict(action='store', help='password to unlock local node account')),
+            (['--batch'],
+             dict(action='store', help='JSON lines file of calls: {"contract": ..., "method": ..., "params": [...]}')),
+            (['--block'],
+             dict(action='store', type=int, help='block number to make the calls at')),
+            (['--pin'],
+             dict(action='store_true', help='make all the calls at the current block'))
         ]
 
     @expose(help="")
@@ -371,6 +454,9 @@ class EZOTestClientController(CementBaseController):
             log.error(red("error with node: {}".format(err)))
             return
 
+        if args.batch:
+            return self.call_batch()
+
         if len(params) != 3:
             self.app.log.error(red("missing parameters for send tx - 3 required"))
             return
@@ -388,6 +474,41 @@ class EZOTestClientController(CementBaseController):
         self.app.log.info(blue("call response: {}".format(yellow(resp))))
         return
 
+    def call_batch(self):
+        ezo = self.app.ezo
+        args = self.app.pargs
+        log = self.app.log
+
+        calls = list()
+        try:
+            with open(args.batch) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    c = json.loads(line)
+                    calls.append((c["contract"], c["method"], c.get("params")))
+        except Exception as e:
+            log.error(red("error reading batch file {}: {}".format(args.batch, e)))
+            return
+
+        block = args.block
+        if args.pin:
+            block = ezo.w3.eth.blockNumber
+        if block is not None:
+            log.info(cyan("calling at block {}".format(block)))
+
+        results, err = Contract.call_many(ezo, calls, args.target, block=block)
+        if err:
+            log.error(red("call error: {}".format(err)))
+            return
+
+        for (name, method, _), (resp, err) in zip(calls, results):
+            if err:
+                log.error(red("{}.{} call error: {}".format(name, method, err)))
+                continue
+            log.info(blue("{}.{} call response: {}".format(name, method, yellow(resp))))
+        return
+
 
 
 class EZOApp(CementApp):
@@ -1,4 +1,4 @@
-import json, xxhash
+import json, xxhash, os, shutil
 from hexbytes import HexBytes
 
 
@@ -10,8 +10,14 @@ class HexJsonEncoder(json.JSONEncoder):
 
 # returns the url for the stage
 def get_url(config, target):
+    return get_urls(config, target)[0]
+
+
+# returns every node url for the stage.  "url" may be a single url or a list of them
+def get_urls(config, target):
     cfg = config["target"][target]
-    return cfg["url"]
+    urls = cfg["url"]
+    return list(urls) if isinstance(urls, (list, tuple)) else [urls]
 
 
 # returns the account address for the stage
@@ -20,6 +26,12 @@ def get_account(config, target):
     return cfg["account"]
 
 
+# returns the keystore files for the target's signing accounts
+def get_keystores(config, target):
+    cfg = config["target"][target]
+    return cfg.get("keystores", [])
+
+
 # returns the base directory for contacts
 def get_contract_path(config, filename=None):
     if filename:
@@ -45,6 +57,42 @@ def get_hash(str):
     bs = bytes(str, 'utf-8')
     return xxhash.xxh64(bs).hexdigest()
 
+# returns a fingerprint of the solc binary py-solc will run, without running it
+def get_compiler_id():
+    binary = os.environ.get('SOLC_BINARY', 'solc')
+    path = shutil.which(binary) or binary
+    try:
+        st = os.stat(path)
+        return get_hash("{}:{}:{}".format(path, st.st_mtime, st.st_size))
+    except OSError:
+        return get_hash(path)
+
+# converts a raw JSON-RPC log (hex quantities) into the shape web3 filters return
+def format_log(log):
+    d = dict(log)
+    for k in ("blockNumber", "logIndex", "transactionIndex"):
+        if isinstance(d.get(k), str):
+            d[k] = int(d[k], 16)
+    for k in ("blockHash", "transactionHash"):
+        if d.get(k) is not None:
+            d[k] = HexBytes(d[k])
+    d["topics"] = [HexBytes(t) for t in d.get("topics", [])]
+    return d
+
+def format_receipt(receipt):
+    '''
+    converts a transaction receipt from its JSON-RPC form (hex quantities) to the form web3 returns
+    '''
+    d = dict(receipt)
+    for k in ("blockNumber", "cumulativeGasUsed", "gasUsed", "status", "transactionIndex"):
+        if isinstance(d.get(k), str):
+            d[k] = int(d[k], 16)
+    for k in ("blockHash", "transactionHash"):
+        if d.get(k) is not None:
+            d[k] = HexBytes(d[k])
+    d["logs"] = [format_log(l) for l in d.get("logs", [])]
+    return d
+
 # returns the sha3 topic for the event method
 '''
  {
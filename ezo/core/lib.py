@@ -6,13 +6,23 @@ library for ezo
 
 from solc import compile_source
 from web3 import Web3, WebsocketProvider, HTTPProvider
-from core.helpers import get_url, get_hash, get_account, get_handler_path, get_topic_sha3
+from web3.providers import BaseProvider
+from core.helpers import get_url, get_urls, get_hash, get_account, get_keystores, get_handler_path, get_topic_sha3, get_compiler_id, \
+    format_log, format_receipt
 from core.generators import gen_event_handler_code, create_blank_config_obj, \
     create_sample_contracts_1, create_sample_contracts_2
 from core.helpers import cyan, red, yellow, blue, bright, magenta, reset, HexJsonEncoder
+from core.stores import SQLiteDB, prefix_stop
 from datetime import datetime
-import plyvel, pickle, asyncio, time, os.path, os, inflection, json, ast
-import importlib.util
+import plyvel, pickle, asyncio, time, os.path, os, inflection, json, ast, zlib
+import importlib.util, websockets, threading, math, requests, requests.adapters
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, TimeoutError as WaitTimeout
+from lru import LRU
+from hexbytes import HexBytes
+from eth_abi.registry import registry as abi_registry
+from eth_abi.decoding import TupleDecoder, ContextFramesBytesIO
+from eth_account import Account
 
 
 class EZO:
@@ -29,6 +39,17 @@ class EZO:
     CONTRACT = "CONTRACT"
     COMPILED = "COMPILED"
     DEPLOYED = "DEPLOYED"
+    SOURCE = "SOURCE"
+    BIN = "BIN"
+    BUILD = "BUILD"
+    CHECKPOINT = "CHECKPOINT"
+    HANDLED = "HANDLED"
+    RESPONSE = "RESPONSE"
+
+    # secondary index prefixes for deployments
+    BY_ADDRESS = "BY-ADDRESS"
+    BY_TARGET = "BY-TARGET"
+    BY_HASH = "BY-HASH"
 
     def __init__(self, config):
         if not config:
@@ -36,7 +57,12 @@ class EZO:
         self.config = config
 #        self.target = None
         self.w3 = None
-        EZO.db = DB(config["project-name"], config["leveldb"] )
+        self.tracker = None
+        self.unlocks = None
+        self.gas = None
+        self.accounts = None
+        EZO.db = DB(config["project-name"], config["leveldb"], persistent=config.get("db-persistent", False),
+                    cache=config.get("db-cache"), codec=config.get("db-codec"), backend=config.get("db-backend"))
 
     def dial(self, target):
         '''
@@ -50,23 +76,22 @@ class EZO:
         if not target:
             return None, "target network must be specified with -t or --target"
 
-        url = get_url(self.config, target)
-
-        try:
-            if url.startswith('ws'):
-                self.w3 = Web3(WebsocketProvider(url))
-            elif url.startswith('http'):
-                self.w3 = Web3(HTTPProvider(url))
-            elif url.endswith('ipc'):
-                if url == 'ipc':
-                    url = None
-                self.w3 = Web3(Web3.IPCProvider(url))
-            else:
-                return None, "Invalid Provider URL: {}".format(url)
+        urls = get_urls(self.config, target)
+        if len(urls) > 1:
+            self.w3 = Web3(FailoverProvider(Balancer.for_target(self.config, target), self.config))
+        else:
+            self.w3, err = ProviderPool.get(urls[0], self.config)
+            if err:
+                return None, err
 
-        except Exception as e:
-            return None, e
+        self.tracker = TxTracker(self.w3, self.config, db=EZO.db)
+        self.unlocks = UnlockSession(self.w3, duration=self.config.get("unlock-duration", 300))
+        self.gas = GasCache(margin=self.config.get("gas-margin", 0.25))
 
+        password = os.environ['EZO_PASSWORD'] if 'EZO_PASSWORD' in os.environ else None
+        self.accounts, err = AccountPool.from_config(self.w3, self.config, target, password)
+        if err:
+            return None, err
         return self.w3, None
 
     def start(self, contract_names, target):
@@ -82,7 +107,11 @@ class EZO:
         if not isinstance(contract_names, list):
             return None, "error: expecting a string, or a list of contract names"
 
-        contract_listeners = []
+        listener = Listener(self, target)
+        HandlerRegistry.hot_reload = self.config.get("handler-hot-reload", False)
+        dispatcher = Dispatcher(workers=self.config.get("handler-workers", 4),
+                                queue_size=self.config.get("event-queue-size", 1000),
+                                ordered=self.config.get("ordered-dispatch", True))
 
         for name in contract_names:
             c, err = Contract.get(name, self)
@@ -104,12 +133,16 @@ class EZO:
                 EZO.log.error(red("no address for contract {}".format(name)))
                 continue
 
-            contract_listeners.append(c.listen(address, target))
+            _, err = listener.add(address, c)
+            if err:
+                EZO.log.error(red("error loading checkpoint for contract {}".format(name)))
+                EZO.log.error(red(err))
+                continue
 
-        if contract_listeners:
+        if listener.contracts:
             loop = asyncio.get_event_loop()
             loop.run_until_complete(
-                asyncio.gather(*contract_listeners)
+                asyncio.gather(dispatcher.run(), listener.run(dispatcher))
             )
         else:
             return None, "unable to start contract listeners"
@@ -181,315 +214,1991 @@ class EZO:
         return None, None
 
 
-class ContractEvent:
+class HandlerRegistry:
+    '''
+    loads event handler modules once and keeps them, keyed by path
 
-    def __init__(self, rce, target):
-        self.timestamp = int(time.time())
-        self.address = rce["address"]
-        self.data = rce["data"]
-        self.log_index = rce["logIndex"]
-        self.tx = rce["transactionHash"]
-        self.topics = rce["topics"]
-        self.block_number = rce["blockNumber"]
-        self.event_topic = self.topics[0]
-        self.target = target
+    in hot-reload mode ("handler-hot-reload" in ezo.conf) the handler file's modification time is
+    checked on each use, and the module is executed again when the file has changed
+    '''
 
-    @staticmethod
-    def handler(rce, contract, target):
+    hot_reload = False
+    _modules = dict()
 
-        ce = ContractEvent(rce, target)
+    @staticmethod
+    def get(path):
+        '''
+        returns the handler module for a path
+        :param path: path to the handler source file
+        :return: module, err
+        '''
 
-        # find the mappped method for the topic
-        if ce.event_topic in contract.te_map:
-            handler_path = contract.te_map[ce.event_topic]
-            s = importlib.util.spec_from_file_location("handlers", handler_path)
-            handler_module = importlib.util.module_from_spec(s)
-            s.loader.exec_module(handler_module)
-            handler_module.handler(ce, contract)
+        entry = HandlerRegistry._modules.get(path)
+        if entry and not HandlerRegistry.hot_reload:
+            return entry[1], None
 
-        else:
-            EZO.log.warn(blue("topic {} not in map".format(ce.event_topic)))
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            return None, e
 
+        if entry and entry[0] == mtime:
+            return entry[1], None
 
-class Contract:
+        try:
+            s = importlib.util.spec_from_file_location("handlers.{}".format(get_hash(path)), path)
+            module = importlib.util.module_from_spec(s)
+            s.loader.exec_module(module)
+        except Exception as e:
+            return None, e
 
-    def __init__(self, name, ezo):
-        self.name = name
-        self._ezo = ezo
-        self.timestamp = datetime.utcnow()
-        self.hash = None
-        self.abi  = None
-        self.bin  = None
-        self.source = None
-        self.te_map = dict()
-        self.contract_obj = None
+        HandlerRegistry._modules[path] = (mtime, module)
+        return module, None
 
-    def deploy(self, target, overwrite=False):
-        '''
-        deploy this contract
-        :param target:
-        :param account:  the account address to use
-        :return: address, err
-        '''
+    @staticmethod
+    def clear():
+        HandlerRegistry._modules = dict()
 
-        name = self.name.replace('<stdin>:', "")
-        key = DB.pkey([EZO.DEPLOYED, name, target, self.hash])
 
-        if not target:
-            return None, "target network must be set with -t or --target"
+class EventDecoder:
+    '''
+    decodes the arguments of one ABI event from a log into a dict keyed by argument name
 
-        password = os.environ['EZO_PASSWORD'] if 'EZO_PASSWORD' in os.environ else None
+    the eth-abi decoders for the argument types are looked up once, when the decoder is built.
+    indexed arguments are read from the log topics.  indexed arguments of dynamic types (string,
+    bytes, arrays) are stored by the node as a hash of the value, so they are returned as the raw topic
+    '''
 
-        # see if a deployment already exists for this contract on this target
-        if not overwrite:
-            res, err = self._ezo.db.get(key)
-            if err:
-                return None, "ERROR: Contract.deployment() {}".format(err)
-            if res:
-                return None, "deployment on {} already exists for contract {} use '--overwrite' to force".format(target, self.hash)
+    def __init__(self, event):
+        self.name = event["name"]
+        self.topic = topic_key(Web3.keccak(text=get_topic_sha3(event)))
+
+        inputs = event["inputs"]
+        self.names = [i["name"] for i in inputs]
+        self._indexed = list()
+        data = list()
+        for i in inputs:
+            if i.get("indexed"):
+                d = abi_registry.get_decoder(i["type"])
+                self._indexed.append((i["name"], None if d.is_dynamic else d))
+            else:
+                data.append(i)
+        self._data_names = [i["name"] for i in data]
+        self._data = TupleDecoder(decoders=[abi_registry.get_decoder(i["type"]) for i in data])
 
-        account = self._ezo.w3.toChecksumAddress(get_account(self._ezo.config, target))
-        self._ezo.w3.eth.accounts[0] = account
+    def decode(self, rce):
+        '''
+        :param rce: raw contract event (log)
+        :return: dict of argument name to value, err
+        '''
 
         try:
-            u_state = self._ezo.w3.personal.unlockAccount(account, password)
+            args = dict()
+            for (name, d), topic in zip(self._indexed, rce["topics"][1:]):
+                topic = HexBytes(topic)
+                args[name] = d(ContextFramesBytesIO(topic)) if d else topic
+            values = self._data(ContextFramesBytesIO(HexBytes(rce["data"])))
+            args.update(zip(self._data_names, values))
         except Exception as e:
-            return None, "unable to unlock account for {} using password".format(account)
+            return None, e
 
-        try:
-            ct = self._ezo.w3.eth.contract(abi=self.abi, bytecode=self.bin)
-            gas_estimate = ct.constructor().estimateGas()
-            h = {'from': account, 'gas': gas_estimate + 1000}
-            tx_hash = ct.constructor().transact(h)
-            tx_receipt = self._ezo.w3.eth.waitForTransactionReceipt(tx_hash)
-            address = tx_receipt['contractAddress']
+        # in the ABI's argument order
+        return {n: args[n] for n in self.names if n in args}, None
 
-        except Exception as e:
-            return None, e
-#        finally:
-#            self._ezo.w3.personal.lockAccount(account)
 
-        d = dict()
-        d["contract-name"] = self.name
-        d["hash"] = self.hash
-        d["tx-hash"] = tx_hash
-        d["address"] = address
-        d["gas-used"] = tx_receipt["gasUsed"]
-        d["target"] = target
-        d["timestamp"] = datetime.utcnow()
+class DispatchTable:
+    '''
+    maps each event topic a contract handles to its handler function and event decoder
 
-        # save the deployment information
-        try:
-            _, err = self._ezo.db.save(key, d, overwrite=overwrite)
-            if err:
-                return None, err
-        except Exception as e:
-            return None, e
+    built once for a contract when it starts listening, from its te_map and its ABI, so nothing has
+    to be looked up or loaded per event.  in hot-reload mode the handler is fetched from the
+    HandlerRegistry on each use instead, so changes to the handler file are picked up
+    '''
 
-        return address, None
+    def __init__(self):
+        self.entries = dict()
 
-    async def listen(self, address, target):
+    @staticmethod
+    def from_contract(contract):
         '''
-        starts event listener for the contract
-        :return:
+        :return: DispatchTable, list of errors for handlers that could not be loaded
         '''
 
-        if not address:
-            return None, "listening address not provided"
+        decoders = dict()
+        for event in (contract.abi or []):
+            if event["type"] == "event" and not event.get("anonymous"):
+                d = EventDecoder(event)
+                decoders[d.topic] = d
 
-        EZO.log.info(bright("hello ezo::listening to address: {}".format(blue(address))))
-        interval = self._ezo.config["poll-interval"]
-
-        event_filter = self._ezo.w3.eth.filter({"address": address, "toBlock": "latest"})
-        loop = asyncio.new_event_loop()
-        try:
-            while True:
-                for event in event_filter.get_new_entries():
-                    if EZO.log:
-                        EZO.log.debug(bright("event received: {}".format(event)))
-                    ContractEvent.handler(event, self, target)
-                await asyncio.sleep(interval)
-        except Exception as e:
-            return None, e
-        finally:
-            loop.close()
+        table = DispatchTable()
+        errors = list()
+        for topic, path in contract.te_map.items():
+            module, err = HandlerRegistry.get(path)
+            if err:
+                errors.append("error loading handler {}: {}".format(path, err))
+                continue
+            table.entries[topic_key(topic)] = (path, module.handler, decoders.get(topic_key(topic)))
+        return table, errors
 
-    def response(self, response_data):
+    def get(self, topic):
         '''
-        called by the event handler with the result data
-        :param response_data: result data
-        :return:
+        :return: handler function, EventDecoder (None if the event is not in the ABI), err
         '''
 
-        if "address" not in response_data:
-            return None, "address missing from response_data payload"
-        if "function" not in response_data:
-            return None, "method missing from response_data payload"
-        if "params" not in response_data:
-            return None, "params missing from response_data payload"
-        if "target" not in response_data:
-            return None, "target missing from response_data payload"
+        entry = self.entries.get(topic_key(topic))
+        if not entry:
+            return None, None, "topic {} not in map".format(topic_key(topic))
+        path, handler, decoder = entry
+        if HandlerRegistry.hot_reload:
+            module, err = HandlerRegistry.get(path)
+            if err:
+                return None, None, "error loading handler {}: {}".format(path, err)
+            handler = module.handler
+        return handler, decoder, None
 
 
-        address = self._ezo.w3.toChecksumAddress(response_data["address"])
-        account = self._ezo.w3.toChecksumAddress(get_account(self._ezo.config, response_data["target"]))
+def topic_key(topic):
+    '''
+    topics arrive as HexBytes or hex strings depending on where they came from.  returns the
+    lowercase 0x-prefixed hex string used as the key in dispatch tables and filters
+    '''
+    if isinstance(topic, bytes):
+        return HexBytes(topic).hex()
+    return topic.lower()
 
-        self._ezo.w3.eth.accounts[0] = account
 
-        tx_dict = dict()
-        tx_dict["account"] = account
-        tx_dict["from"] = account
+class AdaptiveInterval:
+    '''
+    a polling interval that drops to its minimum while there is work.  after patience idle polls
+    in a row, it doubles on each idle poll, up to its maximum
+    '''
 
-        password = os.environ['EZO_PASSWORD'] if 'EZO_PASSWORD' in os.environ else None
+    def __init__(self, interval, minimum, maximum, patience=10):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.patience = patience
+        self.interval = min(max(interval, minimum), maximum)
+        self._idle = 0
 
-        u_state = self._ezo.w3.personal.unlockAccount(account, password)
+    def busy(self):
+        self.interval = self.minimum
+        self._idle = 0
 
-        if not self.contract_obj:
-            try:
-                self.contract_obj = self._ezo.w3.eth.contract(address=address, abi=self.abi)
-            except Exception as e:
-                return None, e
+    def idle(self):
+        self._idle += 1
+        if self._idle > self.patience:
+            self.interval = min(self.interval * 2, self.maximum)
 
-        method = response_data["function"]
-        params = response_data["params"]
-        contract_func = self.contract_obj.functions[method]
-        try:
-            if not params:
-                tx_dict["gas"] = contract_func().estimateGas() + 1000
-                tx_hash = contract_func().transact(tx_dict)
-            else:
-                tx_dict["gas"] = contract_func(*params).estimateGas() + 1000
-                tx_hash = contract_func(*params).transact(tx_dict)
 
-            receipt = self._ezo.w3.eth.waitForTransactionReceipt(tx_hash)
-        except Exception as e:
-            return None, "error executing transaction: {}".format(e)
-  #      finally:
-#            self._ezo.w3.personal.lockAccount(account)
+async def subscribe_logs(url, log_filter, subscribed=None):
+    '''
+    yields the logs matching log_filter as the node pushes them over a websocket eth_subscribe
+    subscription.  logs are formatted like web3 filter entries
+    :param url: websocket url of the node
+    :param log_filter: eth_subscribe logs filter, e.g. {"address": address}
+    :param subscribed: (optional) coroutine function awaited once the subscription is in place
+    '''
 
-        return receipt, None
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe",
+                                  "params": ["logs", log_filter]}))
+        resp = json.loads(await ws.recv())
+        if "error" in resp:
+            raise ValueError("eth_subscribe error: {}".format(resp["error"]))
+        subscription = resp["result"]
+        if subscribed:
+            await subscribed()
 
-    def save(self, overwrite=False):
+        while True:
+            msg = json.loads(await ws.recv())
+            if msg.get("method") == "eth_subscription" and msg["params"]["subscription"] == subscription:
+                yield format_log(msg["params"]["result"])
 
-        c = dict()
-        c["name"] = self.name
-        c["abi"] = self.abi
-        c["bin"] = self.bin
-        c["source"] = self.source
-        c["hash"] = get_hash(self.source)
-        c["timestamp"] = self.timestamp
-        c["te-map"] = self.te_map
 
-        # save to compiled contract
-        name = self.name.replace('<stdin>:',"")
-        key = DB.pkey([EZO.COMPILED, name, c["hash"]])
-        ks, err =  self._ezo.db.save(key, c, overwrite=overwrite)
-        if err:
-            return None, err
+class Checkpoint:
+    '''
+    the position (block number, log index) up to which a contract's events on a target have been
+    handled, kept in the DB so a restarted listener can catch up on what it missed
 
-        # save to contract
-        key = DB.pkey([EZO.CONTRACT, name])
-        ks, err = self._ezo.db.save(key, c, overwrite=True)
-        if err:
-            return None, err
+    events may finish out of order when handled concurrently, so the stored position only moves
+    up to the last event with nothing still in flight before it.  once every log up to a block is
+    known to have been received, the position moves to the end of that block (log index END), so a
+    contract without events doesn't fall behind
+    '''
 
-        return ks, None
+    END = float('inf')
 
-    def generate_event_handlers(self, overwrite=False):
+    def __init__(self, db, name, target):
+        self._db = db
+        self.key = DB.pkey([EZO.CHECKPOINT, name.replace('<stdin>:', ""), target])
+        self.saved = None
+        self.last_seen = None
+        self._inflight = list()
+        self._completed = list()
 
-        # get the contract name, events from the abi
-        contract_name = inflection.underscore(self.name.replace('<stdin>:', ''))
-        errors = list()
+    @staticmethod
+    def position(rce):
+        return (rce["blockNumber"], rce["logIndex"])
 
-        events = [x for x in self.abi if x["type"] == "event"]
+    def load(self):
+        '''
+        :return: the stored (block, log index), err
+        '''
+        cp, err = self._db.get(self.key)
+        if err:
+            return None, err
+        if cp:
+            index = cp["log-index"]
+            self.saved = self.last_seen = (cp["block"], Checkpoint.END if index is None else index)
+        return self.saved, None
 
-        for event in events:
-            #     get the topic sha3
-            topic = Web3.sha3(text=get_topic_sha3(event))
+    def seen(self, rce):
+        '''
+        marks an event as received.  returns False if it is at or before an event already received
+        '''
+        pos = Checkpoint.position(rce)
+        if self.last_seen and pos <= self.last_seen:
+            return False
+        self.last_seen = pos
+        self._inflight.append(pos)
+        return True
+
+    def done(self, rce):
+        '''
+        marks an event as handled, and stores the new position when it moves
+        '''
+        pos = Checkpoint.position(rce)
+        if pos in self._inflight:
+            self._inflight.remove(pos)
+        self._completed.append(pos)
+
+        floor = min(self._inflight) if self._inflight else None
+        safe = [p for p in self._completed if floor is None or p < floor]
+        if not safe:
+            return
+        best = max(safe)
+        self._completed = [p for p in self._completed if p > best]
 
-            #     build full path to new event handler
-            hp = get_handler_path(self._ezo.config, contract_name)
-            if not os.path.isdir(hp):
-                os.mkdir(hp)
-            event_name = inflection.underscore(event['name'])
-            eh = "{}/{}_{}".format(hp, event_name, "handler.py")
+        if self.saved and best <= self.saved:
+            return
+        _, err = self._db.save(self.key, {"block": best[0], "log-index": best[1]}, overwrite=True)
+        if err:
+            EZO.log.error(red("error saving checkpoint {}: {}".format(self.key, err)))
+            return
+        self.saved = best
 
-            #     check to see if it exists
-            #     if not, or if overwrite option is on
-            if not os.path.exists(eh) or overwrite:
+    def advance(self, block):
+        '''
+        moves the position to the end of a block, and stores it, when every event received has been
+        handled.  used once every log up to the block has been received
+        :return: True if the stored position moved
+        '''
+        if self._inflight:
+            return False
+        pos = (block, Checkpoint.END)
+        if self.last_seen and self.last_seen >= pos:
+            return False
+        self.last_seen = pos
+
+        _, err = self._db.save(self.key, {"block": block, "log-index": None}, overwrite=True)
+        if err:
+            EZO.log.error(red("error saving checkpoint {}: {}".format(self.key, err)))
+            return False
+        self.saved = pos
+        return True
 
-                # create event handler scaffold in python
-                code, err = gen_event_handler_code(event_name)
-                if err:
-                    print(red("gen error: {}".format(err)))
-                try:
-                    with open(eh, "w+") as f:
-                        f.write(code)
+    def rewind(self, rce):
+        '''
+        moves the position back to just before an event, so that it is received again.  used when a
+        reorg removes an event that was already seen
+        '''
+        block, index = Checkpoint.position(rce)
+        pos = (block, index - 1)
+        if self.last_seen and self.last_seen > pos:
+            self.last_seen = pos
+        self._inflight = [p for p in self._inflight if p <= pos]
+        self._completed = [p for p in self._completed if p <= pos]
+
+        if self.saved and self.saved > pos:
+            _, err = self._db.save(self.key, {"block": pos[0], "log-index": pos[1]}, overwrite=True)
+            if err:
+                EZO.log.error(red("error saving checkpoint {}: {}".format(self.key, err)))
+                return
+            self.saved = pos
 
-                except Exception as e:
-                    print(red("gen error: {}".format(e)))
-                    errors.append(e)
-                    continue
 
-            #  map the topic to the handler
-            self.te_map[topic] = eh
+class HandledEvents:
+    '''
+    remembers which events on a target have been handled, so none is handled twice when it is
+    delivered again (a reinstalled filter, a reconnected subscription, an overlapping backfill).
+    handlers send paid transactions, so this matters
+
+    an event is identified by (target, tx hash, log index, block hash).  the block hash is part of
+    the key, so an event mined again in another block after a reorg is handled again.  recent events
+    are kept in an LRU, and every handled event is stored in the DB so restarts don't repeat them.
+    when a reorg removes an event (removed: true), it is forgotten.  events far enough before every
+    checkpoint on the target are pruned, since they are not received again
+    '''
 
-        _, err = self.save(overwrite=True)
-        if err:
-            return None, err
-        return None, errors
+    def __init__(self, db, target, size=10000):
+        self._db = db
+        self.target = target
+        self._recent = LRU(size)
 
+    def key(self, rce):
+        block_hash = rce.get("blockHash")
+        return DB.pkey([EZO.HANDLED, self.target, HexBytes(rce["transactionHash"]).hex(), str(rce["logIndex"]),
+                        HexBytes(block_hash).hex() if block_hash else ""])
 
-    def paramsForMethod(self, method, data):
+    def claim(self, rce):
         '''
-
+        marks an event as being handled.  returns False if it already has been
         '''
+        key = self.key(rce)
+        if key in self._recent:
+            return False
 
-        v = ast.literal_eval(data)
-        if not v:
-            return None
-        return v
+        handled, err = self._db.get(key)
+        if err:
+            EZO.log.error(red("error reading handled event {}: {}".format(key, err)))
+        self._recent[key] = True
+        return not handled
 
+    def done(self, rce):
+        '''
+        stores an event as handled
+        '''
+        _, err = self._db.save(self.key(rce), {"block": rce["blockNumber"]}, overwrite=True)
+        if err:
+            EZO.log.error(red("error saving handled event: {}".format(err)))
 
-    @staticmethod
-    def send(ezo, name, method, data, target):
+    def rollback(self, rce):
         '''
-        runs a transaction on a contract method
-        :param ezo:  ezo instance
-        :param name:  name of the Contract
-        :param method:  name of the contract method
-        :param data: formatted data to send to the contract method
-        :return:
+        forgets an event removed by a reorg
         '''
+        key = self.key(rce)
+        if key in self._recent:
+            del self._recent[key]
+        _, err = self._db.delete(key)
+        if err:
+            EZO.log.error(red("error removing handled event {}: {}".format(key, err)))
 
-        # load the contract by name
-        c, err = Contract.get(name, ezo)
+    def prune(self, block):
+        '''
+        forgets the events handled in blocks before block
+        :return: number of events forgotten, err
+        '''
+        it, err = self._db.iter(DB.pkey([EZO.HANDLED, self.target]))
         if err:
             return None, err
+        try:
+            stale = [key for key, value in it if isinstance(value, dict) and value.get("block", block) < block]
+        except Exception as e:
+            return None, "HandledEvents.prune error: {}".format(e)
+        if not stale:
+            return 0, None
 
-        address, err = Contract.get_address(name, c.hash, ezo.db, target)
+        res, err = self._db.delete_keys(stale)
         if err:
             return None, err
+        for key in stale:
+            self._recent.pop(bytes(key, 'utf-8'), None)
+        return len(res), None
 
-        d = dict()
-        d["address"] = address
-        d["function"] = method
-        d["params"] = c.paramsForMethod(method, data)
-        d["target"] = target
 
+class Dispatcher:
+    '''
+    hands received events to a pool of handler worker threads, so a slow handler (e.g. one waiting
+    on a transaction receipt) doesn't hold up polling for every other contract
 
-        resp, err = c.response(d)
-        if err:
-            return None, err
+    events wait in a bounded queue.  when it is full, the listener putting the event waits too
+    (backpressure).  in ordered mode, events for the same contract address always go to the same
+    worker, so each contract's events are handled in the order received
+    '''
 
-        return resp, None
+    def __init__(self, workers=4, queue_size=1000, ordered=True):
+        self.workers = max(1, workers)
+        self.ordered = ordered
+        self.handled = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
 
-    @staticmethod
-    def call(ezo, name, method, data, target):
+        if ordered:
+            size = max(1, queue_size // self.workers)
+            self._queues = [asyncio.Queue(maxsize=size) for _ in range(self.workers)]
+        else:
+            self._queues = [asyncio.Queue(maxsize=queue_size)]
+
+    async def put(self, rce, contract, target, done=None):
         '''
-        calls a method with data and returns a result without changing the chain state
-        :param ezo:  ezo instance
-        :param name:  name of the Contract
+        queues an event for handling, waiting while the queue is full
+        :param done: (optional) called with the event once it has been handled
+        '''
+        q = self._queues[0]
+        if self.ordered:
+            q = self._queues[hash(rce["address"].lower()) % len(self._queues)]
+        await q.put((rce, contract, target, done))
+
+    async def run(self):
+        '''
+        runs the workers until cancelled
+        '''
+        if self.ordered:
+            workers = [self._worker(q) for q in self._queues]
+        else:
+            workers = [self._worker(self._queues[0]) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            self._pool.shutdown(wait=False)
+
+    async def _worker(self, q):
+        loop = asyncio.get_event_loop()
+        while True:
+            rce, contract, target, done = await q.get()
+            try:
+                await loop.run_in_executor(self._pool, ContractEvent.handler, rce, contract, target)
+            except Exception as e:
+                EZO.log.error(red("error handling event {}: {}".format(rce.get("transactionHash"), e)))
+            finally:
+                self.handled += 1
+                if done:
+                    done(rce)
+                q.task_done()
+
+    async def join(self):
+        '''
+        waits until every queued event has been handled
+        '''
+        for q in self._queues:
+            await q.join()
+
+
+class Listener:
+    '''
+    listens for the events of every contract on a target through a single log filter (or a single
+    subscription on websocket targets), and routes each log to its contract by address
+
+    on websocket targets the node pushes logs through an eth_subscribe subscription.  on HTTP and
+    IPC targets the filter is polled, quickly while events are arriving, backing off while idle.
+    the filter is narrowed to the topics the contracts have handlers for.
+
+    contracts that were listened to before catch up from their checkpoint when the listener starts
+    '''
+
+    def __init__(self, ezo, target):
+        self._ezo = ezo
+        self.target = target
+        self.contracts = dict()
+        self.handled = HandledEvents(ezo.db, target, size=ezo.config.get("handled-cache-size", 10000))
+        self._pruned = None
+
+    def add(self, address, contract):
+        '''
+        adds a contract to the listener, loading its checkpoint and building its dispatch table
+        :return: None, err
+        '''
+
+        contract.checkpoint = Checkpoint(self._ezo.db, contract.name, self.target)
+        _, err = contract.checkpoint.load()
+        if err:
+            return None, err
+        contract.dispatch, errors = DispatchTable.from_contract(contract)
+        for err in errors:
+            EZO.log.error(red(err))
+        contract.handled = self.handled
+        self.contracts[address.lower()] = contract
+        return None, None
+
+    def log_filter(self):
+        addresses = list(self.contracts.keys())
+        f = {"address": addresses if len(addresses) > 1 else addresses[0]}
+
+        topics = set()
+        for c in self.contracts.values():
+            if not c.te_map:
+                return f
+            topics.update(topic_key(t) for t in c.te_map)
+        f["topics"] = [sorted(topics)]
+        return f
+
+    async def run(self, dispatcher=None):
+        '''
+        runs until cancelled
+        :param dispatcher: (optional) Dispatcher to queue events on.  without one, events are handled inline
+        '''
+
+        if not self.contracts:
+            return None, "no contracts to listen to"
+
+        for address in self.contracts:
+            EZO.log.info(bright("hello ezo::listening to address: {}".format(blue(address))))
+
+        urls = get_urls(self._ezo.config, self.target)
+        if all(u.startswith('ws') for u in urls) and self._ezo.config.get("subscribe", True):
+            return await self._subscribed(dispatcher)
+        return await self._polling(dispatcher)
+
+    async def route(self, event, dispatcher=None):
+        '''
+        hands a log to the contract at its address
+        '''
+        c = self.contracts.get(event["address"].lower())
+        if not c:
+            EZO.log.warn(blue("log from unknown address {}".format(event["address"])))
+            return
+        await c.received(event, self.target, dispatcher)
+        self.prune()
+
+    def prune(self):
+        '''
+        every "checkpoint-interval" seconds, forgets the handled events more than "reorg-depth" blocks
+        before the oldest checkpoint on the target
+        '''
+        config = self._ezo.config
+        now = time.monotonic()
+        if self._pruned is not None and now - self._pruned < config.get("checkpoint-interval", 60):
+            return
+        self._pruned = now
+
+        saved = [c.checkpoint.saved for c in self.contracts.values()]
+        if not saved or None in saved:
+            return
+        floor = min(pos[0] for pos in saved) - config.get("reorg-depth", 64)
+        count, err = self.handled.prune(floor)
+        if err:
+            EZO.log.error(red("error pruning handled events on {}: {}".format(self.target, err)))
+        elif count:
+            EZO.log.debug(bright("forgot {} handled events before block {}".format(count, floor)))
+
+    async def _subscribed(self, dispatcher):
+        # with several endpoints, each reconnect goes to the best one available
+        balancer = Balancer.for_target(self._ezo.config, self.target)
+        backoff = AdaptiveInterval(0.5, 0.5, 30, patience=0)
+        loop = asyncio.get_event_loop()
+        while True:
+            url = balancer.pick()
+            start = None
+
+            async def catch_up():
+                balancer.success(url)
+                await self.backfill(dispatcher, start=start)
+
+            try:
+                # read before subscribing, so nothing emitted while subscribing is missed
+                start = await loop.run_in_executor(None, lambda: self._ezo.w3.eth.blockNumber)
+                async for event in subscribe_logs(url, self.log_filter(), subscribed=catch_up):
+                    backoff.busy()
+                    await self.route(event, dispatcher)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                balancer.failure(url)
+                EZO.log.warn(blue("subscription to {} lost ({}), reconnecting in {}s".format(url, e, backoff.interval)))
+            await asyncio.sleep(backoff.interval)
+            backoff.idle()
+
+    async def _polling(self, dispatcher):
+        config = self._ezo.config
+        base = config["poll-interval"]
+        interval = AdaptiveInterval(base, config.get("poll-interval-min", base / 10),
+                                    config.get("poll-interval-max", base * 10))
+        backoff = AdaptiveInterval(0.5, 0.5, 30, patience=0)
+        every = config.get("checkpoint-interval", 60)
+        loop = asyncio.get_event_loop()
+
+        while True:
+            # the filter lives on the node it was installed on.  when that node fails, the filter is
+            # installed again (on another node, with several), and the missed events backfilled
+            try:
+                # the filter is installed before the head is read, so every log is either polled
+                # from the filter or backfilled.  contracts without a checkpoint start at the head
+                # read before installing it
+                start = await loop.run_in_executor(None, lambda: self._ezo.w3.eth.blockNumber)
+                f = dict(self.log_filter(), toBlock="latest")
+                event_filter = await loop.run_in_executor(None, self._ezo.w3.eth.filter, f)
+                head = await loop.run_in_executor(None, lambda: self._ezo.w3.eth.blockNumber)
+                await self.backfill(dispatcher, head=head, start=start)
+                backoff.busy()
+                mark, marked = None, time.monotonic()
+                while True:
+                    # poll off the event loop so queued handlers keep being fed
+                    events = await loop.run_in_executor(None, event_filter.get_new_entries)
+                    for event in events:
+                        await self.route(event, dispatcher)
+                    if events:
+                        interval.busy()
+                    else:
+                        interval.idle()
+                        # every log up to a head read "checkpoint-interval" seconds ago has been
+                        # polled by now, even when the head was read from another node than the filter's
+                        if time.monotonic() - marked >= every:
+                            if mark is not None:
+                                self.advance(mark)
+                            mark = await loop.run_in_executor(None, lambda: self._ezo.w3.eth.blockNumber)
+                            marked = time.monotonic()
+                    await asyncio.sleep(interval.interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                EZO.log.warn(blue("event filter on {} lost ({}), installing it again in {}s".format(
+                    self.target, e, backoff.interval)))
+            await asyncio.sleep(backoff.interval)
+            backoff.idle()
+
+    async def backfill(self, dispatcher=None, head=None, start=None):
+        '''
+        handles the events emitted since the last one seen by each contract, up to head (by default
+        the current block).  the range is fetched with eth_getLogs in chunks of "backfill-chunk-size"
+        blocks, "backfill-workers" at a time.  the checkpoints are then advanced to head
+        :param start: (optional) block contracts without a checkpoint start after (by default head)
+        '''
+
+        config = self._ezo.config
+        w3 = self._ezo.w3
+        loop = asyncio.get_event_loop()
+        if head is None:
+            head = await loop.run_in_executor(None, lambda: w3.eth.blockNumber)
+        if start is None or start > head:
+            start = head
+
+        seen = list()
+        for c in self.contracts.values():
+            if not c.checkpoint.last_seen:
+                # nothing from before the listener started -- stored, so a restart catches up from here
+                c.checkpoint.advance(start)
+            block, index = c.checkpoint.last_seen
+            # a block handled to its end is not fetched again
+            seen.append(block + 1 if index == Checkpoint.END else block)
+        if not seen:
+            return
+
+        chunk = config.get("backfill-chunk-size", 1000)
+        ranges = [(b, min(b + chunk - 1, head)) for b in range(min(seen), head + 1, chunk)]
+        if not ranges:
+            return
+
+        EZO.log.info(bright("catching up from block {} to {}".format(min(seen), head)))
+        f = self.log_filter()
+        pool = ThreadPoolExecutor(max_workers=config.get("backfill-workers", 4))
+        try:
+            fetches = [loop.run_in_executor(pool, w3.eth.getLogs, dict(f, fromBlock=b, toBlock=t)) for b, t in ranges]
+            # handled in block order, as each chunk arrives
+            for fetch in fetches:
+                for event in await fetch:
+                    await self.route(event, dispatcher)
+        finally:
+            pool.shutdown(wait=False)
+
+        self.advance(head)
+
+    def advance(self, block):
+        '''
+        moves the checkpoint of every contract with nothing in flight to the end of block
+        '''
+        for c in self.contracts.values():
+            c.checkpoint.advance(block)
+        self.prune()
+
+
+class ProviderPool:
+    '''
+    keeps one Web3 connection per node URL for the life of the process, instead of a new one per
+    dial
+
+    HTTP nodes are reached through a persistent requests.Session, so connections are kept alive and
+    reused: "http-pool-size" connections at most, with requests timing out after "node-timeout"
+    seconds.  websocket nodes keep their connection open between requests, and reconnect on the
+    next request after it drops.  a connection not used for "provider-health-interval" seconds is
+    checked before it is handed out again, and replaced when the node does not answer
+    '''
+
+    _providers = dict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(url, config):
+        '''
+        :param url: node URL, as returned by get_url
+        :return: Web3, err
+        '''
+
+        # the node is checked and connected to outside the lock, so a slow node doesn't hold up the others
+        with ProviderPool._lock:
+            entry = ProviderPool._providers.get(url)
+        if entry:
+            w3, session, checked = entry
+            if time.monotonic() - checked < config.get("provider-health-interval", 30) or w3.isConnected():
+                with ProviderPool._lock:
+                    if ProviderPool._providers.get(url) is entry:
+                        ProviderPool._providers[url] = (w3, session, time.monotonic())
+                return w3, None
+            EZO.log.warn(blue("node {} not answering, reconnecting".format(url)))
+            with ProviderPool._lock:
+                if ProviderPool._providers.get(url) is entry:
+                    del ProviderPool._providers[url]
+            ProviderPool._close(session)
+
+        try:
+            w3, session = ProviderPool._connect(url, config)
+        except Exception as e:
+            return None, e
+        if w3 is None:
+            return None, "Invalid Provider URL: {}".format(url)
+
+        with ProviderPool._lock:
+            current = ProviderPool._providers.get(url)
+            if current is None:
+                ProviderPool._providers[url] = (w3, session, time.monotonic())
+        if current is not None:
+            # another thread connected first, its connection is shared instead
+            ProviderPool._close(session)
+            return current[0], None
+        return w3, None
+
+    @staticmethod
+    def session(url):
+        '''
+        :return: the requests.Session for an HTTP node URL, or None
+        '''
+        entry = ProviderPool._providers.get(url)
+        return entry[1] if entry else None
+
+    @staticmethod
+    def close():
+        with ProviderPool._lock:
+            for w3, session, _ in ProviderPool._providers.values():
+                ProviderPool._close(session)
+            ProviderPool._providers = dict()
+
+    @staticmethod
+    def _connect(url, config):
+        if url.startswith('ws'):
+            return Web3(WebsocketProvider(url, websocket_timeout=config.get("node-timeout", 10))), None
+
+        if url.startswith('http'):
+            size = config.get("http-pool-size", 10)
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            provider = HTTPProvider(url, request_kwargs={"timeout": config.get("node-timeout", 10)}, session=session)
+            return Web3(provider), session
+
+        if url.endswith('ipc'):
+            return Web3(Web3.IPCProvider(None if url == 'ipc' else url)), None
+
+        return None, None
+
+    @staticmethod
+    def _close(session):
+        if session:
+            session.close()
+
+
+class Balancer:
+    '''
+    spreads the requests for a target over its node endpoints (a list of URLs as the target's "url")
+
+    with "balance" set to "round-robin" the endpoints take turns, with "least-latency" the endpoint
+    answering fastest (moving average) is used.  an endpoint failing "circuit-errors" times in a row
+    is left out (its circuit is open) for "circuit-reset" seconds, then tried again.  when every
+    endpoint is out, the one due back first is used
+    '''
+
+    _targets = dict()
+    _targets_lock = threading.Lock()
+
+    def __init__(self, urls, strategy="round-robin", errors=3, reset=30):
+        self.urls = list(urls)
+        self.strategy = strategy
+        self.errors = errors
+        self.reset = reset
+        self.latency = {u: None for u in self.urls}
+        self._failures = {u: 0 for u in self.urls}
+        self._open_until = {u: 0 for u in self.urls}
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_target(config, target):
+        '''
+        :return: the Balancer shared by everything using target
+        '''
+        with Balancer._targets_lock:
+            if target not in Balancer._targets:
+                Balancer._targets[target] = Balancer(get_urls(config, target), strategy=config.get("balance", "round-robin"),
+                                                     errors=config.get("circuit-errors", 3),
+                                                     reset=config.get("circuit-reset", 30))
+            return Balancer._targets[target]
+
+    def pick(self, exclude=()):
+        '''
+        :param exclude: endpoints already tried
+        :return: endpoint URL, or None when every endpoint is excluded
+        '''
+        now = time.monotonic()
+        with self._lock:
+            rest = [u for u in self.urls if u not in exclude]
+            if not rest:
+                return None
+            closed = [u for u in rest if self._open_until[u] <= now]
+            if not closed:
+                return min(rest, key=lambda u: self._open_until[u])
+
+            if self.strategy == "least-latency":
+                # endpoints not measured yet go first, so every endpoint gets measured
+                return min(closed, key=lambda u: (self.latency[u] is not None, self.latency[u] or 0))
+            url = closed[self._turn % len(closed)]
+            self._turn += 1
+            return url
+
+    def success(self, url, seconds=None):
+        '''
+        :param seconds: (optional) how long the endpoint took to answer
+        '''
+        with self._lock:
+            last = self.latency[url]
+            if seconds is not None:
+                self.latency[url] = seconds if last is None else 0.8 * last + 0.2 * seconds
+            self._failures[url] = 0
+            self._open_until[url] = 0
+
+    def failure(self, url):
+        with self._lock:
+            self._failures[url] += 1
+            if self._failures[url] < self.errors:
+                return
+            self._open_until[url] = time.monotonic() + self.reset
+        EZO.log.warn(blue("node {} failing, left out for {}s".format(url, self.reset)))
+
+
+class FailoverProvider(BaseProvider):
+    '''
+    web3 provider sending each request to an endpoint chosen by a Balancer, and on to the next
+    endpoint when one fails (connection errors and timeouts, not JSON-RPC errors)
+
+    filters only exist on the node that installed them, so filter requests go to that node and are
+    not failed over: the error tells the caller to install the filter again
+
+    accounts are unlocked on one node only, so the requests acting for an account (unlocking it, and
+    sending or signing from it) go to the node it was first used on.  when that node fails, the error
+    is returned and the account is released from it: its next unlock goes to another node, and the
+    sends after it follow
+    '''
+
+    FILTER_INSTALL = ("eth_newFilter", "eth_newBlockFilter", "eth_newPendingTransactionFilter")
+    FILTER_USE = ("eth_getFilterChanges", "eth_getFilterLogs", "eth_uninstallFilter")
+
+    # requests acting for an account, with the position of the account (or transaction dict) in their params
+    ACCOUNT = {"personal_unlockAccount": 0, "personal_lockAccount": 0, "personal_sendTransaction": 0,
+               "personal_sign": 1, "eth_sendTransaction": 0, "eth_sign": 0}
+
+    def __init__(self, balancer, config):
+        self.balancer = balancer
+        self.config = config
+        self._filters = dict()
+        self._accounts = dict()
+
+    def make_request(self, method, params):
+        if method in FailoverProvider.FILTER_USE and params and params[0] in self._filters:
+            return self._request(self._filters[params[0]], method, params)
+
+        account = FailoverProvider.account(method, params)
+        if account:
+            return self._for_account(account, method, params)
+
+        resp, url = self._failover(lambda w3: w3.provider.make_request(method, params))
+        if method in FailoverProvider.FILTER_INSTALL and "result" in resp:
+            self._filters[resp["result"]] = url
+        return resp
+
+    def batch(self, calls):
+        '''
+        rpc_batch through the chosen endpoint
+        '''
+
+        def send(w3):
+            results = rpc_batch(w3, calls)
+            if results and all(isinstance(err, Exception) for _, err in results):
+                raise results[0][1]
+            return results
+
+        try:
+            return self._failover(send)[0]
+        except Exception as e:
+            return [(None, e)] * len(calls)
+
+    @staticmethod
+    def account(method, params):
+        '''
+        :return: the account a request acts for, or None
+        '''
+        i = FailoverProvider.ACCOUNT.get(method)
+        if i is None or not params or len(params) <= i:
+            return None
+        account = params[i]
+        if isinstance(account, dict):
+            account = account.get("from")
+        return account.lower() if isinstance(account, str) else None
+
+    def _for_account(self, account, method, params):
+        url = self._accounts.get(account)
+        if url:
+            try:
+                return self._request(url, method, params)
+            except Exception:
+                self._accounts.pop(account, None)
+                # the account is only unlocked on that node, it moves with its next unlock
+                if method != "personal_unlockAccount":
+                    raise
+
+        resp, url = self._failover(lambda w3: w3.provider.make_request(method, params))
+        if "error" not in resp:
+            self._accounts[account] = url
+        return resp
+
+    def isConnected(self):
+        return any(w3.isConnected() for w3, err in (ProviderPool.get(u, self.config) for u in self.balancer.urls)
+                   if not err)
+
+    def _failover(self, request):
+        tried, last = list(), None
+        while True:
+            url = self.balancer.pick(exclude=tried)
+            if url is None:
+                raise last or ConnectionError("no node endpoints")
+            tried.append(url)
+            try:
+                return self._timed(url, request), url
+            except Exception as e:
+                last = e
+                EZO.log.debug(blue("request to {} failed: {}".format(url, e)))
+
+    def _request(self, url, method, params):
+        return self._timed(url, lambda w3: w3.provider.make_request(method, params))
+
+    def _timed(self, url, request):
+        w3, err = ProviderPool.get(url, self.config)
+        if err:
+            self.balancer.failure(url)
+            raise ConnectionError(err)
+
+        start = time.perf_counter()
+        try:
+            resp = request(w3)
+        except Exception:
+            self.balancer.failure(url)
+            raise
+        self.balancer.success(url, time.perf_counter() - start)
+        return resp
+
+
+class NonceManager:
+    '''
+    hands out the nonces for an account locally, so transactions from the account can be sent one
+    after the other without waiting for the previous one to be mined
+
+    the first nonce is read from the node (pending transaction count).  after a failed send the
+    nonce is no longer known, and is read again on the next use
+    '''
+
+    def __init__(self, w3, account):
+        self._w3 = w3
+        self.account = account
+        self._next = None
+        self._lock = threading.Lock()
+
+    def next(self):
+        '''
+        :return: nonce, err
+        '''
+        with self._lock:
+            if self._next is None:
+                try:
+                    self._next = self._w3.eth.getTransactionCount(self.account, "pending")
+                except Exception as e:
+                    return None, e
+            nonce = self._next
+            self._next += 1
+        return nonce, None
+
+    def resync(self):
+        with self._lock:
+            self._next = None
+
+
+class TxTracker:
+    '''
+    sends transactions with locally managed nonces, and watches them for their receipts in a
+    background thread, so neither the event loop nor a handler waits on a transaction being mined
+
+    the receipts of every pending transaction are requested together, in a single JSON-RPC batch,
+    once per new block.  a transaction not mined within the timeout ("tx-timeout" in ezo.conf) is
+    sent again with the same nonce and its gas price raised by "gas-bump", replacing the stuck one.
+    after "tx-max-resends" replacements, or once the gas price would pass "tx-max-gas-price" (wei),
+    the transaction is given up on and its Future fails with a TimeoutError
+
+    the caller gets a Future that resolves to the receipt of whichever version is mined.  threads
+    can wait on it, coroutines can await asyncio.wrap_future(f), or it can be ignored.  when a
+    record is passed with the transaction, it is saved under RESPONSE: with the gas used and the
+    seconds from sending to the receipt
+    '''
+
+    def __init__(self, w3, config, db=None):
+        self._w3 = w3
+        self._db = db
+        self.timeout = config.get("tx-timeout", 120)
+        self.bump = config.get("gas-bump", 1.125)
+        self.max_resends = config.get("tx-max-resends", 5)
+        self.max_price = config.get("tx-max-gas-price")
+        self.interval = config.get("receipt-poll-interval", 1)
+        self._nonces = dict()
+        self._pending = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._block = None
+
+    def nonces(self, account):
+        with self._lock:
+            if account not in self._nonces:
+                self._nonces[account] = NonceManager(self._w3, account)
+            return self._nonces[account]
+
+    def send(self, tx_dict, transact, record=None):
+        '''
+        sends a transaction with the next nonce for its account
+        :param tx_dict: transaction fields, "from" is required
+        :param transact: function sending the transaction dict and returning its hash
+        :param record: (optional) dict saved to the DB with the outcome, see track()
+        :return: Future resolving to the receipt, err
+        '''
+
+        nm = self.nonces(tx_dict["from"])
+        nonce, err = nm.next()
+        if err:
+            return None, err
+
+        tx_dict = dict(tx_dict, nonce=nonce)
+        try:
+            tx_hash = transact(tx_dict)
+        except Exception as e:
+            # the nonce was not used, the ones handed out after it are now out of sequence
+            nm.resync()
+            return None, e
+
+        return self.track(tx_hash, tx_dict, transact=transact, record=record), None
+
+    def track(self, tx_hash, tx_dict=None, transact=None, record=None):
+        '''
+        watches a sent transaction
+        :param tx_dict: the fields it was sent with
+        :param transact: the function it was sent with.  without it and tx_dict, it is never resent
+        :param record: (optional) dict saved under RESPONSE:<name>:<tx hash>: once mined, with "name"
+        naming the record, and "tx-hash", "gas-used", "status", "block" and "latency" added
+        :return: Future resolving to the receipt
+        '''
+        f = Future()
+        now = time.monotonic()
+        tx_hash = HexBytes(tx_hash)
+        with self._lock:
+            # every hash sent for the nonce is kept, replacements after the original
+            self._pending[tx_hash] = [f, tx_dict, transact, now, now, record, [tx_hash]]
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="ezo-tx-tracker", daemon=True)
+                self._thread.start()
+        return f
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def wait_timeout(self):
+        '''
+        :return: seconds after which every resend of a transaction has had its time to be mined
+        '''
+        return self.timeout * (self.max_resends + 1) + self.interval
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self._thread = None
+                        return
+                # an error in one pass must not stop the thread, or no Future resolves again
+                try:
+                    try:
+                        block = self._w3.eth.blockNumber
+                    except Exception as e:
+                        block = None
+                        EZO.log.debug(blue("error reading block number: {}".format(e)))
+                    if block is None or block != self._block:
+                        self._check()
+                        self._block = block
+                    self._resend_stuck()
+                except Exception as e:
+                    EZO.log.error(red("error tracking transactions: {}".format(e)))
+                time.sleep(self.interval)
+        finally:
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _check(self):
+        # the original may be mined rather than its replacement, so every version is polled
+        with self._lock:
+            sent = [(key, h) for key, e in self._pending.items() for h in e[6]]
+        results = rpc_batch(self._w3, [("eth_getTransactionReceipt", [h.hex()]) for _, h in sent])
+
+        for (key, tx_hash), (receipt, err) in zip(sent, results):
+            if err:
+                EZO.log.debug(blue("receipt for {} not available: {}".format(tx_hash.hex(), err)))
+            if not receipt:
+                continue
+            with self._lock:
+                entry = self._pending.pop(key, None)
+            if entry is None:
+                continue
+            f, _, _, first_sent, _, record, _ = entry
+            try:
+                receipt = format_receipt(receipt)
+                if record is not None:
+                    self._save(record, receipt, time.monotonic() - first_sent)
+            except Exception as e:
+                if not f.done():
+                    f.set_exception(e)
+                continue
+            # the caller may have cancelled the Future
+            if not f.done():
+                f.set_result(receipt)
+
+    def _save(self, record, receipt, latency):
+        if not self._db:
+            return
+        r = dict(record)
+        r["tx-hash"] = receipt["transactionHash"].hex()
+        r["gas-used"] = receipt["gasUsed"]
+        r["status"] = receipt.get("status")
+        r["block"] = receipt["blockNumber"]
+        r["latency"] = latency
+        r["timestamp"] = datetime.utcnow()
+        _, err = self._db.save(DB.pkey([EZO.RESPONSE, record["name"], r["tx-hash"]]), r, overwrite=True)
+        if err:
+            EZO.log.error(red("error saving response record: {}".format(err)))
+
+    def _resend_stuck(self):
+        now = time.monotonic()
+        with self._lock:
+            stuck = [(h, e) for h, e in self._pending.items()
+                     if e[1] is not None and e[2] is not None and now - e[4] >= self.timeout]
+
+        for key, entry in stuck:
+            tx_hash = entry[6][-1]
+            if len(entry[6]) > self.max_resends:
+                self._give_up(key, entry, "not mined after {} resends".format(len(entry[6]) - 1))
+                continue
+            try:
+                replacement, tx_dict = self._resend(tx_hash, entry[1], entry[2])
+            except Exception as e:
+                # the earlier transaction may have been mined in the meantime, keep watching it
+                EZO.log.warn(blue("error resending transaction {}: {}".format(tx_hash.hex(), e)))
+                entry[4] = time.monotonic()
+                continue
+            if replacement is None:
+                self._give_up(key, entry, "not mined at the maximum gas price {}".format(self.max_price))
+                continue
+
+            EZO.log.warn(blue("transaction {} not mined after {}s, resent as {} with gas price {}".format(
+                tx_hash.hex(), self.timeout, replacement.hex(), tx_dict["gasPrice"])))
+            with self._lock:
+                entry[1] = tx_dict
+                entry[4] = time.monotonic()
+                entry[6].append(replacement)
+
+    def _resend(self, tx_hash, tx_dict, transact):
+        price = tx_dict.get("gasPrice")
+        if price is None:
+            # the node chose the gas price
+            price = self._w3.eth.getTransaction(tx_hash)["gasPrice"]
+        new_price = int(math.ceil(price * self.bump))
+        if self.max_price is not None:
+            new_price = min(new_price, self.max_price)
+            if new_price <= price:
+                return None, tx_dict
+        tx_dict = dict(tx_dict, gasPrice=new_price)
+        return HexBytes(transact(tx_dict)), tx_dict
+
+    def _give_up(self, key, entry, reason):
+        with self._lock:
+            if self._pending.pop(key, None) is None:
+                return
+        f, tx_dict = entry[0], entry[1]
+        # the nonce may have been dropped by the node, read it again before the next send
+        self.nonces(tx_dict["from"]).resync()
+        EZO.log.error(red("transaction {} {}, giving up".format(key.hex(), reason)))
+        if not f.done():
+            f.set_exception(TimeoutError("transaction {} {}".format(key.hex(), reason)))
+
+
+def rpc_batch(w3, calls):
+    '''
+    makes several JSON-RPC calls.  over HTTP they are sent as one batch request, other providers
+    make them one by one.  results are raw JSON-RPC results, not formatted by web3
+    :param w3: Web3 instance
+    :param calls: list of (method, params)
+    :return: list of (result, err), in the order of calls
+    '''
+
+    if not calls:
+        return list()
+
+    provider = w3.provider
+    if isinstance(provider, FailoverProvider):
+        return provider.batch(calls)
+    if not isinstance(provider, HTTPProvider):
+        results = list()
+        for method, params in calls:
+            try:
+                resp = provider.make_request(method, params)
+            except Exception as e:
+                results.append((None, e))
+                continue
+            results.append((resp.get("result"), resp.get("error")))
+        return results
+
+    payload = [{"jsonrpc": "2.0", "id": i, "method": m, "params": p} for i, (m, p) in enumerate(calls)]
+    session = ProviderPool.session(provider.endpoint_uri) or requests
+    try:
+        r = session.post(provider.endpoint_uri, json=payload, **provider.get_request_kwargs())
+        r.raise_for_status()
+        responses = {resp.get("id"): resp for resp in r.json()}
+    except Exception as e:
+        return [(None, e)] * len(calls)
+
+    results = list()
+    for i in range(len(calls)):
+        resp = responses.get(i)
+        if resp is None:
+            results.append((None, "no response to batched call {}".format(calls[i][0])))
+        else:
+            results.append((resp.get("result"), resp.get("error")))
+    return results
+
+
+class UnlockSession:
+    '''
+    keeps accounts unlocked on the node for "unlock-duration" seconds, and only unlocks them again
+    once that has run out, instead of once per transaction
+    '''
+
+    def __init__(self, w3, duration=300):
+        self._w3 = w3
+        self.duration = duration
+        self._expires = dict()
+        self._lock = threading.Lock()
+
+    def unlock(self, account, password):
+        '''
+        :return: None, err
+        '''
+        with self._lock:
+            if time.monotonic() < self._expires.get(account, 0):
+                return None, None
+            try:
+                unlocked = self._w3.geth.personal.unlock_account(account, password, self.duration)
+            except Exception as e:
+                return None, e
+            if not unlocked:
+                return None, "unable to unlock account for {} using password".format(account)
+            # renewed a little early, so a transaction is never sent just as the account locks
+            self._expires[account] = time.monotonic() + self.duration * 0.9
+        return None, None
+
+    def expire(self, account):
+        with self._lock:
+            self._expires.pop(account, None)
+
+
+class GasCache:
+    '''
+    caches gas estimates for contract functions, so each response doesn't need an estimateGas call
+
+    estimates are keyed by (contract hash, function, size class of the arguments): calls with
+    arguments of similar size use similar gas.  the estimate returned has "gas-margin" added to it.
+    a transaction that runs out of gas drops the estimate it used
+    '''
+
+    def __init__(self, margin=0.25, size=1024):
+        self.margin = margin
+        self._lru = LRU(size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(contract_hash, function, params):
+        return (contract_hash, function, GasCache.size_class(params))
+
+    @staticmethod
+    def size_class(params):
+        '''
+        the total length of the variable size arguments (strings, bytes, lists), rounded up to a
+        power of two
+        '''
+        n = 0
+        for p in params or []:
+            if isinstance(p, (str, bytes, list, tuple)):
+                n += len(p)
+        return 1 << (n - 1).bit_length() if n else 0
+
+    def get(self, key):
+        with self._lock:
+            return self._lru.get(key)
+
+    def put(self, key, estimate):
+        '''
+        :return: the gas to use: the estimate with the margin added
+        '''
+        gas = int(math.ceil(estimate * (1 + self.margin)))
+        with self._lock:
+            self._lru[key] = gas
+        return gas
+
+    def invalidate(self, key):
+        with self._lock:
+            self._lru.pop(key, None)
+
+    def check(self, key, gas, receipt):
+        '''
+        drops the estimate if the transaction it was used for ran out of gas
+        :param receipt: Future resolving to the receipt
+        '''
+        if receipt.cancelled() or receipt.exception():
+            return
+        r = receipt.result()
+        if r.get("status") == 0 and r["gasUsed"] >= gas:
+            EZO.log.warn(blue("transaction {} ran out of gas, estimating {} again".format(
+                HexBytes(r["transactionHash"]).hex(), key[1])))
+            self.invalidate(key)
+
+
+class AccountPool:
+    '''
+    accounts that sign transactions in process, from keystore files ("keystores" in the target's
+    config), so nothing has to be unlocked on the node.  the keystores are decrypted once, with
+    the EZO_PASSWORD password
+
+    transactions are handed to the accounts in turn, so that each account's nonces are contended
+    by fewer transactions
+    '''
+
+    def __init__(self, w3, accounts):
+        self._w3 = w3
+        self.accounts = accounts
+        self._turn = 0
+        self._chain_id = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_config(w3, config, target, password):
+        '''
+        :return: AccountPool, or None when the target has no keystores, err
+        '''
+
+        keystores = get_keystores(config, target)
+        if not keystores:
+            return None, None
+
+        accounts = list()
+        for path in keystores:
+            try:
+                with open(os.path.expanduser(path)) as f:
+                    key = Account.decrypt(json.load(f), password)
+            except Exception as e:
+                return None, "unable to decrypt keystore {}: {}".format(path, e)
+            accounts.append(Account.privateKeyToAccount(key))
+        return AccountPool(w3, accounts), None
+
+    def next(self):
+        with self._lock:
+            account = self.accounts[self._turn % len(self.accounts)]
+            self._turn += 1
+        return account
+
+    def chain_id(self):
+        if self._chain_id is None:
+            self._chain_id = self._w3.eth.chainId
+        return self._chain_id
+
+    def transact(self, account, build):
+        '''
+        returns a function that signs and sends a transaction from account
+        :param build: function completing a transaction dict, such as a contract function's buildTransaction
+        '''
+
+        def send(tx_dict):
+            tx = dict(tx_dict)
+            if "gasPrice" not in tx:
+                tx["gasPrice"] = self._w3.eth.gasPrice
+            tx["chainId"] = self.chain_id()
+            signed = account.signTransaction(build(tx))
+            return self._w3.eth.sendRawTransaction(signed.rawTransaction)
+        return send
+
+
+class ContractEvent:
+
+    def __init__(self, rce, target):
+        self.timestamp = int(time.time())
+        self.address = rce["address"]
+        self.data = rce["data"]
+        self.log_index = rce["logIndex"]
+        self.tx = rce["transactionHash"]
+        self.topics = rce["topics"]
+        self.block_number = rce["blockNumber"]
+        self.event_topic = self.topics[0]
+        self.target = target
+        self.name = None
+        self.args = dict()
+
+    @staticmethod
+    def handler(rce, contract, target):
+
+        ce = ContractEvent(rce, target)
+
+        if contract.dispatch is None:
+            contract.dispatch, errors = DispatchTable.from_contract(contract)
+            for err in errors:
+                EZO.log.error(red(err))
+
+        # find the mappped method for the topic
+        handler, decoder, err = contract.dispatch.get(ce.event_topic)
+        if err:
+            EZO.log.warn(blue(err))
+            return
+
+        if decoder:
+            ce.name = decoder.name
+            ce.args, err = decoder.decode(rce)
+            if err:
+                EZO.log.error(red("error decoding event {}: {}".format(decoder.name, err)))
+                return
+        handler(ce, contract)
+
+
+class Contract:
+
+    def __init__(self, name, ezo):
+        self.name = name
+        self._ezo = ezo
+        self.timestamp = datetime.utcnow()
+        self.hash = None
+        self.abi  = None
+        self._bin  = None
+        self._source = None
+        self.te_map = dict()
+        self.contract_obj = None
+        self.build_key = None
+        # True when reused from a stored build, whose COMPILED record is already saved
+        self.built = False
+        self.checkpoint = None
+        self.handled = None
+        self.dispatch = None
+
+    # source and bytecode are stored apart from the contract record, and loaded on first access
+
+    @property
+    def source(self):
+        if self._source is None and self.hash:
+            self._source = self._load_blob(DB.pkey([EZO.SOURCE, self.hash]))
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        self._source = value
+
+    @property
+    def bin(self):
+        if self._bin is None and self.hash:
+            self._bin = self._load_blob(DB.pkey([EZO.BIN, self.name.replace('<stdin>:', ""), self.hash]))
+        return self._bin
+
+    @bin.setter
+    def bin(self, value):
+        self._bin = value
+
+    def _load_blob(self, key):
+        v, err = self._ezo.db.get(key)
+        if err:
+            EZO.log.error(red("error loading {}: {}".format(key, err)))
+            return None
+        return v
+
+    def deploy(self, target, overwrite=False):
+        '''
+        deploy this contract
+        :param target:
+        :param account:  the account address to use
+        :return: address, err
+        '''
+
+        name = self.name.replace('<stdin>:', "")
+        key = DB.pkey([EZO.DEPLOYED, name, target, self.hash])
+
+        if not target:
+            return None, "target network must be set with -t or --target"
+
+        # see if a deployment already exists for this contract on this target
+        if not overwrite:
+            res, err = self._ezo.db.get(key)
+            if err:
+                return None, "ERROR: Contract.deployment() {}".format(err)
+            if res:
+                return None, "deployment on {} already exists for contract {} use '--overwrite' to force".format(target, self.hash)
+
+        try:
+            ct = self._ezo.w3.eth.contract(abi=self.abi, bytecode=self.bin).constructor()
+        except Exception as e:
+            return None, e
+
+        account, transact, err = self._sender(target, ct.buildTransaction, ct.transact)
+        if err:
+            return None, err
+
+        try:
+            gas_estimate = ct.estimateGas({'from': account})
+            h = {'from': account, 'gas': gas_estimate + 1000}
+            pending, err = self._ezo.tracker.send(h, transact)
+            if err:
+                return None, err
+            try:
+                tx_receipt = pending.result(timeout=self._ezo.tracker.wait_timeout())
+            except WaitTimeout:
+                return None, "deployment transaction not mined after {}s".format(self._ezo.tracker.wait_timeout())
+            tx_hash = tx_receipt['transactionHash']
+            address = tx_receipt['contractAddress']
+
+        except Exception as e:
+            return None, e
+#        finally:
+#            self._ezo.w3.geth.personal.lock_account(account)
+
+        d = dict()
+        d["contract-name"] = self.name
+        d["hash"] = self.hash
+        d["tx-hash"] = tx_hash
+        d["address"] = address
+        d["gas-used"] = tx_receipt["gasUsed"]
+        d["target"] = target
+        d["timestamp"] = datetime.utcnow()
+
+        # save the deployment information and its indexes
+        with self._ezo.db.batch() as b:
+            _, err = Contract.save_deployment(b, key, d, overwrite=overwrite)
+            if err:
+                b.discard()
+        if b.err:
+            return None, b.err
+        if err:
+            return None, err
+
+        return address, None
+
+    @staticmethod
+    def delete(ezo, name, keep=0, dry_run=False):
+        '''
+        deletes the compiled versions of a contract, except the latest keep versions and the current
+        one.  with keep at 0, the contract itself is deleted too.  source blobs may be shared with other contracts
+        from the same file and are left in place
+        :param ezo: ezo instance
+        :param name: name of the Contract
+        :param keep: number of the latest compiled versions to keep
+        :param dry_run: report what would be deleted without deleting
+        :return: list of (key, bytes), err
+        '''
+
+        versions, err = ezo.db.stale(DB.pkey([EZO.COMPILED, name]), keep=keep)
+        if err:
+            return None, err
+
+        # the version the contract points to is kept, whatever its age -- a build reused from an
+        # earlier compile keeps its old timestamp
+        current = None
+        if keep > 0:
+            cp, err = ezo.db.get(DB.pkey([EZO.CONTRACT, name]))
+            if err:
+                return None, err
+            current = cp["hash"] if cp else None
+
+        keys = list()
+        for key, cp in versions:
+            if cp["hash"] == current:
+                continue
+            keys.append(key)
+            keys.append(DB.pkey([EZO.BIN, name, cp["hash"]]))
+        if keep <= 0:
+            keys.append(DB.pkey([EZO.CONTRACT, name]))
+
+        return ezo.db.delete_keys(keys, dry_run=dry_run)
+
+    @staticmethod
+    def delete_deployments(ezo, name, target=None, dry_run=False):
+        '''
+        deletes the deployments of a contract, on one target or on all of them, with their index entries
+        :param ezo: ezo instance
+        :param name: name of the Contract
+        :param target: (optional) the target network
+        :param dry_run: report what would be deleted without deleting
+        :return: list of (key, bytes), err
+        '''
+
+        prefix = DB.pkey([EZO.DEPLOYED, name, target]) if target else DB.pkey([EZO.DEPLOYED, name])
+        deploys, err = ezo.db.stale(prefix)
+        if err:
+            return None, err
+
+        keys = list()
+        for key, d in deploys:
+            _, _, t, h = key.split(':')[:4]
+            keys.append(key)
+            keys.append(DB.pkey([EZO.BY_ADDRESS, t, d["address"].lower()]))
+            keys.append(DB.pkey([EZO.BY_TARGET, t, name, h]))
+            keys.append(DB.pkey([EZO.BY_HASH, h, t, name]))
+
+        return ezo.db.delete_keys(keys, dry_run=dry_run)
+
+    @staticmethod
+    def save_deployment(batch, key, d, overwrite=False):
+        '''
+        stages a deployment record with its address, target and hash index entries
+        :param batch: the DB Batch to stage the writes in
+        :param key: the DEPLOYED key of the deployment
+        :param d: the deployment record
+        :return: key, err
+        '''
+
+        name = d["contract-name"].replace('<stdin>:', "")
+
+        # drop the address index of the deployment being replaced
+        if overwrite:
+            old, err = batch.get(key)
+            if err:
+                return None, err
+            if old and old["address"].lower() != d["address"].lower():
+                batch.delete(DB.pkey([EZO.BY_ADDRESS, old["target"], old["address"].lower()]))
+
+        ks, err = batch.save(key, d, overwrite=overwrite)
+        if err:
+            return None, err
+
+        pk = key.decode('utf-8')
+        for ik in [DB.pkey([EZO.BY_ADDRESS, d["target"], d["address"].lower()]),
+                   DB.pkey([EZO.BY_TARGET, d["target"], name, d["hash"]]),
+                   DB.pkey([EZO.BY_HASH, d["hash"], d["target"], name])]:
+            _, err = batch.save(ik, pk, overwrite=True)
+            if err:
+                return None, err
+
+        return ks, None
+
+    async def listen(self, address, target, dispatcher=None):
+        '''
+        starts event listener for the contract.  to listen to several contracts on a target, run one
+        Listener for all of them instead
+        :param dispatcher: (optional) Dispatcher to queue events on.  without one, events are handled inline
+        :return:
+        '''
+
+        if not address:
+            return None, "listening address not provided"
+
+        listener = Listener(self._ezo, target)
+        _, err = listener.add(address, self)
+        if err:
+            return None, err
+        return await listener.run(dispatcher)
+
+    async def received(self, event, target, dispatcher=None):
+        '''
+        takes an event for this contract from a listener.  events at or before the last one seen,
+        and events already handled, are dropped.  an event removed by a reorg rewinds the checkpoint,
+        so the event is handled again if it is mined in another block
+        '''
+
+        cp = self.checkpoint
+        handled = self.handled
+
+        if event.get("removed"):
+            EZO.log.warn(blue("event removed by reorg: tx {} log {} in block {}".format(
+                HexBytes(event["transactionHash"]).hex(), event["logIndex"], event["blockNumber"])))
+            if handled:
+                handled.rollback(event)
+            if cp:
+                cp.rewind(event)
+            return
+
+        if cp and not cp.seen(event):
+            return
+        if handled and not handled.claim(event):
+            EZO.log.debug(bright("event already handled: {}".format(event)))
+            if cp:
+                cp.done(event)
+            return
+
+        if EZO.log:
+            EZO.log.debug(bright("event received: {}".format(event)))
+
+        def done(rce):
+            if handled:
+                handled.done(rce)
+            if cp:
+                cp.done(rce)
+        if dispatcher:
+            await dispatcher.put(event, self, target, done=done)
+        else:
+            ContractEvent.handler(event, self, target)
+            done(event)
+
+    def response(self, response_data, wait=False):
+        '''
+        called by the event handler with the result data
+
+        the transaction is sent without waiting for the ones before it from the same account to be
+        mined, and its gas used and latency are recorded under RESPONSE: (see TxTracker)
+        :param response_data: result data
+        :param wait: wait for the transaction to be mined
+        :return: receipt if waiting, else a Future resolving to the receipt, err
+        '''
+
+        if "address" not in response_data:
+            return None, "address missing from response_data payload"
+        if "function" not in response_data:
+            return None, "method missing from response_data payload"
+        if "params" not in response_data:
+            return None, "params missing from response_data payload"
+        if "target" not in response_data:
+            return None, "target missing from response_data payload"
+
+
+        address = self._ezo.w3.toChecksumAddress(response_data["address"])
+
+        if not self.contract_obj:
+            try:
+                self.contract_obj = self._ezo.w3.eth.contract(address=address, abi=self.abi)
+            except Exception as e:
+                return None, e
+
+        method = response_data["function"]
+        params = response_data["params"] or list()
+        contract_func = self.contract_obj.functions[method](*params)
+
+        account, transact, err = self._sender(response_data["target"], contract_func.buildTransaction,
+                                              contract_func.transact)
+        if err:
+            return None, err
+
+        tx_dict = dict()
+        tx_dict["from"] = account
+
+        gas_key = GasCache.key(self.hash, method, params)
+        tx_dict["gas"] = self._ezo.gas.get(gas_key)
+        if tx_dict["gas"] is None:
+            try:
+                tx_dict["gas"] = self._ezo.gas.put(gas_key, contract_func.estimateGas({"from": account}))
+            except Exception as e:
+                return None, "error estimating gas: {}".format(e)
+
+        record = {"name": self.name.replace('<stdin>:', ""), "function": method, "address": address,
+                  "target": response_data["target"]}
+        receipt, err = self._ezo.tracker.send(tx_dict, transact, record=record)
+        if err:
+            # a locked account fails the send, unlock it again next time
+            self._ezo.unlocks.expire(account)
+            return None, "error executing transaction: {}".format(err)
+        receipt.add_done_callback(lambda f: self._ezo.gas.check(gas_key, tx_dict["gas"], f))
+        if not wait:
+            return receipt, None
+
+        try:
+            return receipt.result(timeout=self._ezo.tracker.wait_timeout()), None
+        except WaitTimeout:
+            return None, "error executing transaction: not mined after {}s".format(self._ezo.tracker.wait_timeout())
+        except Exception as e:
+            return None, "error executing transaction: {}".format(e)
+
+    def _sender(self, target, build, node_transact):
+        '''
+        picks the account a transaction is sent from: the next account of the AccountPool, signing
+        locally, or the target's account, unlocked on the node
+        :param build: function completing the transaction dict, for local signing
+        :param node_transact: function sending the transaction dict through the node
+        :return: account address, function sending the transaction dict, err
+        '''
+
+        if self._ezo.accounts:
+            signer = self._ezo.accounts.next()
+            return signer.address, self._ezo.accounts.transact(signer, build), None
+
+        account = self._ezo.w3.toChecksumAddress(get_account(self._ezo.config, target))
+
+        password = os.environ['EZO_PASSWORD'] if 'EZO_PASSWORD' in os.environ else None
+        _, err = self._ezo.unlocks.unlock(account, password)
+        if err:
+            return None, None, err
+        return account, node_transact, None
+
+    def save(self, overwrite=False, batch=None):
+        '''
+        saves the compiled contract, both as a COMPILED version and as the latest CONTRACT.  a contract
+        reused from a stored build only becomes the latest CONTRACT again
+        :param overwrite: overwrite an existing COMPILED record for the same source
+        :param batch: (optional) a DB Batch to stage the writes in, instead of writing them immediately
+        :return: key, err
+        '''
+
+        if not batch:
+            with self._ezo.db.batch() as b:
+                ks, err = self.save(overwrite=overwrite, batch=b)
+                if err:
+                    b.discard()
+            if b.err:
+                return None, b.err
+            return ks, err
+
+        if self._source is not None:
+            self.hash = get_hash(self._source)
+
+        c = dict()
+        c["name"] = self.name
+        c["abi"] = self.abi
+        c["hash"] = self.hash
+        c["timestamp"] = self.timestamp
+        # topics are stored as hex strings so the record stays codec neutral
+        c["te-map"] = {HexBytes(k).hex(): v for k, v in self.te_map.items()}
+
+        # save to compiled contract -- a contract reused from a stored build is already saved
+        name = self.name.replace('<stdin>:',"")
+        if not self.built:
+            key = DB.pkey([EZO.COMPILED, name, c["hash"]])
+            ks, err = batch.save(key, c, overwrite=overwrite)
+            if err:
+                return None, err
+
+        # save to contract
+        key = DB.pkey([EZO.CONTRACT, name])
+        ks, err = batch.save(key, c, overwrite=True)
+        if err:
+            return None, err
+
+        if self.built:
+            return ks, None
+
+        # save the source and bytecode blobs, if they were loaded
+        if self._source is not None:
+            _, err = batch.save(DB.pkey([EZO.SOURCE, self.hash]), self._source, overwrite=True)
+            if err:
+                return None, err
+        if self._bin is not None:
+            _, err = batch.save(DB.pkey([EZO.BIN, name, self.hash]), self._bin, overwrite=True)
+            if err:
+                return None, err
+
+        return ks, None
+
+    def generate_event_handlers(self, overwrite=False):
+
+        # get the contract name, events from the abi
+        contract_name = inflection.underscore(self.name.replace('<stdin>:', ''))
+        errors = list()
+
+        events = [x for x in self.abi if x["type"] == "event"]
+
+        for event in events:
+            #     get the topic sha3
+            topic = Web3.keccak(text=get_topic_sha3(event))
+
+            #     build full path to new event handler
+            hp = get_handler_path(self._ezo.config, contract_name)
+            if not os.path.isdir(hp):
+                os.mkdir(hp)
+            event_name = inflection.underscore(event['name'])
+            eh = "{}/{}_{}".format(hp, event_name, "handler.py")
+
+            #     check to see if it exists
+            #     if not, or if overwrite option is on
+            if not os.path.exists(eh) or overwrite:
+
+                # create event handler scaffold in python
+                code, err = gen_event_handler_code(event_name)
+                if err:
+                    print(red("gen error: {}".format(err)))
+                try:
+                    with open(eh, "w+") as f:
+                        f.write(code)
+
+                except Exception as e:
+                    print(red("gen error: {}".format(e)))
+                    errors.append(e)
+                    continue
+
+            #  map the topic to the handler
+            self.te_map[topic] = eh
+            self.dispatch = None
+
+        _, err = self.save(overwrite=True)
+        if err:
+            return None, err
+        return None, errors
+
+
+    def paramsForMethod(self, method, data):
+        '''
+
+        '''
+
+        v = ast.literal_eval(data)
+        if not v:
+            return None
+        return v
+
+
+    @staticmethod
+    def send(ezo, name, method, data, target):
+        '''
+        runs a transaction on a contract method
+        :param ezo:  ezo instance
+        :param name:  name of the Contract
+        :param method:  name of the contract method
+        :param data: formatted data to send to the contract method
+        :return:
+        '''
+
+        # load the contract by name
+        c, err = Contract.get(name, ezo)
+        if err:
+            return None, err
+
+        address, err = Contract.get_address(name, c.hash, ezo.db, target)
+        if err:
+            return None, err
+
+        d = dict()
+        d["address"] = address
+        d["function"] = method
+        d["params"] = c.paramsForMethod(method, data)
+        d["target"] = target
+
+
+        resp, err = c.response(d, wait=True)
+        if err:
+            return None, err
+
+        return resp, None
+
+    @staticmethod
+    def call(ezo, name, method, data, target):
+        '''
+        calls a method with data and returns a result without changing the chain state
+        :param ezo:  ezo instance
+        :param name:  name of the Contract
         :param method:  name of the contract method
         :param data: formatted data to send to the contract method
         :param target: the target network
@@ -529,6 +2238,89 @@ class Contract:
         return result, None
 
 
+    @staticmethod
+    def call_many(ezo, calls, target, block=None):
+        '''
+        makes many read-only calls, sent to the node in JSON-RPC batches of "call-batch-size"
+        :param ezo:  ezo instance
+        :param calls: list of (contract name, method name, params), params a list, or formatted data
+        as for call()
+        :param target: the target network
+        :param block: (optional) block number all calls read from, for a consistent view.  defaults to latest
+        :return: list of (result, err) in the order of calls, err
+        '''
+
+        account = ezo.w3.toChecksumAddress(get_account(ezo.config, target))
+        block_id = hex(block) if block is not None else "latest"
+
+        contracts, decoders = dict(), dict()
+        pending, results = list(), [None] * len(calls)
+        for n, (name, method, params) in enumerate(calls):
+            if name not in contracts:
+                contracts[name] = Contract._callable(ezo, name, target)
+            c, err = contracts[name]
+            if err:
+                results[n] = (None, err)
+                continue
+
+            try:
+                if isinstance(params, str):
+                    params = c.paramsForMethod(method, params)
+                data = c.contract_obj.encodeABI(fn_name=method, args=params or [])
+                if (name, method) not in decoders:
+                    outputs = c.contract_obj.get_function_by_name(method).abi["outputs"]
+                    decoders[(name, method)] = TupleDecoder(
+                        decoders=[abi_registry.get_decoder(o["type"]) for o in outputs])
+            except Exception as e:
+                results[n] = (None, "error encoding call {}.{}: {}".format(name, method, e))
+                continue
+
+            tx = {"from": account, "to": c.contract_obj.address, "data": data}
+            pending.append((n, decoders[(name, method)], ("eth_call", [tx, block_id])))
+
+        size = ezo.config.get("call-batch-size", 100)
+        for i in range(0, len(pending), size):
+            chunk = pending[i:i + size]
+            replies = rpc_batch(ezo.w3, [r for _, _, r in chunk])
+            for (n, decoder, _), (reply, err) in zip(chunk, replies):
+                if err:
+                    results[n] = (None, "error executing call: {}".format(err))
+                    continue
+                try:
+                    values = decoder(ContextFramesBytesIO(HexBytes(reply)))
+                except Exception as e:
+                    results[n] = (None, "error decoding call result: {}".format(e))
+                    continue
+                # a single output is returned as is, like call()
+                results[n] = (values[0] if len(values) == 1 else list(values)), None
+
+        return results, None
+
+    @staticmethod
+    def _callable(ezo, name, target):
+        '''
+        loads a contract with its contract object for its deployment on target
+        :return: Contract, err
+        '''
+
+        c, err = Contract.get(name, ezo)
+        if err:
+            return None, err
+        if not c:
+            return None, "contract {} not found".format(name)
+
+        address, err = Contract.get_address(name, c.hash, ezo.db, target)
+        if err:
+            return None, err
+        if not address:
+            return None, "contract {} is not deployed on {}".format(name, target)
+
+        try:
+            c.contract_obj = ezo.w3.eth.contract(address=ezo.w3.toChecksumAddress(address), abi=c.abi)
+        except Exception as e:
+            return None, e
+        return c, None
+
     @staticmethod
     def get(name, ezo):
         '''
@@ -546,17 +2338,27 @@ class Contract:
         if not cp:
             return None, None
 
-        # create a new Contract
+        return Contract.from_record(cp, ezo), None
+
+
+    @staticmethod
+    def from_record(cp, ezo):
+        '''
+        creates a Contract from a stored contract record.  source and bytecode are loaded lazily,
+        unless the record predates the split and still carries them
+        :param cp: the contract record
+        :param ezo: ezo instance
+        :return: Contract
+        '''
+
         c = Contract(cp["name"], ezo)
         c.abi = cp["abi"]
-        c.bin = cp["bin"]
         c.hash = cp["hash"]
-        c.source = cp["source"]
+        c.bin = cp.get("bin")
+        c.source = cp.get("source")
         c.timestamp = cp["timestamp"]
-        c.te_map = cp['te-map']
-
-        return c, None
-
+        c.te_map = {HexBytes(k): v for k, v in cp['te-map'].items()}
+        return c
 
     @staticmethod
     def create_from_hash(hash, ezo):
@@ -571,16 +2373,7 @@ class Contract:
         if err:
             return None, err
 
-        # create a new Contract
-        c = Contract(cp["name"], ezo)
-        c.abi = cp["abi"]
-        c.bin = cp["bin"]
-        c.hash = cp["hash"]
-        c.source = cp["source"]
-        c.timestamp = cp["timestamp"]
-        c.te_map = cp['te-map']
-
-        return c, None
+        return Contract.from_record(cp, ezo), None
 
     @staticmethod
     def load(filepath):
@@ -599,28 +2392,146 @@ class Contract:
         return source, None
 
     @staticmethod
-    def compile(source, ezo):
+    def compile(source, ezo, **options):
         '''
-        compiles the source code
+        compiles the source code.  if the same source was already compiled with the same solc binary
+        and options, the stored abi and bytecode are reused and solc is not run
 
         :param source: (string) - contract source code
         :param ezo: - ezo reference for Contract object creation
+        :param options: - extra py-solc compile_source options
         :return: (list) compiled source
         '''
-        try:
-            compiled = compile_source(source)
-            compiled_list = []
-            for name in compiled:
-                c = Contract(name, ezo)
-                interface = compiled[name]
-                c.abi = interface['abi']
-                c.bin = interface['bin']
-                compiled_list.append(c)
 
+        build_key = Contract.build_key(source, options)
+        compiled_list, err = Contract.from_build(build_key, ezo)
+        if err:
+            return None, err
+        if compiled_list:
+            if EZO.log:
+                EZO.log.info(cyan("source unchanged, reusing compiled contracts {}".format(build_key)))
+            return compiled_list, None
+
+        try:
+            compiled = compile_source(source, **options)
         except Exception as e:
             return None, e
+        return Contract.from_compiled(compiled, ezo, build_key), None
+
+    @staticmethod
+    def compile_many(sources, ezo, workers=None, **options):
+        '''
+        compiles several sources, running solc for the ones without a stored build in a pool of
+        worker processes
+
+        :param sources: list of (filename, source)
+        :param ezo: - ezo reference for Contract object creation
+        :param workers: number of solc processes to run at once (defaults to the cpu count)
+        :param options: - extra py-solc compile_source options
+        :return: list of (filename, contracts, seconds) in the order given, err
+        '''
+
+        results = dict()
+        pending = list()
+        for filename, source in sources:
+            start = time.perf_counter()
+            build_key = Contract.build_key(source, options)
+            contracts, err = Contract.from_build(build_key, ezo)
+            if err:
+                return None, err
+            if contracts:
+                results[filename] = (contracts, time.perf_counter() - start)
+            else:
+                pending.append((filename, source, build_key))
+
+        if len(pending) == 1:
+            filename, source, build_key = pending[0]
+            compiled, err, seconds = _compile_source(source, options)
+            if err:
+                return None, "{}: {}".format(filename, err)
+            results[filename] = (Contract.from_compiled(compiled, ezo, build_key), seconds)
+
+        elif pending:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [(filename, build_key, pool.submit(_compile_source, source, options))
+                           for filename, source, build_key in pending]
+                for filename, build_key, f in futures:
+                    compiled, err, seconds = f.result()
+                    if err:
+                        return None, "{}: {}".format(filename, err)
+                    results[filename] = (Contract.from_compiled(compiled, ezo, build_key), seconds)
+
+        return [(filename,) + results[filename] for filename, _ in sources], None
+
+    @staticmethod
+    def from_compiled(compiled, ezo, build_key=None):
+        '''
+        creates Contracts from py-solc compile_source output
+        '''
+        compiled_list = []
+        for name in compiled:
+            c = Contract(name, ezo)
+            interface = compiled[name]
+            c.abi = interface['abi']
+            c.bin = interface['bin']
+            c.build_key = build_key
+            compiled_list.append(c)
+        return compiled_list
+
+    @staticmethod
+    def build_key(source, options=None):
+        '''
+        key of the build record for a source, compiler binary and set of compile options
+        '''
+        opts = get_hash(json.dumps(options or {}, sort_keys=True))
+        return DB.pkey([EZO.BUILD, get_hash(source), get_compiler_id(), opts])
+
+    @staticmethod
+    def from_build(build_key, ezo):
+        '''
+        rebuilds the compiled contracts of a build record from the stored contract versions
+        :return: list of Contracts, or None if there is no complete build, err
+        '''
+
+        names, err = ezo.db.get(build_key)
+        if err or not names:
+            return None, err
+
+        source_hash = build_key.decode('utf-8').split(':')[1]
+        compiled_list = []
+        for name in names:
+            short = name.replace('<stdin>:', "")
+            cp, err = ezo.db.get(DB.pkey([EZO.COMPILED, short, source_hash]))
+            if err:
+                return None, err
+            bin, err = ezo.db.get(DB.pkey([EZO.BIN, short, source_hash]))
+            if err:
+                return None, err
+            if not cp or bin is None:
+                # a version was deleted since -- compile again
+                return None, None
+
+            # the handler map and timestamp of the stored version are kept, since it is saved again as is
+            c = Contract(name, ezo)
+            c.abi = cp["abi"]
+            c.bin = bin
+            c.timestamp = cp["timestamp"]
+            c.te_map = {HexBytes(k): v for k, v in cp.get("te-map", dict()).items()}
+            c.build_key = build_key
+            c.built = True
+            compiled_list.append(c)
+
         return compiled_list, None
 
+    @staticmethod
+    def save_build(batch, contracts):
+        '''
+        stages the build record for contracts compiled together from one source
+        '''
+        if not contracts or not getattr(contracts[0], "build_key", None):
+            return None, None
+        return batch.save(contracts[0].build_key, [c.name for c in contracts], overwrite=True)
+
     @staticmethod
     def get_address(name, hash, db, target=None):
         '''
@@ -641,6 +2552,19 @@ class Contract:
         return d['address'].lower(), None
 
 
+def _compile_source(source, options):
+    '''
+    runs solc on one source.  module level so it can run in a compile worker process
+    :return: compiled output, err, seconds
+    '''
+    start = time.perf_counter()
+    try:
+        compiled = compile_source(source, **options)
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+    return compiled, None, time.perf_counter() - start
+
+
 class Catalog:
     '''
     a filesystem catalog for ABIs
@@ -706,12 +2630,311 @@ class Catalog:
         return abi, None
 
 
+def _parse_datetime(s):
+    '''
+    parses naive datetime.isoformat output (YYYY-MM-DDTHH:MM:SS[.ffffff]) by position, which is several
+    times faster than strptime.  datetime.fromisoformat would be as fast, but needs python 3.7
+    '''
+    if len(s) == 19 or (len(s) == 26 and s[19] == "."):
+        return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                        int(s[20:26]) if len(s) == 26 else 0)
+    return datetime.strptime(s, "%Y-%m-%dT%H:%M:%S.%f" if "." in s else "%Y-%m-%dT%H:%M:%S")
+
+
+class JsonCodec:
+    '''
+    compact JSON codec for stored records
+
+    datetime, HexBytes and bytes values are typed so they decode to the same types.  in a record's
+    top level dict (where ezo keeps them: timestamp, tx-hash) they are stored as plain strings, named
+    with their type in a "__t__" field, and converted after parsing.  anywhere deeper they are stored
+    as tagged objects ({"__dt__": ...}), which need a (slower) per-dict hook while parsing, so the
+    hook is only used when a payload contains one.  payloads larger than compress_over bytes
+    (e.g. COMPILED records carrying source and bytecode) are zlib compressed and stored under a
+    separate version byte
+    '''
+
+    VERSION = 1
+    VERSION_ZLIB = 2
+    compress_over = 512
+
+    TAG = b'{"__'
+    _types = ((datetime, "dt", datetime.isoformat), (HexBytes, "hex", HexBytes.hex),
+              ((bytes, bytearray), "b", lambda v: bytes(v).hex()))
+    _from = {"dt": _parse_datetime, "hex": HexBytes, "b": bytes.fromhex}
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, datetime):
+            return {"__dt__": obj.isoformat()}
+        if isinstance(obj, HexBytes):
+            return {"__hex__": obj.hex()}
+        if isinstance(obj, (bytes, bytearray)):
+            return {"__b__": bytes(obj).hex()}
+        raise TypeError("{} is not serializable".format(type(obj)))
+
+    @staticmethod
+    def _hook(d):
+        if len(d) == 1:
+            if "__dt__" in d:
+                return _parse_datetime(d["__dt__"])
+            if "__hex__" in d:
+                return HexBytes(d["__hex__"])
+            if "__b__" in d:
+                return bytes.fromhex(d["__b__"])
+        return d
+
+    @classmethod
+    def _flatten(cls, value):
+        if not isinstance(value, dict):
+            return value
+        flat, types = None, dict()
+        for k, v in value.items():
+            for t, name, to_str in cls._types:
+                if isinstance(v, t):
+                    if flat is None:
+                        flat = dict(value)
+                    flat[k] = to_str(v)
+                    types[k] = name
+                    break
+        if flat is None:
+            return value
+        flat["__t__"] = types
+        return flat
+
+    @classmethod
+    def encode(cls, value):
+        v = json.dumps(cls._flatten(value), separators=(',', ':'), default=cls._default).encode('utf-8')
+        if len(v) > cls.compress_over:
+            return bytes([cls.VERSION_ZLIB]) + zlib.compress(v)
+        return bytes([cls.VERSION]) + v
+
+    @classmethod
+    def decode(cls, version, payload):
+        if version == cls.VERSION_ZLIB:
+            payload = zlib.decompress(payload)
+        if cls.TAG in payload:
+            value = json.loads(payload, object_hook=cls._hook)
+        else:
+            value = json.loads(payload)
+        if isinstance(value, dict) and "__t__" in value:
+            for k, name in value.pop("__t__").items():
+                value[k] = cls._from[name](value[k])
+        return value
+
+
+class PickleCodec:
+    '''
+    pickle codec, kept for compatibility.  values written before codecs were versioned are raw
+    pickles, and are recognized by the pickle protocol marker
+    '''
+
+    VERSION = 3
+    PROTOCOL_MARKER = 0x80
+
+    @classmethod
+    def encode(cls, value):
+        return bytes([cls.VERSION]) + pickle.dumps(value)
+
+    @classmethod
+    def decode(cls, version, payload):
+        return pickle.loads(payload)
+
+
+class Cache:
+    '''
+    bounded LRU cache placed in front of the DB
+
+    entries are evicted least-recently-used when the cache is full, and expire after a time-to-live.
+    the ttl can be set per key prefix, so immutable records (COMPILED) are kept until evicted, while
+    records that another process may rewrite (DEPLOYED) are dropped quickly.
+
+    a ttl of None caches forever, a ttl of 0 disables caching for that prefix.
+
+    hits, misses and evictions are counted, see stats()
+    '''
+
+    def __init__(self, size=1024, ttl=60, policies=None):
+        self.size = size
+        self.ttl = ttl
+        self.policies = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lru = LRU(size, callback=self._evicted)
+
+        if policies is None:
+            policies = {EZO.COMPILED: None, EZO.DEPLOYED: 10}
+        for prefix, pttl in policies.items():
+            if isinstance(prefix, str):
+                prefix = bytes(prefix, 'utf-8')
+            self.policies[prefix] = pttl
+
+    def _evicted(self, key, value):
+        self.evictions += 1
+
+    def _ttl_for(self, key):
+        for prefix, ttl in self.policies.items():
+            if key.startswith(prefix):
+                return ttl
+        return self.ttl
+
+    def get(self, key):
+        '''
+        returns the cached value, or None if missing or expired
+        '''
+        entry = self._lru.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            # another thread may have dropped it already
+            self._lru.pop(key, None)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        ttl = self._ttl_for(key)
+        if ttl == 0:
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._lru[key] = (value, expires)
+
+    def invalidate(self, key):
+        self._lru.pop(key, None)
+
+    def clear(self):
+        self._lru.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __len__(self):
+        return len(self._lru)
+
+    def stats(self):
+        return {"size": len(self._lru), "max-size": self.size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    @staticmethod
+    def from_config(cfg):
+        '''
+        builds a cache from the "db-cache" section of ezo.conf
+        '''
+        if not cfg:
+            return Cache()
+        return Cache(size=cfg.get("size", 1024), ttl=cfg.get("ttl", 60), policies=cfg.get("policies"))
+
+
+class Batch:
+    '''
+    a group of writes committed to the DB in a single LevelDB write batch
+
+    created by DB.batch().  saves are staged in memory and written atomically when the batch
+    completes.  if any save fails, or discard() is called, nothing is written.
+
+    errors (including errors opening the DB) are kept in err, and returned from save()
+    '''
+
+    def __init__(self, db):
+        self._db = db
+        self._pending = dict()
+        self.err = None
+        self.discarded = False
+
+    def save(self, key, value, overwrite=False, serialize=True):
+
+        if self.err:
+            return None, self.err
+
+        if isinstance(key, str):
+            key = bytes(key, 'utf-8')
+
+        if not overwrite:
+            a, err = self.get(key)
+            if err:
+                return None, err
+            if a is not None:
+                return None, "{} already exists ".format(key)
+
+        try:
+            v = DB.encode(value) if serialize else value
+        except Exception as e:
+            return None, "DB.batch error: {}".format(e)
+        self._pending[key] = value
+        self._wb.put(key, v)
+        return key, None
+
+    def get(self, key):
+        '''
+        reads a key, seeing saves and deletes already staged in this batch
+        '''
+
+        if isinstance(key, str):
+            key = bytes(key, 'utf-8')
+
+        if self.err:
+            return None, self.err
+        if key in self._pending:
+            return self._pending[key], None
+
+        cached = DB.cache.get(key)
+        if cached is not None:
+            return cached, None
+
+        try:
+            val = DB.db.get(key)
+            return (DB.decode(val) if val else None), None
+        except Exception as e:
+            return None, e
+
+    def delete(self, key):
+
+        if isinstance(key, str):
+            key = bytes(key, 'utf-8')
+
+        if self.err:
+            return None, self.err
+
+        self._pending[key] = None
+        self._wb.delete(key)
+        return key, None
+
+    def discard(self):
+        self.discarded = True
+
+
 class DB:
     '''
     data storage abstraction layer for LevelDB
 
-    the db is opened and closed on demand.  this allows multiple applications to use the same
-    DB at the same time.  a pseudo lock-wait mechanism is implemented in the open method).
+    the db is opened and closed on demand by default.  this allows multiple applications to use the same
+    DB at the same time.  a pseudo lock-wait mechanism is implemented in the open method).  within the
+    process, the handle is shared: threads opening it while it is open reuse it, and it is closed when
+    the last of them closes it
+
+    in persistent mode ("db-persistent" in ezo.conf), a single long-lived LevelDB handle is shared by
+    every DB instance in the process.  each instance holds a reference to the handle, and the handle is
+    closed when the last reference is released with shutdown().  use it when ezo is the only process
+    using the DB (e.g. oracle mode);  open-on-demand remains the fallback for multi-process use.
+
+    the storage backend is LevelDB by default.  with "db-backend": "sqlite" in ezo.conf, a SQLite
+    database in WAL mode is used instead (see core.stores), which lets one writer and any number of
+    readers in other processes use the DB at the same time, without the lock-and-retry wait.
 
     a caching object is placed ahead of and behind get method reads and behind save method writes.  This keeps
     oracle mode from having to hit leveldb very often at all.
@@ -721,35 +2944,77 @@ class DB:
     db = None
     project = None
     dbpath = None
-    cache = dict()
+    cache = None
+    persistent = False
+    codec = JsonCodec
+    codecs = {"json": JsonCodec, "pickle": PickleCodec}
+    backend = plyvel.DB
+    backends = {"leveldb": plyvel.DB, "sqlite": SQLiteDB}
+
+    # shared backend handle and reference count for persistent mode
+    _handle = None
+    _refs = 0
 
-    def __init__(self, project, dbpath=None):
+    # number of open() calls not yet closed in on-demand mode, guarded by _lock
+    _opens = 0
+    _lock = threading.RLock()
+
+    def __init__(self, project, dbpath=None, persistent=False, cache=None, codec=None, backend=None):
 
         DB.dbpath = dbpath if dbpath else '~/ezodb/'
         DB.project = project if project else 'ezo_project_default'
+        DB.persistent = persistent
+        DB.codec = DB.codecs.get(codec, JsonCodec) if codec else JsonCodec
+        DB.backend = DB.backends.get(backend, plyvel.DB) if backend else plyvel.DB
+        if cache is not None or DB.cache is None:
+            DB.cache = Cache.from_config(cache)
+        self._owner = False
+
+        if persistent:
+            with DB._lock:
+                DB._refs += 1
+            self._owner = True
 
     def open(self):
         '''
         attempts to open the database.  if it gets a locked message, it will wait one second and try
         again.  if it is still locked, it will return an error
+
+        in persistent mode, the shared handle is opened once and reused on subsequent calls.  in on-demand
+        mode, a handle already open in the process is reused until every open() has been closed
         :return: None, None if successful
                  None, error if error
         '''
-        cycle = 2
-        count = 0
 
-        while(True):
-            try:
-                DB.db = plyvel.DB(DB.dbpath, create_if_missing=True).prefixed_db(bytes(DB.project, 'utf-8'))
-                if DB.db:
-                    break
+        with DB._lock:
+            if DB.persistent and DB._handle:
+                DB.db = DB._handle.prefixed_db(bytes(DB.project, 'utf-8'))
+                return None, None
 
-            except Exception as e:
-                # wait for other program to unlock the db
-                count+=1
-                time.sleep(1)
-                if count >= cycle:
-                    return None, "DB error: {}".format(e)
+            if DB._opens and DB.db:
+                DB._opens += 1
+                return None, None
+
+            cycle = 2
+            count = 0
+
+            while(True):
+                try:
+                    handle = DB.backend(DB.dbpath, create_if_missing=True)
+                    DB.db = handle.prefixed_db(bytes(DB.project, 'utf-8'))
+                    if DB.db:
+                        if DB.persistent and DB._refs > 0:
+                            DB._handle = handle
+                        else:
+                            DB._opens = 1
+                        break
+
+                except Exception as e:
+                    # wait for other program to unlock the db
+                    count+=1
+                    time.sleep(1)
+                    if count >= cycle:
+                        return None, "DB error: {}".format(e)
 
         return None, None
 
@@ -765,11 +3030,16 @@ class DB:
             if a:
                 return None, "{} already exists ".format(key)
 
+        # encoded before opening, so a value that can't be encoded doesn't leave the DB open
+        try:
+            v = DB.encode(value) if serialize else value
+        except Exception as e:
+            return None, "DB.save error: {}".format(e)
+
         _, err = self.open()
         if err:
             return None, err
 
-        v = pickle.dumps(value) if serialize else value
         try:
             DB.db.put(key, v)
 
@@ -779,19 +3049,163 @@ class DB:
         finally:
             self.close()
 
-        DB.cache[key] = value
+        DB.cache.put(key, value)
         return key, None
 
+    @contextmanager
+    def batch(self):
+        '''
+        context manager that opens the DB once and commits every save made through the
+        returned Batch in a single atomic write
+
+            with db.batch() as b:
+                _, err = b.save(key, value)
+
+        check b.err after the block for open, save or write errors
+        '''
+
+        b = Batch(self)
+        _, err = self.open()
+        if err:
+            b.err = "DB.batch error: {}".format(err)
+            yield b
+            return
+
+        try:
+            b._wb = DB.db.write_batch()
+            yield b
+            if b.err or b.discarded:
+                return
+            try:
+                b._wb.write()
+            except Exception as e:
+                b.err = "DB.batch error: {}".format(e)
+                return
+            for key, value in b._pending.items():
+                if value is None:
+                    DB.cache.invalidate(key)
+                else:
+                    DB.cache.put(key, value)
+        finally:
+            self.close()
+
     def delete(self, key):
-        pass
+        '''
+        deletes a single key
+        :return: key, err
+        '''
+
+        res, err = self.delete_keys([key])
+        if err:
+            return None, err
+        return (res[0][0] if res else None), None
+
+    def delete_prefix(self, prefix, keep=0, dry_run=False):
+        '''
+        deletes every record under a key prefix, except the latest keep records
+        :param prefix: (string or bytes) key prefix
+        :param keep: number of the latest records to keep
+        :param dry_run: report what would be deleted without deleting
+        :return: list of (key, bytes), err
+        '''
+
+        records, err = self.stale(prefix, keep=keep)
+        if err:
+            return None, err
+        return self.delete_keys([key for key, _ in records], dry_run=dry_run)
+
+    def stale(self, prefix, keep=0):
+        '''
+        returns the records under a key prefix, less the latest keep records.  records are
+        ordered by their timestamp when they have one, otherwise by key
+        :return: list of (key, value), err
+        '''
+
+        it, err = self.iter(prefix)
+        if err:
+            return None, err
+
+        try:
+            records = [(key, value) for key, value in it]
+        except Exception as e:
+            return None, "DB.stale error: {}".format(e)
+
+        if keep > 0:
+            def latest(r):
+                ts = r[1].get("timestamp") if isinstance(r[1], dict) else None
+                return (ts is not None, ts or datetime.min, r[0])
+            records = sorted(records, key=latest)[:-keep]
+
+        return records, None
+
+    def delete_keys(self, keys, dry_run=False):
+        '''
+        deletes a set of keys in one write batch, invalidates them in the cache, and compacts the
+        key range they covered under each record type.  single-key deletes are not compacted
+        :param keys: keys to delete
+        :param dry_run: report what would be deleted without deleting
+        :return: list of (key, bytes reclaimed), err
+        '''
+
+        keys = [bytes(k, 'utf-8') if isinstance(k, str) else k for k in keys]
+
+        _, err = self.open()
+        if err:
+            return None, err
+
+        res = list()
+        try:
+            wb = DB.db.write_batch()
+            for key in keys:
+                val = DB.db.get(key)
+                if val is None:
+                    continue
+                res.append((key.decode('utf-8'), len(key) + len(val)))
+                wb.delete(key)
+
+            if not dry_run and res:
+                wb.write()
+                for key in keys:
+                    DB.cache.invalidate(key)
+
+                # reclaim the space of bulk deletes -- compact_range lives on the unprefixed db
+                if len(res) > 1:
+                    project = bytes(DB.project, 'utf-8')
+                    for start, stop in DB.compact_ranges([k for k, _ in res]):
+                        DB.db.db.compact_range(start=project + start, stop=project + stop)
+        except Exception as e:
+            return None, "DB.delete error: {}".format(e)
+        finally:
+            self.close()
+
+        return res, None
+
+    @staticmethod
+    def compact_ranges(keys):
+        '''
+        returns the key ranges to compact after deleting keys: one (start, stop) range per record
+        type (the key part up to the first ':'), so unrelated records between them are left alone
+        :param keys: (string or bytes) deleted keys
+        :return: list of (start, stop)
+        '''
+
+        groups = dict()
+        for key in keys:
+            if isinstance(key, str):
+                key = bytes(key, 'utf-8')
+            prefix = key[:key.find(b':') + 1] if b':' in key else key
+            groups.setdefault(prefix, list()).append(key)
+
+        return [(min(group), max(group) + b'\xff') for _, group in sorted(groups.items())]
 
     def get(self, key, deserialize=True):
 
         if isinstance(key, str):
             key = bytes(key, 'utf-8')
 
-        if key in DB.cache:
-            return DB.cache[key], None
+        cached = DB.cache.get(key)
+        if cached is not None:
+            return cached, None
 
         _, err = self.open()
         if err:
@@ -803,7 +3217,7 @@ class DB:
             return None, None
         try:
             if deserialize:
-                obj = pickle.loads(val)
+                obj = DB.decode(val)
             else:
                 obj = val
 
@@ -812,38 +3226,223 @@ class DB:
         finally:
             self.close()
 
-        DB.cache[key] = obj
+        DB.cache.put(key, obj)
         return obj, None
 
     def find(self, keypart):
 
-        _, err = self.open()
+        it, err = self.iter(keypart)
         if err:
             return None, err
 
-        if isinstance(keypart, str):
-            keypart = bytes(keypart, 'utf-8')
-
-        elif not isinstance(keypart, bytes):
-            return None, "keypart must be a string or byte string"
-
         res = list()
         try:
-            it = DB.db.iterator(prefix=keypart)
-            it.seek_to_start()
-
             for key, value in it:
-               res.append({key.decode('utf-8'): pickle.loads(value)})
+               res.append({key: value})
         except Exception as e:
             return None, e
+
+        return res, None
+
+    def iter(self, prefix, start=None, limit=None, keys_only=False, reverse=False):
+        '''
+        streams the records under a key prefix, in key order
+
+        the DB is held open until the generator is exhausted or closed
+
+        :param prefix: (string or bytes) key prefix
+        :param start: (optional) cursor - the last key seen on the previous page.  iteration resumes after it
+        :param limit: (optional) maximum number of records to yield
+        :param keys_only: yield only the keys, without decoding the values
+        :param reverse: iterate in reverse key order
+        :return: generator of (key, value) or keys, err
+        '''
+
+        if isinstance(prefix, str):
+            prefix = bytes(prefix, 'utf-8')
+
+        elif not isinstance(prefix, bytes):
+            return None, "keypart must be a string or byte string"
+
+        if isinstance(start, str):
+            start = bytes(start, 'utf-8')
+
+        _, err = self.open()
+        if err:
+            return None, err
+
+        # the range covered by the prefix, narrowed by the cursor
+        stop = DB.prefix_stop(prefix)
+        kwargs = dict(start=prefix, stop=stop, reverse=reverse, include_value=not keys_only)
+        if start:
+            if reverse:
+                kwargs["stop"] = start
+            else:
+                kwargs["start"] = start
+                kwargs["include_start"] = False
+
+        return self._iter(DB.db, kwargs, limit, keys_only), None
+
+    def _iter(self, db, kwargs, limit, keys_only):
+        count = 0
+        try:
+            if limit is not None and limit <= 0:
+                return
+            for item in db.iterator(**kwargs):
+                if keys_only:
+                    yield item.decode('utf-8')
+                else:
+                    key, value = item
+                    yield key.decode('utf-8'), DB.decode(value)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
         finally:
             self.close()
 
-        return res, None
+    @staticmethod
+    def prefix_stop(prefix):
+        '''
+        returns the first key after every key starting with prefix, or None if there is none
+        '''
+        return prefix_stop(prefix)
 
     def close(self):
-#        DB.db.db.close()
-        DB.db = None
+        '''
+        closes the on-demand handle once every open() has been closed.  in persistent mode the shared
+        handle stays open until shutdown()
+        '''
+
+        with DB._lock:
+            if DB.persistent and DB._handle:
+                return
+
+            if DB._opens > 1:
+                DB._opens -= 1
+                return
+
+            DB._opens = 0
+            if DB.db:
+                DB.db.db.close()
+            DB.db = None
+
+    def shutdown(self):
+        '''
+        releases this instance's reference to the persistent handle.  the handle is closed
+        when the last reference is released
+        :return: None, None if successful
+                 None, error if error
+        '''
+
+        if not self._owner:
+            return None, None
+
+        with DB._lock:
+            self._owner = False
+            DB._refs -= 1
+            if DB._refs > 0:
+                return None, None
+
+            try:
+                if DB._handle:
+                    DB._handle.close()
+            except Exception as e:
+                return None, "DB.shutdown error: {}".format(e)
+            finally:
+                DB._handle = None
+                DB.db = None
+                DB._refs = 0
+
+        return None, None
+
+    @staticmethod
+    def encode(value):
+        '''
+        serializes a value with the configured codec, prefixed with the codec's version byte
+        '''
+        return DB.codec.encode(value)
+
+    @staticmethod
+    def decode(val):
+        '''
+        deserializes a stored value using the codec named by its version byte
+        '''
+        version = val[0]
+        if version == PickleCodec.PROTOCOL_MARKER:
+            return pickle.loads(val)
+        for codec in DB.codecs.values():
+            if version in (codec.VERSION, getattr(codec, "VERSION_ZLIB", None)):
+                return codec.decode(version, val[1:])
+        raise ValueError("unknown record version: {}".format(version))
+
+    def migrate(self, dry_run=False):
+        '''
+        rewrites every record in the project with the configured codec, in place.  bytes dict keys are
+        stored as hex strings.  the deployment address index is rebuilt from the deployments, keyed by
+        target and address
+        :param dry_run: count the records that would be rewritten without writing them
+        :return: (rewritten count, bytes before, bytes after), err
+        '''
+
+        _, err = self.open()
+        if err:
+            return None, err
+
+        by_address = DB.pkey([EZO.BY_ADDRESS])
+        deployed = DB.pkey([EZO.DEPLOYED])
+        count = before = after = 0
+        try:
+            wb = DB.db.write_batch()
+            index = dict()
+            for key, val in DB.db.iterator():
+                if key.startswith(by_address):
+                    # entries saved before they were keyed by target too, rebuilt below
+                    wb.delete(key)
+                    continue
+                if not val:
+                    continue
+                current = val[0] == DB.codec.VERSION or val[0] == getattr(DB.codec, "VERSION_ZLIB", None)
+                if current and not key.startswith(deployed):
+                    continue
+                try:
+                    obj = DB.decode(val)
+                except Exception:
+                    # raw values saved with serialize=False are left alone
+                    continue
+                if key.startswith(deployed):
+                    ik = DB.pkey([EZO.BY_ADDRESS, obj["target"], obj["address"].lower()])
+                    index[ik] = DB.encode(key.decode('utf-8'))
+                if current:
+                    continue
+                v = DB.encode(DB.str_keys(obj))
+                count += 1
+                before += len(val)
+                after += len(v)
+                wb.put(key, v)
+            for ik, v in index.items():
+                wb.put(ik, v)
+            if not dry_run:
+                wb.write()
+        except Exception as e:
+            return None, "DB.migrate error: {}".format(e)
+        finally:
+            self.close()
+
+        DB.cache.clear()
+        return (count, before, after), None
+
+    @staticmethod
+    def str_keys(value):
+        '''
+        returns value with the bytes keys of its dicts as hex strings, as records are saved now -- older
+        records pickled their te-map with HexBytes topic keys, which JSON can't store
+        '''
+        if isinstance(value, dict):
+            return {(HexBytes(k).hex() if isinstance(k, (bytes, bytearray)) else k): DB.str_keys(v)
+                    for k, v in value.items()}
+        if isinstance(value, list):
+            return [DB.str_keys(v) for v in value]
+        return value
 
     @staticmethod
     def pkey(elems):
@@ -0,0 +1,170 @@
+'''
+alternative storage backends for ezo
+
+each backend mirrors the subset of the plyvel interface used by core.lib.DB (get, put, delete,
+iterator, write_batch, prefixed_db, compact_range, close), so DB can open either one.
+'''
+
+import os, sqlite3
+
+
+class SQLiteDB:
+    '''
+    SQLite key/value store, used in place of LevelDB when several processes share the ezo DB
+
+    the database runs in WAL mode:  any number of processes can read while one writes, and a
+    writer waits on the lock (busy_timeout) instead of failing.  keys are compared bytewise,
+    like LevelDB, so prefix scans and ranges behave the same.
+    '''
+
+    FILENAME = "ezo.sqlite"
+
+    def __init__(self, path, create_if_missing=True, timeout=5.0):
+        path = os.path.expanduser(path)
+        if create_if_missing and not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.db = self
+        self.closed = False
+        self._conn = sqlite3.connect(os.path.join(path, SQLiteDB.FILENAME), timeout=timeout,
+                                     isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID")
+
+    def get(self, key):
+        row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, value))
+
+    def delete(self, key):
+        self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def iterator(self, start=None, stop=None, include_start=True, include_stop=False, reverse=False,
+                 include_value=True, prefix=None):
+        if prefix is not None:
+            start, stop = prefix, prefix_stop(prefix)
+            include_start, include_stop = True, False
+
+        where, params = list(), list()
+        if start is not None:
+            where.append("key >= ?" if include_start else "key > ?")
+            params.append(start)
+        if stop is not None:
+            where.append("key <= ?" if include_stop else "key < ?")
+            params.append(stop)
+
+        sql = "SELECT key, value FROM kv"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY key DESC" if reverse else " ORDER BY key"
+
+        for key, value in self._conn.execute(sql, params):
+            yield (key, value) if include_value else key
+
+    def write_batch(self):
+        return SQLiteWriteBatch(self, b'')
+
+    def prefixed_db(self, prefix):
+        return SQLitePrefixedDB(self, prefix)
+
+    def compact_range(self, start=None, stop=None):
+        # WAL checkpoint folds the log back into the database; VACUUM would block other processes
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        if not self.closed:
+            self._conn.close()
+            self.closed = True
+
+
+class SQLitePrefixedDB:
+    '''
+    view of a SQLiteDB restricted to keys starting with prefix, like plyvel's PrefixedDB
+    '''
+
+    def __init__(self, db, prefix):
+        self.db = db
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.db.get(self.prefix + key)
+
+    def put(self, key, value):
+        self.db.put(self.prefix + key, value)
+
+    def delete(self, key):
+        self.db.delete(self.prefix + key)
+
+    def iterator(self, start=None, stop=None, include_start=True, include_stop=False, reverse=False,
+                 include_value=True, prefix=None):
+        if prefix is not None:
+            start, stop = prefix, prefix_stop(prefix)
+            include_start, include_stop = True, False
+
+        start = self.prefix + start if start is not None else self.prefix
+        stop = self.prefix + stop if stop is not None else prefix_stop(self.prefix)
+
+        n = len(self.prefix)
+        for item in self.db.iterator(start=start, stop=stop, include_start=include_start,
+                                     include_stop=include_stop, reverse=reverse, include_value=include_value):
+            if include_value:
+                yield item[0][n:], item[1]
+            else:
+                yield item[n:]
+
+    def write_batch(self):
+        return SQLiteWriteBatch(self.db, self.prefix)
+
+    def prefixed_db(self, prefix):
+        return SQLitePrefixedDB(self.db, self.prefix + prefix)
+
+
+class SQLiteWriteBatch:
+    '''
+    collects puts and deletes and applies them in a single transaction
+    '''
+
+    def __init__(self, db, prefix):
+        self._db = db
+        self._prefix = prefix
+        self._ops = list()
+
+    def put(self, key, value):
+        self._ops.append((self._prefix + key, value))
+
+    def delete(self, key):
+        self._ops.append((self._prefix + key, None))
+
+    def clear(self):
+        self._ops = list()
+
+    def write(self):
+        conn = self._db._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, value in self._ops:
+                if value is None:
+                    conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, value))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._ops = list()
+
+
+def prefix_stop(prefix):
+    '''
+    returns the first key after every key starting with prefix, or None if there is none
+    '''
+    p = bytearray(prefix)
+    while p:
+        if p[-1] < 0xff:
+            p[-1] += 1
+            return bytes(p)
+        p.pop()
+    return None
@@ -14,13 +14,23 @@ def get_contracts(term, ezo):
     return res, None
 
 
+def iter_contracts(term, ezo, start=None, limit=None):
+    # streams (key, contract) pairs -- start is the last key of the previous page
+    st = DB.pkey([EZO.CONTRACT, term]) if term else DB.pkey([EZO.CONTRACT])
+    return ezo.db.iter(st, start=start, limit=limit)
+
+
+def view_contract(key, value):
+    key = key.replace(EZO.CONTRACT + ":", "")
+    return bright("contract: {:35s} hash: {:25s} timestamp: {:25s}".
+                  format(cyan(key), format(blue(value["hash"])), cyan(value["timestamp"])))
+
+
 def view_contracts(results):
     l = list()
     for res in results:
         for key, value in res.items():
-            key = key.replace(EZO.CONTRACT + ":", "")
-            l.append(bright("contract: {:35s} hash: {:25s} timestamp: {:25s}".
-                            format(cyan(key), format(blue(value["hash"])), cyan(value["timestamp"]))))
+            l.append(view_contract(key, value))
     return l
 
 
@@ -32,13 +42,56 @@ def get_deploys(term, ezo):
     return res, None
 
 
+def iter_deploys(term, ezo, start=None, limit=None):
+    # streams (key, deployment) pairs -- start is the last key of the previous page
+    st = DB.pkey([EZO.DEPLOYED, term]) if term else DB.pkey([EZO.DEPLOYED])
+    return ezo.db.iter(st, start=start, limit=limit)
+
+
+def get_deploy_by_address(address, target, ezo):
+    # resolves a contract address on a target to its deployment record through the address index --
+    # deployments saved before the index existed are indexed by 'ezo migrate'
+    pk, err = ezo.db.get(DB.pkey([EZO.BY_ADDRESS, target, address.lower()]))
+    if err or not pk:
+        return None, err
+    return ezo.db.get(pk)
+
+
+def get_deploys_by_target(target, ezo):
+    return _get_indexed(DB.pkey([EZO.BY_TARGET, target]), ezo)
+
+
+def get_deploys_by_hash(hash, ezo):
+    return _get_indexed(DB.pkey([EZO.BY_HASH, hash]), ezo)
+
+
+def _get_indexed(prefix, ezo):
+    it, err = ezo.db.iter(prefix)
+    if err:
+        return None, err
+    pks = [pk for _, pk in it]
+
+    res = list()
+    for pk in pks:
+        d, err = ezo.db.get(pk)
+        if err:
+            return None, err
+        if d:
+            res.append({pk: d})
+    return res, None
+
+
+def view_deploy(key, value):
+    key = key.replace(EZO.DEPLOYED + ":", "").split(':')
+    return "contract: {:35s} target: {:20s} hash: {:27s} address: {:35s} timestamp: {:25s}".\
+        format(cyan(key[0]), magenta(key[1]), blue(key[2]), blue(value["address"]), cyan(value["timestamp"]))
+
+
 def view_deploys(results):
     l = list()
     for res in results:
         for key, value in res.items():
-            key = key.replace(EZO.DEPLOYED + ":", "").split(':')
-            l.append("contract: {:35s} target: {:20s} hash: {:27s} address: {:35s} timestamp: {:25s}".
-                     format(cyan(key[0]), magenta(key[1]), blue(key[2]), blue(value["address"]), cyan(value["timestamp"])))
+            l.append(view_deploy(key, value))
     return l
 
 
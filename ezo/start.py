@@ -1,6 +1,6 @@
 
 from cement.core.exc import FrameworkError, CaughtSignal
-from core.lib import EZO
+from core.lib import EZO, ProviderPool
 from cli.ezo_cli import EZOApp
 from core.helpers import reset
 
@@ -34,6 +34,11 @@ def main():
             app.exit_code = 300
 
         finally:
+            # report cache usage, release the persistent db handle, if any, and node connections
+            app.log.debug("db cache: {}".format(app.ezo.db.cache.stats()))
+            app.ezo.db.shutdown()
+            ProviderPool.close()
+
             # reset terminal
             print(reset(""))
 
@@ -3,6 +3,7 @@ from core.views import event_output
 # This code automatically generated by ezo.  Only modify where suggested.
 #
 # data is an instance of ContractEvent
+# data.args holds the event's decoded arguments, by name
 # contract is the calling instance of Contract - it is used to send a response
 
 
@@ -4,18 +4,58 @@
 			"test": {
 				"account": "0x627306090abaB3A6e1400e9345bC60c78a8BEf57",
 				"url": "http://127.0.0.1:7545",
-				"network": "ganache"
+				"network": "ganache",
+				"keystores": []
 			},
 			"test2": {
 				"account": "",
 				"url": "http://localhost:8545",
-				"network": "ganache-cli"
+				"network": "ganache-cli",
+				"keystores": []
 			}
 		},
 		"contract-dir": "",
 		"handlers-dir": "",
 		"leveldb": "",
+		"db-backend": "leveldb",
+		"db-persistent": false,
+		"db-codec": "json",
+		"db-cache": {
+			"size": 1024,
+			"ttl": 60,
+			"policies": {
+				"COMPILED": null,
+				"DEPLOYED": 10
+			}
+		},
 		"poll-interval": 1,
+		"poll-interval-min": 0.1,
+		"poll-interval-max": 10,
+		"subscribe": true,
+		"backfill-chunk-size": 1000,
+		"backfill-workers": 4,
+		"checkpoint-interval": 60,
+		"reorg-depth": 64,
+		"compile-workers": 4,
+		"handler-hot-reload": false,
+		"handler-workers": 4,
+		"event-queue-size": 1000,
+		"ordered-dispatch": true,
+		"handled-cache-size": 10000,
+		"tx-timeout": 120,
+		"gas-bump": 1.125,
+		"tx-max-resends": 5,
+		"tx-max-gas-price": null,
+		"receipt-poll-interval": 1,
+		"unlock-duration": 300,
+		"gas-margin": 0.25,
+		"call-batch-size": 100,
+		"http-pool-size": 10,
+		"node-timeout": 10,
+		"provider-health-interval": 30,
+		"balance": "round-robin",
+		"circuit-errors": 3,
+		"circuit-reset": 30,
 		"project-name": ""
 	}
 }
\ No newline at end of file
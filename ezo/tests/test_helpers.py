@@ -3,6 +3,7 @@ from ezo.core import helpers
 from core.lib import EZO
 import json
 import pytest
+from hexbytes import HexBytes
 
 
 
@@ -31,3 +32,23 @@ def test_03_get_contract_path():
 def test_04_get_handler_path():
     k = helpers.get_handler_path(config(), "event_handler.py")
     assert "event_handler.py" in k
+
+
+def test_05_format_log():
+    log = {"address": "0x5fbb", "blockNumber": "0x1b", "logIndex": "0x2", "transactionIndex": "0x0",
+           "transactionHash": "0x" + "cd" * 32, "blockHash": "0x" + "ef" * 32, "topics": ["0x" + "ab" * 32],
+           "data": "0x"}
+    k = helpers.format_log(log)
+    assert k["blockNumber"] == 27
+    assert k["logIndex"] == 2
+    assert k["topics"][0] == HexBytes("0x" + "ab" * 32)
+
+
+def test_06_format_receipt():
+    receipt = {"transactionHash": "0x" + "cd" * 32, "blockNumber": "0x1b", "gasUsed": "0x5208", "status": "0x1",
+               "logs": [{"address": "0x5fbb", "blockNumber": "0x1b", "logIndex": "0x0", "topics": []}]}
+    k = helpers.format_receipt(receipt)
+    assert k["gasUsed"] == 21000
+    assert k["status"] == 1
+    assert k["transactionHash"] == HexBytes("0x" + "cd" * 32)
+    assert k["logs"][0]["blockNumber"] == 27
@@ -1,4 +1,11 @@
-from core.lib import DB
+from core.lib import DB, Cache, JsonCodec, PickleCodec, Contract, EZO
+from core.helpers import get_hash
+from core.stores import SQLiteDB
+from core import views
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from hexbytes import HexBytes
+import pickle
 import pytest
 import shutil
 
@@ -86,17 +93,537 @@ class TestDB:
         TestDB.db.close()
         assert not DB.db
 
-    def test_06a_fail_open_already_open(self):
+    def test_06a_open_twice_shares_handle(self):
         assert not DB.db
         ks, err = TestDB.db.open()
         assert not err
-        assert DB.db
+        handle = DB.db
         ks, err = TestDB.db.open()
-        assert 'LOCK' in err
+        assert not err
+        assert DB.db is handle
+        TestDB.db.close()
+        assert DB.db is handle
         TestDB.db.close()
         assert not DB.db
 
+    def test_06b_threads_share_on_demand_handle(self):
+        def work(n):
+            for i in range(20):
+                _, err = TestDB.db.save("thread:{}:{}".format(n, i), i, overwrite=True)
+                assert err is None
+                DB.cache.clear()
+                v, err = TestDB.db.get("thread:{}:{}".format(n, i))
+                assert err is None and v == i
+            return n
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            assert sorted(pool.map(work, range(4))) == [0, 1, 2, 3]
+        assert not DB.db
+
+    def test_06c_unencodable_value_leaves_db_closed(self):
+        ks, err = TestDB.db.save("unencodable", {"value": object()}, overwrite=True)
+        assert ks is None and "DB.save error" in err
+        assert not DB.db
+        with TestDB.db.batch() as b:
+            ks, err = b.save("unencodable", {"value": object()}, overwrite=True)
+            assert ks is None and "DB.batch error" in err
+            b.discard()
+        assert not DB.db
+
     def test_07a_fail_keypart_not_str_or_dict(self):
         ks, err = TestDB.db.find(dict())
         assert err
-        assert "keypart must be a string or byte string" in err
\ No newline at end of file
+        assert "keypart must be a string or byte string" in err
+
+    def test_07b_iter_streams_prefix_in_order(self):
+        for k in ["iter:a", "iter:b", "iter:c", "iterz"]:
+            TestDB.db.save(k, k, overwrite=True)
+        it, err = TestDB.db.iter("iter:")
+        assert err is None
+        assert [k for k, v in it] == ["iter:a", "iter:b", "iter:c"]
+
+    def test_07c_iter_pagination_cursor(self):
+        for k in ["page:a", "page:b", "page:c"]:
+            TestDB.db.save(k, k, overwrite=True)
+        it, err = TestDB.db.iter("page:", limit=2, keys_only=True)
+        page = list(it)
+        assert page == ["page:a", "page:b"]
+        it, err = TestDB.db.iter("page:", start=page[-1], limit=2, keys_only=True)
+        assert list(it) == ["page:c"]
+
+    def test_07d_iter_reverse(self):
+        for k in ["rev:a", "rev:b", "rev:c"]:
+            TestDB.db.save(k, k, overwrite=True)
+        it, err = TestDB.db.iter("rev:", reverse=True, keys_only=True)
+        assert list(it) == ["rev:c", "rev:b", "rev:a"]
+        it, err = TestDB.db.iter("rev:", start="rev:b", reverse=True, keys_only=True)
+        assert list(it) == ["rev:a"]
+
+    def test_07e_delete_key(self):
+        TestDB.db.save("delete:a", "me", overwrite=True)
+        ks, err = TestDB.db.delete("delete:a")
+        assert err is None
+        assert ks == "delete:a"
+        ks, err = TestDB.db.get("delete:a")
+        assert ks is None
+
+    def test_07f_delete_prefix_keep_latest(self):
+        for i in range(3):
+            TestDB.db.save("versions:{}".format(i), {"timestamp": datetime(2018, 6, 13 + i)}, overwrite=True)
+        res, err = TestDB.db.delete_prefix("versions:", keep=1, dry_run=True)
+        assert err is None
+        assert [k for k, _ in res] == ["versions:0", "versions:1"]
+        it, _ = TestDB.db.iter("versions:", keys_only=True)
+        assert len(list(it)) == 3
+
+        res, err = TestDB.db.delete_prefix("versions:", keep=1)
+        assert err is None
+        assert all(size > 0 for _, size in res)
+        it, _ = TestDB.db.iter("versions:", keys_only=True)
+        assert list(it) == ["versions:2"]
+
+    def test_07g_compact_ranges_per_record_type(self):
+        ranges = DB.compact_ranges(["HANDLED:b", "DEPLOY:x", "HANDLED:a", b"DEPLOY:y"])
+        assert ranges == [(b"DEPLOY:x", b"DEPLOY:y\xff"), (b"HANDLED:a", b"HANDLED:b\xff")]
+
+    def test_08_batch_commits_all_saves(self):
+        with TestDB.db.batch() as b:
+            _, err = b.save("batch1", "me")
+            assert err is None
+            _, err = b.save("batch2", "me")
+            assert err is None
+        assert b.err is None
+        DB.cache.clear()
+        ks, err = TestDB.db.get("batch1")
+        assert ks == "me"
+        ks, err = TestDB.db.get("batch2")
+        assert ks == "me"
+
+    def test_08a_batch_duplicate_in_same_batch(self):
+        with TestDB.db.batch() as b:
+            _, err = b.save("batch3", "me")
+            assert err is None
+            _, err = b.save("batch3", "me")
+            assert 'already exists' in err
+            b.discard()
+        DB.cache.clear()
+        ks, err = TestDB.db.get("batch3")
+        assert ks is None
+
+class TestPersistentDB:
+
+    db = None
+    dbpath = None
+    project = None
+
+    @classmethod
+    def setup(cls):
+        cls.dbpath = "/tmp/ezotest_persistent"
+        cls.project = "pytest"
+        cls.db = DB(cls.project, cls.dbpath, persistent=True)
+
+    @classmethod
+    def teardown(cls):
+        cls.db.shutdown()
+        DB.persistent = False
+        try:
+            shutil.rmtree(cls.dbpath)
+        except:
+            pass
+
+    def test_01_handle_reused_across_operations(self):
+        ks, err = TestPersistentDB.db.save("hello", "me", overwrite=True)
+        assert err is None
+        handle = DB._handle
+        assert handle
+        ks, err = TestPersistentDB.db.save("hello2", "me", overwrite=True)
+        assert err is None
+        assert DB._handle is handle
+        assert not handle.closed
+
+    def test_02_shutdown_closes_handle(self):
+        ks, err = TestPersistentDB.db.open()
+        assert not err
+        handle = DB._handle
+        TestPersistentDB.db.close()
+        assert not handle.closed
+        TestPersistentDB.db.shutdown()
+        assert handle.closed
+        assert not DB._handle
+
+    def test_03_handle_closed_on_last_reference(self):
+        other = DB(TestPersistentDB.project, TestPersistentDB.dbpath, persistent=True)
+        ks, err = other.open()
+        assert not err
+        handle = DB._handle
+        other.shutdown()
+        assert not handle.closed
+        TestPersistentDB.db.shutdown()
+        assert handle.closed
+
+
+class TestCache:
+
+    def test_01_lru_eviction(self):
+        c = Cache(size=2, ttl=None, policies={})
+        c.put(b"a", 1)
+        c.put(b"b", 2)
+        assert c.get(b"a") == 1
+        c.put(b"c", 3)
+        assert c.get(b"b") is None
+        assert c.get(b"a") == 1
+        assert c.stats()["evictions"] == 1
+
+    def test_02_ttl_expiry(self):
+        c = Cache(size=10, ttl=-1, policies={})
+        c.put(b"a", 1)
+        assert c.get(b"a") is None
+        assert c.stats()["misses"] == 1
+
+    def test_03_prefix_policies(self):
+        c = Cache(size=10, ttl=-1, policies={"COMPILED": None, "DEPLOYED": 0})
+        c.put(b"COMPILED:name:hash:", 1)
+        c.put(b"DEPLOYED:name:test:hash:", 2)
+        assert c.get(b"COMPILED:name:hash:") == 1
+        assert c.get(b"DEPLOYED:name:test:hash:") is None
+        assert len(c) == 1
+
+    def test_04_hit_miss_counters(self):
+        c = Cache()
+        c.put(b"a", 1)
+        c.get(b"a")
+        c.get(b"b")
+        stats = c.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_05_concurrent_expiry_and_invalidate(self):
+        c = Cache(size=100, ttl=-1, policies={})
+
+        def churn(_):
+            for _ in range(200):
+                c.put(b"a", 1)
+                c.get(b"a")
+                c.invalidate(b"a")
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(churn, range(8)))
+        c.invalidate(b"missing")
+        assert len(c) == 0
+
+
+class TestCodec:
+
+    def test_01_json_round_trip(self):
+        value = {"address": "0x5fbb", "tx-hash": HexBytes("0x1234"), "timestamp": datetime(2018, 6, 13, 1, 2, 3, 4),
+                 "gas-used": 21000}
+        v = DB.encode(value)
+        assert v[0] == JsonCodec.VERSION
+        assert DB.decode(v) == value
+
+    def test_02_large_values_compressed(self):
+        value = {"source": "contract " * 200}
+        v = DB.encode(value)
+        assert v[0] == JsonCodec.VERSION_ZLIB
+        assert len(v) < len(value["source"])
+        assert DB.decode(v) == value
+
+    def test_03_decode_legacy_pickle(self):
+        value = {"address": "0x5fbb", "timestamp": datetime.utcnow()}
+        assert DB.decode(pickle.dumps(value)) == value
+        assert DB.decode(PickleCodec.encode(value)) == value
+
+    def test_04_typed_fields_decode_without_hook(self):
+        value = {"tx-hash": HexBytes("0x1234"), "timestamp": datetime(2018, 6, 13), "logs": [{"at": datetime(2018, 6, 14)}]}
+        v = DB.encode(value)
+        assert b'"timestamp":"2018-06-13T00:00:00"' in v
+        assert DB.decode(v) == value
+
+        # written before typed fields were flattened
+        tagged = b'{"timestamp":{"__dt__":"2018-06-13T01:02:03.000004"}}'
+        assert DB.decode(bytes([JsonCodec.VERSION]) + tagged) == {"timestamp": datetime(2018, 6, 13, 1, 2, 3, 4)}
+
+    def test_05_migrate_rewrites_pickle_records(self):
+        db = DB("pytest", "/tmp/ezotest_migrate", codec="pickle")
+        try:
+            _, err = db.save("legacy", {"a": 1}, overwrite=True)
+            assert err is None
+            DB.codec = JsonCodec
+            res, err = db.migrate()
+            assert err is None
+            assert res[0] == 1
+            DB.cache.clear()
+            val, err = db.get("legacy", deserialize=False)
+            assert val[0] == JsonCodec.VERSION
+        finally:
+            DB.codec = JsonCodec
+            shutil.rmtree("/tmp/ezotest_migrate", ignore_errors=True)
+
+    def test_06_migrate_baseline_contract_record(self):
+        db = DB("pytest", "/tmp/ezotest_migrate")
+        topic = HexBytes("0x" + "ab" * 32)
+        # as saved before codecs were versioned: a raw pickle, with HexBytes topic keys
+        record = {"name": "<stdin>:Old", "abi": [{"type": "event", "name": "E", "inputs": []}], "hash": "abc",
+                  "source": "contract Old {}", "bin": "6080604052", "timestamp": datetime(2018, 6, 13),
+                  "te-map": {topic: "/handlers/old/e_handler.py"}}
+        try:
+            _, err = db.save(DB.pkey([EZO.CONTRACT, "Old"]), pickle.dumps(record), overwrite=True, serialize=False)
+            assert err is None
+            res, err = db.migrate(dry_run=True)
+            assert err is None
+            assert res[0] == 1
+            res, err = db.migrate()
+            assert err is None
+            assert res[0] == 1
+
+            DB.cache.clear()
+            val, err = db.get(DB.pkey([EZO.CONTRACT, "Old"]), deserialize=False)
+            assert val[0] in (JsonCodec.VERSION, JsonCodec.VERSION_ZLIB)
+            DB.cache.clear()
+            c, err = Contract.get("Old", type("Ezo", (), {"db": db}))
+            assert err is None
+            assert c.te_map == {topic: "/handlers/old/e_handler.py"}
+            assert c.timestamp == datetime(2018, 6, 13)
+        finally:
+            DB.cache.clear()
+            shutil.rmtree("/tmp/ezotest_migrate", ignore_errors=True)
+
+    def test_07_migrate_indexes_deployments_by_target(self):
+        db = DB("pytest", "/tmp/ezotest_migrate")
+        key = DB.pkey([EZO.DEPLOYED, "Old", "test", "abc"])
+        d = {"contract-name": "<stdin>:Old", "hash": "abc", "address": "0xAAAA", "target": "test"}
+        try:
+            _, err = db.save(key, d, overwrite=True)
+            assert err is None
+            # as indexed before the target was part of the key
+            _, err = db.save(DB.pkey([EZO.BY_ADDRESS, "0xaaaa"]), key.decode('utf-8'), overwrite=True)
+            assert err is None
+
+            res, err = db.migrate()
+            assert err is None
+            DB.cache.clear()
+            dep, err = views.get_deploy_by_address("0xAAAA", "test", type("Ezo", (), {"db": db}))
+            assert err is None
+            assert dep["hash"] == "abc"
+            old, err = db.get(DB.pkey([EZO.BY_ADDRESS, "0xaaaa"]))
+            assert old is None
+        finally:
+            DB.cache.clear()
+            shutil.rmtree("/tmp/ezotest_migrate", ignore_errors=True)
+
+
+class TestContractStorage:
+
+    db = None
+    dbpath = "/tmp/ezotest_contracts"
+
+    class Ezo:
+        db = None
+
+    @classmethod
+    def setup(cls):
+        cls.db = DB("pytest", cls.dbpath)
+        cls.Ezo.db = cls.db
+
+    @classmethod
+    def teardown(cls):
+        DB.cache.clear()
+        shutil.rmtree(cls.dbpath, ignore_errors=True)
+
+    def test_01_blobs_split_from_metadata(self):
+        c = Contract("<stdin>:LazyOracle", self.Ezo)
+        c.abi = []
+        c.bin = "6080604052"
+        c.source = "contract LazyOracle {}"
+        ks, err = c.save(overwrite=True)
+        assert err is None
+
+        DB.cache.clear()
+        cp, err = self.db.get(DB.pkey([EZO.CONTRACT, "LazyOracle"]))
+        assert "source" not in cp
+        assert "bin" not in cp
+
+    def test_02_source_and_bin_loaded_lazily(self):
+        c = Contract("<stdin>:LazyOracle", self.Ezo)
+        c.abi = []
+        c.bin = "6080604052"
+        c.source = "contract LazyOracle {}"
+        ks, err = c.save(overwrite=True)
+        assert err is None
+
+        DB.cache.clear()
+        c, err = Contract.get("LazyOracle", self.Ezo)
+        assert err is None
+        assert c._source is None
+        assert c.source == "contract LazyOracle {}"
+        assert c.bin == "6080604052"
+
+    def test_03_compile_reuses_stored_build(self):
+        source = "contract CachedOracle {}"
+        c = Contract("<stdin>:CachedOracle", self.Ezo)
+        c.abi = [{"type": "event", "name": "E", "inputs": []}]
+        c.bin = "6080604052"
+        c.source = source
+        c.build_key = Contract.build_key(source)
+        with self.db.batch() as b:
+            _, err = c.save(overwrite=True, batch=b)
+            assert err is None
+            _, err = Contract.save_build(b, [c])
+            assert err is None
+
+        DB.cache.clear()
+        compiled, err = Contract.compile(source, self.Ezo)
+        assert err is None
+        assert [x.name for x in compiled] == ["<stdin>:CachedOracle"]
+        assert compiled[0].abi == c.abi
+        assert compiled[0].bin == "6080604052"
+
+        # compiling again without --overwrite saves the reused contract as the latest one
+        compiled[0].source = source
+        with self.db.batch() as b:
+            _, err = compiled[0].save(overwrite=False, batch=b)
+            assert err is None
+        assert b.err is None
+        latest, err = Contract.get("CachedOracle", self.Ezo)
+        assert err is None
+        assert latest.hash == get_hash(source)
+
+    def test_03a_recompile_keeps_generated_handlers(self):
+        source = "contract CachedOracle {}"
+        topic = HexBytes("0x" + "ab" * 32)
+        c = Contract("<stdin>:CachedOracle", self.Ezo)
+        c.abi = [{"type": "event", "name": "E", "inputs": []}]
+        c.bin = "6080604052"
+        c.source = source
+        c.build_key = Contract.build_key(source)
+        with self.db.batch() as b:
+            _, err = c.save(overwrite=True, batch=b)
+            assert err is None
+            _, err = Contract.save_build(b, [c])
+            assert err is None
+
+        # ezo gen maps the event topics to their handlers, and saves the contract again
+        latest, err = Contract.get("CachedOracle", self.Ezo)
+        latest.te_map[topic] = "/handlers/cached_oracle/e_handler.py"
+        _, err = latest.save(overwrite=True)
+        assert err is None
+
+        DB.cache.clear()
+        compiled, err = Contract.compile(source, self.Ezo)
+        assert err is None
+        assert compiled[0].built
+        compiled[0].source = source
+        _, err = compiled[0].save(overwrite=False)
+        assert err is None
+
+        DB.cache.clear()
+        again, err = Contract.get("CachedOracle", self.Ezo)
+        assert again.te_map == {topic: "/handlers/cached_oracle/e_handler.py"}
+        assert again.timestamp == latest.timestamp
+
+    def test_03b_delete_keeps_current_version(self):
+        for i, source in enumerate(["contract Kept { a }", "contract Kept { b }"]):
+            c = Contract("<stdin>:Kept", self.Ezo)
+            c.abi = []
+            c.bin = "60{:02x}".format(i)
+            c.source = source
+            c.timestamp = datetime(2018, 6, 13 + i)
+            _, err = c.save(overwrite=True)
+            assert err is None
+
+        # compiled again, the first version is reused from its build, with its old timestamp
+        DB.cache.clear()
+        reused = Contract.from_record(self.db.get(DB.pkey([EZO.COMPILED, "Kept", get_hash("contract Kept { a }")]))[0],
+                                      self.Ezo)
+        reused.built = True
+        _, err = reused.save()
+        assert err is None
+
+        res, err = Contract.delete(self.Ezo, "Kept", keep=1)
+        assert err is None
+        assert res == []
+        DB.cache.clear()
+        current, err = Contract.get("Kept", self.Ezo)
+        assert current.bin == "6000"
+
+    def test_04_build_key_changes_with_options(self):
+        source = "contract CachedOracle {}"
+        assert Contract.build_key(source) != Contract.build_key(source, {"optimize": True})
+        assert Contract.build_key(source) != Contract.build_key(source + " ")
+
+    def test_05_compile_many_keeps_order_and_reports_file(self):
+        source = "contract CachedOracle {}"
+        c = Contract("<stdin>:CachedOracle", self.Ezo)
+        c.abi = []
+        c.bin = "6080604052"
+        c.source = source
+        c.build_key = Contract.build_key(source)
+        with self.db.batch() as b:
+            c.save(overwrite=True, batch=b)
+            Contract.save_build(b, [c])
+
+        res, err = Contract.compile_many([("a.sol", source), ("b.sol", source)], self.Ezo)
+        assert err is None
+        assert [r[0] for r in res] == ["a.sol", "b.sol"]
+        assert res[1][1][0].bin == "6080604052"
+
+        # solc is not installed for the tests, so uncached sources fail in the workers
+        res, err = Contract.compile_many([("c.sol", "contract C {}"), ("d.sol", "contract D {}")],
+                                         self.Ezo, workers=2, solc_binary="/nonexistent/solc")
+        assert res is None
+        assert "c.sol" in err
+
+
+class TestSQLiteDB:
+
+    db = None
+    dbpath = "/tmp/ezotest_sqlite"
+
+    @classmethod
+    def setup(cls):
+        cls.db = DB("pytest", cls.dbpath, backend="sqlite")
+        DB.cache.clear()
+
+    @classmethod
+    def teardown(cls):
+        DB.backend = DB.backends["leveldb"]
+        DB.cache.clear()
+        shutil.rmtree(cls.dbpath, ignore_errors=True)
+
+    def test_01_save_get(self):
+        ks, err = TestSQLiteDB.db.save("hello", {"a": 1})
+        assert err is None
+        DB.cache.clear()
+        ks, err = TestSQLiteDB.db.get("hello")
+        assert ks == {"a": 1}
+
+    def test_02_open_twice_without_lock(self):
+        ks, err = TestSQLiteDB.db.open()
+        assert not err
+        try:
+            # a second connection, as another process would have, writing while the first is open
+            other = SQLiteDB(TestSQLiteDB.dbpath)
+            try:
+                other.prefixed_db(b"pytest").put(b"other", DB.encode("me"))
+            finally:
+                other.close()
+            DB.cache.clear()
+            ks, err = TestSQLiteDB.db.get("other")
+            assert err is None
+            assert ks == "me"
+        finally:
+            TestSQLiteDB.db.close()
+
+    def test_03_iter_batch_delete(self):
+        with TestSQLiteDB.db.batch() as b:
+            for k in ["s:a", "s:b", "s:c", "t:a"]:
+                b.save(k, k, overwrite=True)
+        assert b.err is None
+        it, err = TestSQLiteDB.db.iter("s:", start="s:a", keys_only=True)
+        assert list(it) == ["s:b", "s:c"]
+        res, err = TestSQLiteDB.db.delete_prefix("s:")
+        assert err is None
+        assert len(res) == 3
+        it, err = TestSQLiteDB.db.iter("", keys_only=True)
+        assert "t:a" in list(it)
+
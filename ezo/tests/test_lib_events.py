@@ -0,0 +1,436 @@
+from core.lib import HandlerRegistry, EventDecoder, DispatchTable, ContractEvent, Dispatcher, AdaptiveInterval, subscribe_logs, Checkpoint, Contract, Listener, DB, EZO
+import pytest
+from eth_abi import encode_abi
+from hexbytes import HexBytes
+from web3 import Web3
+import asyncio, json, logging, os, shutil, time, websockets
+
+
+class TestHandlerRegistry:
+
+    path = "/tmp/ezotest_handlers"
+
+    @classmethod
+    def setup(cls):
+        os.makedirs(cls.path, exist_ok=True)
+        HandlerRegistry.clear()
+        HandlerRegistry.hot_reload = False
+
+    @classmethod
+    def teardown(cls):
+        HandlerRegistry.clear()
+        HandlerRegistry.hot_reload = False
+        shutil.rmtree(cls.path, ignore_errors=True)
+
+    def write_handler(self, name, result):
+        hp = "{}/{}".format(self.path, name)
+        with open(hp, "w+") as f:
+            f.write("def handler(data, contract):\n    return {}, None\n".format(repr(result)))
+        return hp
+
+    def test_01_module_loaded_once(self):
+        hp = self.write_handler("once_handler.py", "first")
+        m1, err = HandlerRegistry.get(hp)
+        assert err is None
+        m2, err = HandlerRegistry.get(hp)
+        assert m1 is m2
+        assert m1.handler(None, None) == ("first", None)
+
+    def test_02_hot_reload_on_change(self):
+        HandlerRegistry.hot_reload = True
+        hp = self.write_handler("reload_handler.py", "first")
+        m1, err = HandlerRegistry.get(hp)
+        assert m1.handler(None, None) == ("first", None)
+
+        self.write_handler("reload_handler.py", "second")
+        os.utime(hp, (time.time() + 10, time.time() + 10))
+        m2, err = HandlerRegistry.get(hp)
+        assert m2.handler(None, None) == ("second", None)
+
+    def test_03_missing_handler_error(self):
+        m, err = HandlerRegistry.get("{}/throatwobbler_handler.py".format(self.path))
+        assert m is None
+        assert err
+
+
+class TestDispatchTable:
+
+    path = "/tmp/ezotest_dispatch_table"
+    event = {"anonymous": False, "name": "FilledRequest", "type": "event",
+             "inputs": [{"indexed": True, "name": "requester", "type": "address"},
+                        {"indexed": True, "name": "tag", "type": "string"},
+                        {"indexed": False, "name": "rtemp", "type": "uint256"},
+                        {"indexed": False, "name": "note", "type": "string"}]}
+
+    @classmethod
+    def setup(cls):
+        os.makedirs(cls.path, exist_ok=True)
+        HandlerRegistry.clear()
+
+    @classmethod
+    def teardown(cls):
+        HandlerRegistry.clear()
+        shutil.rmtree(cls.path, ignore_errors=True)
+
+    def log(self):
+        requester = "0x" + "00" * 12 + "11" * 20
+        return {"address": "0xabc", "logIndex": 0, "transactionHash": "0x0", "blockNumber": 1,
+                "topics": [HexBytes(Web3.keccak(text="FilledRequest(address,string,uint256,string)")),
+                           HexBytes(requester), HexBytes(Web3.keccak(text="hot"))],
+                "data": HexBytes(encode_abi(["uint256", "string"], [72, "sunny"])).hex()}
+
+    def test_01_decode_named_args(self):
+        d = EventDecoder(self.event)
+        args, err = d.decode(self.log())
+        assert err is None
+        assert list(args.keys()) == ["requester", "tag", "rtemp", "note"]
+        assert args["requester"] == "0x" + "11" * 20
+        assert args["tag"] == HexBytes(Web3.keccak(text="hot"))
+        assert args["rtemp"] == 72
+        assert args["note"] == "sunny"
+
+    def test_02_handler_gets_decoded_event(self):
+        hp = "{}/filled_request_handler.py".format(self.path)
+        with open(hp, "w+") as f:
+            f.write("def handler(data, contract):\n    contract.calls.append((data.name, data.args['rtemp']))\n")
+
+        c = RecordingContract(hp)
+        c.abi = [self.event]
+        c.te_map = {Web3.keccak(text="FilledRequest(address,string,uint256,string)"): hp}
+        table, errors = DispatchTable.from_contract(c)
+        assert errors == []
+        c.dispatch = table
+
+        ContractEvent.handler(self.log(), c, "test")
+        assert c.calls == [("FilledRequest", 72)]
+
+    def test_03_unknown_topic(self):
+        table, errors = DispatchTable.from_contract(RecordingContract("{}/nope.py".format(self.path)))
+        assert len(errors) == 1
+        handler, decoder, err = table.get("0xtopic")
+        assert handler is None and err
+
+
+class RecordingContract:
+
+    def __init__(self, handler_path):
+        self.abi = None
+        self.te_map = {"0xtopic": handler_path}
+        self.dispatch = None
+        self.calls = list()
+
+
+def rce(address, n):
+    return {"address": address, "data": "0x", "logIndex": n, "transactionHash": "0x{}".format(n),
+            "topics": ["0xtopic"], "blockNumber": 1}
+
+
+class TestDispatcher:
+
+    path = "/tmp/ezotest_dispatch"
+
+    @classmethod
+    def setup(cls):
+        os.makedirs(cls.path, exist_ok=True)
+        HandlerRegistry.clear()
+        cls.handler = "{}/slow_handler.py".format(cls.path)
+        with open(cls.handler, "w+") as f:
+            f.write("import time\n"
+                    "def handler(data, contract):\n"
+                    "    time.sleep(0.1)\n"
+                    "    contract.calls.append(data.log_index)\n")
+
+    @classmethod
+    def teardown(cls):
+        HandlerRegistry.clear()
+        shutil.rmtree(cls.path, ignore_errors=True)
+
+    def dispatch(self, dispatcher, events):
+        async def go():
+            runner = asyncio.ensure_future(dispatcher.run())
+            for e, c in events:
+                await dispatcher.put(e, c, "test")
+            await dispatcher.join()
+            runner.cancel()
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+
+        loop = asyncio.new_event_loop()
+        start = time.perf_counter()
+        try:
+            loop.run_until_complete(go())
+        finally:
+            loop.close()
+        return time.perf_counter() - start
+
+    def test_01_handlers_run_concurrently(self):
+        contracts = [RecordingContract(self.handler) for _ in range(4)]
+        events = [(rce("0x{}".format(i), i), contracts[i]) for i in range(4)]
+        elapsed = self.dispatch(Dispatcher(workers=4, ordered=False), events)
+        assert sum(len(c.calls) for c in contracts) == 4
+        assert elapsed < 0.35
+
+    def test_02_ordered_per_contract(self):
+        c = RecordingContract(self.handler)
+        events = [(rce("0xabc", i), c) for i in range(5)]
+        self.dispatch(Dispatcher(workers=4, ordered=True), events)
+        assert c.calls == [0, 1, 2, 3, 4]
+
+
+class TestListening:
+
+    def test_01_adaptive_interval(self):
+        i = AdaptiveInterval(1, 0.1, 4, patience=2)
+        i.busy()
+        assert i.interval == 0.1
+        i.idle()
+        i.idle()
+        assert i.interval == 0.1
+        for _ in range(10):
+            i.idle()
+        assert i.interval == 4
+
+    def test_02_subscribe_logs_from_stand_in_node(self):
+        log = {"address": "0x5fbb", "blockNumber": "0x1", "logIndex": "0x0", "transactionHash": "0x01",
+               "topics": ["0x" + "ab" * 32], "data": "0x"}
+
+        async def node(ws, path=None):
+            req = json.loads(await ws.recv())
+            assert req["method"] == "eth_subscribe"
+            await ws.send(json.dumps({"jsonrpc": "2.0", "id": req["id"], "result": "0x9"}))
+            await ws.send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription",
+                                      "params": {"subscription": "0x9", "result": log}}))
+            await asyncio.sleep(1)
+
+        async def go():
+            server = await websockets.serve(node, "127.0.0.1", 8766)
+            try:
+                async for event in subscribe_logs("ws://127.0.0.1:8766", {"address": "0x5fbb"}):
+                    return event
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        loop = asyncio.new_event_loop()
+        try:
+            event = loop.run_until_complete(go())
+        finally:
+            loop.close()
+        assert event["blockNumber"] == 1
+        assert event["address"] == "0x5fbb"
+
+
+class StubEth:
+
+    def __init__(self, logs, head):
+        self.logs = logs
+        self.blockNumber = head
+        self.requests = list()
+
+    def getLogs(self, f):
+        self.requests.append((f["fromBlock"], f["toBlock"]))
+        addresses = f["address"] if isinstance(f["address"], list) else [f["address"]]
+        return [l for l in self.logs if f["fromBlock"] <= l["blockNumber"] <= f["toBlock"]
+                and l["address"] in addresses]
+
+
+class StubEzo:
+
+    def __init__(self, db, logs, head):
+        self.db = db
+        self.config = {"backfill-chunk-size": 10, "backfill-workers": 2}
+        self.w3 = type("W3", (), {})()
+        self.w3.eth = StubEth(logs, head)
+
+
+class TestCheckpoint:
+
+    dbpath = "/tmp/ezotest_checkpoint"
+
+    @classmethod
+    def setup(cls):
+        cls.db = DB("pytest", cls.dbpath)
+        DB.cache.clear()
+        EZO.log = logging.getLogger("ezotest")
+
+    @classmethod
+    def teardown(cls):
+        DB.cache.clear()
+        shutil.rmtree(cls.dbpath, ignore_errors=True)
+
+    def test_01_position_waits_for_inflight_events(self):
+        cp = Checkpoint(self.db, "<stdin>:Oracle", "test")
+        a, b = {"blockNumber": 5, "logIndex": 0}, {"blockNumber": 5, "logIndex": 1}
+        assert cp.seen(a)
+        assert cp.seen(b)
+        assert not cp.seen(a)
+        cp.done(b)
+        assert cp.saved is None
+        cp.done(a)
+        assert cp.saved == (5, 1)
+
+        again = Checkpoint(self.db, "<stdin>:Oracle", "test")
+        pos, err = again.load()
+        assert pos == (5, 1)
+
+    def test_01a_advance_waits_for_inflight_events(self):
+        cp = Checkpoint(self.db, "<stdin>:Quiet", "test")
+        a = {"blockNumber": 5, "logIndex": 0}
+        assert cp.seen(a)
+        assert not cp.advance(8)
+        cp.done(a)
+        assert cp.advance(8)
+        assert not cp.seen({"blockNumber": 8, "logIndex": 3})
+
+        again = Checkpoint(self.db, "<stdin>:Quiet", "test")
+        pos, err = again.load()
+        assert pos == (8, Checkpoint.END)
+
+    def contract(self, ezo, name):
+        c = Contract(name, ezo)
+        c.te_map = {"0xtopic": TestDispatcher.handler}
+        c.calls = list()
+        return c
+
+    def test_02_backfill_from_checkpoint(self):
+        TestDispatcher.setup()
+        try:
+            logs = [dict(rce("0xabc", 0), blockNumber=b, transactionHash="0x{:02x}".format(b)) for b in (3, 12, 25)]
+            ezo = StubEzo(self.db, logs, head=30)
+            c = self.contract(ezo, "<stdin>:Oracle")
+            listener = Listener(ezo, "test")
+            listener.add("0xABC", c)
+            c.checkpoint.seen(logs[0])
+            c.checkpoint.done(logs[0])
+
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(listener.backfill())
+            finally:
+                loop.close()
+
+            assert sorted(ezo.w3.eth.requests) == [(3, 12), (13, 22), (23, 30)]
+            assert len(c.calls) == 2
+            # every log up to the head was handled
+            assert c.checkpoint.saved == (30, Checkpoint.END)
+        finally:
+            TestDispatcher.teardown()
+
+    def test_03_one_filter_for_all_contracts(self):
+        TestDispatcher.setup()
+        try:
+            logs = [dict(rce("0xabc", 0), blockNumber=12), dict(rce("0xdef", 1), blockNumber=13),
+                    dict(rce("0xabc", 2), blockNumber=14)]
+            ezo = StubEzo(self.db, logs, head=20)
+            oracle, other = self.contract(ezo, "<stdin>:Oracle"), self.contract(ezo, "<stdin>:Other")
+            listener = Listener(ezo, "test")
+            listener.add("0xabc", oracle)
+            listener.add("0xdef", other)
+
+            f = listener.log_filter()
+            assert sorted(f["address"]) == ["0xabc", "0xdef"]
+            assert f["topics"] == [["0xtopic"]]
+
+            # Other has never been listened to, so it starts at the head
+            oracle.checkpoint.last_seen = (10, 0)
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(listener.backfill())
+                loop.run_until_complete(listener.route(dict(rce("0xDEF", 3), blockNumber=21)))
+            finally:
+                loop.close()
+
+            assert ezo.w3.eth.requests == [(10, 19), (20, 20)]
+            assert oracle.calls == [0, 2]
+            assert other.calls == [3]
+
+            # Other's starting point was stored, so a restart catches up from there
+            again = Checkpoint(self.db, "<stdin>:Other", "test")
+            pos, err = again.load()
+            assert pos == (21, 3)
+        finally:
+            TestDispatcher.teardown()
+
+    def test_03a_new_contract_backfilled_from_start(self):
+        TestDispatcher.setup()
+        try:
+            # the head moved from 20 to 22 while the filter was being installed
+            logs = [dict(rce("0xabc", b - 20), blockNumber=b, transactionHash="0x{:02x}".format(b)) for b in (20, 21, 22)]
+            ezo = StubEzo(self.db, logs, head=22)
+            c = self.contract(ezo, "<stdin>:Started")
+            listener = Listener(ezo, "test")
+            listener.add("0xabc", c)
+
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(listener.backfill(head=22, start=20))
+            finally:
+                loop.close()
+
+            assert ezo.w3.eth.requests == [(21, 22)]
+            assert c.calls == [1, 2]
+            assert c.checkpoint.saved == (22, Checkpoint.END)
+        finally:
+            TestDispatcher.teardown()
+
+    def test_04_handled_once_across_reorgs_and_restarts(self):
+        TestDispatcher.setup()
+        try:
+            ezo = StubEzo(self.db, [], head=20)
+            c = self.contract(ezo, "<stdin>:Reorged")
+            listener = Listener(ezo, "test")
+            listener.add("0xabc", c)
+
+            event = dict(rce("0xabc", 0), blockNumber=5, blockHash="0x01")
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(listener.route(event))
+                loop.run_until_complete(listener.route(event))
+                assert c.calls == [0]
+
+                # the block is reorged out, and the transaction is mined again in another block
+                loop.run_until_complete(listener.route(dict(event, removed=True)))
+                assert c.checkpoint.saved == (5, -1)
+                loop.run_until_complete(listener.route(dict(event, blockHash="0x02")))
+                assert c.calls == [0, 0]
+
+                # restarted, with the event delivered again from before the checkpoint
+                again = self.contract(ezo, "<stdin>:Reorged")
+                restarted = Listener(ezo, "test")
+                restarted.add("0xabc", again)
+                again.checkpoint.last_seen = None
+                loop.run_until_complete(restarted.route(dict(event, blockHash="0x02")))
+                assert again.calls == []
+            finally:
+                loop.close()
+        finally:
+            TestDispatcher.teardown()
+
+    def test_05_handled_events_pruned_behind_checkpoints(self):
+        TestDispatcher.setup()
+        try:
+            ezo = StubEzo(self.db, [], head=100)
+            ezo.config["reorg-depth"] = 10
+            c = self.contract(ezo, "<stdin>:Pruned")
+            listener = Listener(ezo, "pruned")
+            listener.add("0xabc", c)
+
+            old, recent = dict(rce("0xabc", 0), blockNumber=5), dict(rce("0xabc", 1), blockNumber=65)
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(listener.route(old))
+                loop.run_until_complete(listener.route(recent))
+            finally:
+                loop.close()
+            assert c.calls == [0, 1]
+
+            listener._pruned = None
+            listener.advance(70)
+            DB.cache.clear()
+            assert self.db.get(listener.handled.key(old)) == (None, None)
+            handled, err = self.db.get(listener.handled.key(recent))
+            assert handled == {"block": 65}
+        finally:
+            TestDispatcher.teardown()
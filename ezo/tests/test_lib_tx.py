@@ -0,0 +1,529 @@
+from core.lib import NonceManager, TxTracker, UnlockSession, GasCache, AccountPool, ProviderPool, Balancer, FailoverProvider, Contract, \
+    DB, EZO
+from eth_account import Account
+from web3 import Web3, HTTPProvider
+from eth_abi import encode_abi, decode_abi
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from hexbytes import HexBytes
+from concurrent.futures import ThreadPoolExecutor, Future
+import json, logging, os, pytest, shutil, threading, time
+
+
+class StubEth:
+    '''
+    a node that mines the transactions it is told to, and remembers every one sent
+    '''
+
+    def __init__(self, count=7):
+        self.count = count
+        self.sent = list()
+        self.mined = dict()
+        self.lock = threading.Lock()
+
+    def getTransactionCount(self, account, block):
+        return self.count
+
+    def sendTransaction(self, tx):
+        with self.lock:
+            self.sent.append(tx)
+            return HexBytes("0x{:064x}".format(len(self.sent)))
+
+    def getTransaction(self, tx_hash):
+        tx = self.sent[int(HexBytes(tx_hash).hex(), 16) - 1]
+        return {"from": tx["from"], "nonce": tx["nonce"], "gas": tx["gas"], "gasPrice": tx.get("gasPrice", 100),
+                "value": 0, "input": "0x", "to": "0xdef"}
+
+    def mine(self, n):
+        tx_hash = "0x{:064x}".format(n)
+        self.mined[tx_hash] = {"transactionHash": tx_hash, "gasUsed": "0x5208", "blockNumber": hex(n), "status": "0x1",
+                               "logs": []}
+        self.blockNumber += 1
+
+
+class StubProvider:
+    '''
+    answers raw JSON-RPC requests, counting them
+    '''
+
+    def __init__(self, eth):
+        self.eth = eth
+        self.requests = list()
+
+    def make_request(self, method, params):
+        self.requests.append(method)
+        if method == "eth_getTransactionReceipt":
+            return {"result": self.eth.mined.get(params[0])}
+        return {"error": "unsupported"}
+
+
+class StubW3:
+
+    def __init__(self):
+        self.eth = StubEth()
+        self.eth.blockNumber = 1
+        self.provider = StubProvider(self.eth)
+
+
+class TestTransactions:
+
+    dbpath = "/tmp/ezotest_tx"
+
+    @classmethod
+    def setup(cls):
+        EZO.log = logging.getLogger("ezotest")
+        cls.db = DB("pytest", cls.dbpath)
+        DB.cache.clear()
+
+    @classmethod
+    def teardown(cls):
+        DB.cache.clear()
+        shutil.rmtree(cls.dbpath, ignore_errors=True)
+
+    def test_01_nonces_assigned_locally(self):
+        w3 = StubW3()
+        nm = NonceManager(w3, "0xabc")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            nonces = [n for n, err in pool.map(lambda _: nm.next(), range(50))]
+        assert sorted(nonces) == list(range(7, 57))
+
+        nm.resync()
+        w3.eth.count = 3
+        assert nm.next() == (3, None)
+
+    def test_02_pipelined_sends_resolve(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01})
+        futures = list()
+        for _ in range(3):
+            f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+            assert err is None
+            futures.append(f)
+
+        # all three were sent before any was mined
+        assert [tx["nonce"] for tx in w3.eth.sent] == [7, 8, 9]
+        for n in (1, 2, 3):
+            w3.eth.mine(n)
+        assert [f.result(timeout=2)["gasUsed"] for f in futures] == [21000] * 3
+
+    def test_03_failed_send_resyncs_nonce(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {})
+
+        def fail(tx):
+            raise ValueError("nonce too low")
+
+        f, err = tracker.send({"from": "0xabc", "gas": 21000}, fail)
+        assert f is None and err
+        w3.eth.count = 9
+        assert tracker.nonces("0xabc").next() == (9, None)
+
+    def test_04_stuck_transaction_resent_with_bumped_gas_price(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01, "tx-timeout": 0.05, "gas-bump": 1.5})
+        f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+        assert err is None
+
+        for _ in range(200):
+            if len(w3.eth.sent) > 1:
+                break
+            time.sleep(0.01)
+        replacement = w3.eth.sent[1]
+        assert replacement["nonce"] == 7
+        assert replacement["gasPrice"] == 150
+
+        w3.eth.mine(2)
+        assert f.result(timeout=2)["transactionHash"] == HexBytes("0x{:064x}".format(2))
+
+    def test_04a_original_mined_after_resend(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01, "tx-timeout": 0.05})
+        f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+        assert err is None
+
+        for _ in range(200):
+            if len(w3.eth.sent) > 1:
+                break
+            time.sleep(0.01)
+        assert len(w3.eth.sent) > 1
+
+        w3.eth.mine(1)
+        assert f.result(timeout=2)["transactionHash"] == HexBytes("0x{:064x}".format(1))
+        assert tracker.pending() == 0
+
+    def test_04b_cancelled_future_does_not_stop_tracking(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01})
+        cancelled, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+        assert cancelled.cancel()
+        w3.eth.mine(1)
+        for _ in range(200):
+            if not tracker.pending():
+                break
+            time.sleep(0.01)
+
+        f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+        w3.eth.mine(2)
+        assert f.result(timeout=2)["gasUsed"] == 21000
+
+    def test_04c_resends_stop_after_max_resends(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01, "tx-timeout": 0.02, "tx-max-resends": 2})
+        f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+        assert err is None
+
+        with pytest.raises(TimeoutError):
+            f.result(timeout=2)
+        assert len(w3.eth.sent) == 3
+        assert tracker.pending() == 0
+
+    def test_04d_resends_stop_at_max_gas_price(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01, "tx-timeout": 0.02, "gas-bump": 1.5,
+                                 "tx-max-gas-price": 200})
+        f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction)
+        assert err is None
+
+        with pytest.raises(TimeoutError):
+            f.result(timeout=2)
+        assert [tx.get("gasPrice") for tx in w3.eth.sent] == [None, 150, 200]
+        assert tracker.pending() == 0
+
+    def test_05_receipts_polled_once_per_block_and_recorded(self):
+        w3 = StubW3()
+        tracker = TxTracker(w3, {"receipt-poll-interval": 0.01}, db=self.db)
+        futures = list()
+        for _ in range(3):
+            record = {"name": "Oracle", "function": "fill"}
+            f, err = tracker.send({"from": "0xabc", "gas": 21000}, w3.eth.sendTransaction, record=record)
+            futures.append(f)
+
+        time.sleep(0.05)
+        polled = w3.provider.requests.count("eth_getTransactionReceipt")
+        time.sleep(0.1)
+        # no new block, no new receipt requests
+        assert w3.provider.requests.count("eth_getTransactionReceipt") == polled
+        for n in (1, 2, 3):
+            w3.eth.mine(n)
+        receipts = [f.result(timeout=2) for f in futures]
+        assert [r["gasUsed"] for r in receipts] == [21000] * 3
+
+        tx_hash = receipts[0]["transactionHash"].hex()
+        rec, err = self.db.get(DB.pkey([EZO.RESPONSE, "Oracle", tx_hash]))
+        assert err is None
+        assert rec["function"] == "fill"
+        assert rec["gas-used"] == 21000
+        assert rec["latency"] > 0
+
+    def test_06_unlock_renewed_only_when_expired(self):
+        w3 = StubW3()
+        unlocks = list()
+        w3.geth = type("Geth", (), {})()
+        w3.geth.personal = type("Personal", (), {})()
+        w3.geth.personal.unlock_account = lambda account, password, duration: unlocks.append(duration) or True
+
+        session = UnlockSession(w3, duration=0.1)
+        for _ in range(5):
+            assert session.unlock("0xabc", "pw") == (None, None)
+        assert unlocks == [0.1]
+
+        time.sleep(0.1)
+        session.unlock("0xabc", "pw")
+        session.expire("0xabc")
+        session.unlock("0xabc", "pw")
+        assert len(unlocks) == 3
+
+        w3.geth.personal.unlock_account = lambda account, password, duration: False
+        session.expire("0xabc")
+        _, err = session.unlock("0xabc", "wrong")
+        assert err
+
+    def test_07_gas_estimates_cached_by_size_class(self):
+        gas = GasCache(margin=0.5)
+        short, longer = GasCache.key("h", "fill", ["ab", 7]), GasCache.key("h", "fill", ["a" * 40, 7])
+        assert short == GasCache.key("h", "fill", ["cd", 9])
+        assert short != longer
+        assert gas.get(short) is None
+        assert gas.put(short, 30000) == 45000
+        assert gas.get(short) == 45000
+
+        # succeeded, or failed for some other reason than gas: kept
+        ok = Future()
+        ok.set_result({"transactionHash": "0x01", "status": 0, "gasUsed": 30000})
+        gas.check(short, 45000, ok)
+        assert gas.get(short) == 45000
+
+        out_of_gas = Future()
+        out_of_gas.set_result({"transactionHash": "0x02", "status": 0, "gasUsed": 45000})
+        gas.check(short, 45000, out_of_gas)
+        assert gas.get(short) is None
+
+    def test_08_local_signing_rotates_accounts(self):
+        os.makedirs(self.dbpath, exist_ok=True)
+        keys = [Account.create() for _ in range(2)]
+        paths = list()
+        for n, key in enumerate(keys):
+            paths.append("{}/key{}.json".format(self.dbpath, n))
+            with open(paths[-1], "w") as f:
+                json.dump(Account.encrypt(key.privateKey, "secret", kdf="pbkdf2", iterations=2), f)
+        config = {"target": {"test": {"account": "", "keystores": paths}}}
+
+        w3 = StubW3()
+        raw = list()
+        w3.eth.chainId = 1337
+        w3.eth.gasPrice = 100
+        w3.eth.sendRawTransaction = lambda tx: raw.append(tx) or HexBytes("0x{:064x}".format(len(raw)))
+
+        pool, err = AccountPool.from_config(w3, config, "test", "secret")
+        assert err is None
+        senders = [pool.next() for _ in range(4)]
+        assert [s.address for s in senders] == [k.address for k in keys] * 2
+
+        build = lambda tx: dict(tx, to=Web3.toChecksumAddress("0x" + "de" * 20), data="0x", value=0)
+        tracker = TxTracker(w3, {})
+        for signer in senders[:2]:
+            f, err = tracker.send({"from": signer.address, "gas": 21000}, pool.transact(signer, build))
+            assert err is None
+        assert [Account.recover_transaction(tx) for tx in raw] == [k.address for k in keys]
+
+        _, err = AccountPool.from_config(w3, config, "test", "wrong")
+        assert err
+        assert AccountPool.from_config(w3, {"target": {"test": {"account": ""}}}, "test", None) == (None, None)
+
+
+class BatchNode(BaseHTTPRequestHandler):
+    '''
+    a JSON-RPC node answering eth_call to temp(uint256) with the argument times ten
+    '''
+
+    posts = list()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(body, dict):
+            BatchNode.posts.append(body)
+            # requests that stay on their node are answered with its port
+            result = "BatchNode/v1"
+            if body["method"] in ("eth_newFilter", "personal_unlockAccount", "eth_sendTransaction"):
+                result = "0x{:x}".format(self.server.server_port)
+            out = json.dumps({"jsonrpc": "2.0", "id": body["id"], "result": result}).encode()
+        else:
+            BatchNode.posts.append(body)
+            replies = list()
+            for req in body:
+                tx = req["params"][0]
+                city = decode_abi(["uint256"], HexBytes(tx["data"])[4:])[0]
+                result = HexBytes(encode_abi(["uint256"], [city * 10])).hex()
+                replies.append({"jsonrpc": "2.0", "id": req["id"], "result": result})
+            out = json.dumps(list(reversed(replies))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBatchCalls:
+
+    dbpath = "/tmp/ezotest_calls"
+    abi = [{"type": "function", "name": "temp", "constant": True, "stateMutability": "view",
+            "inputs": [{"name": "city", "type": "uint256"}], "outputs": [{"name": "", "type": "uint256"}]}]
+
+    class Ezo:
+        db = None
+        w3 = None
+        config = {"target": {"test": {"account": "0x" + "ab" * 20}}, "call-batch-size": 2}
+
+    @classmethod
+    def setup(cls):
+        EZO.log = logging.getLogger("ezotest")
+        cls.db = DB("pytest", cls.dbpath)
+        DB.cache.clear()
+        cls.Ezo.db = cls.db
+        cls.server = HTTPServer(("127.0.0.1", 0), BatchNode)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.Ezo.w3 = Web3(HTTPProvider("http://127.0.0.1:{}".format(cls.server.server_port)))
+        BatchNode.posts = list()
+
+    @classmethod
+    def teardown(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        DB.cache.clear()
+        shutil.rmtree(cls.dbpath, ignore_errors=True)
+
+    def test_01_calls_batched_and_decoded(self):
+        c = Contract("<stdin>:Thermometer", self.Ezo)
+        c.abi = self.abi
+        c.source = "contract Thermometer {}"
+        _, err = c.save(overwrite=True)
+        assert err is None
+        _, err = self.db.save(DB.pkey([EZO.DEPLOYED, "Thermometer", "test", c.hash]), {"address": "0x" + "cd" * 20},
+                              overwrite=True)
+        assert err is None
+
+        calls = [("Thermometer", "temp", [n]) for n in range(5)] + [("Barometer", "pressure", [])]
+        results, err = Contract.call_many(self.Ezo, calls, "test", block=12)
+        assert err is None
+        assert [r for r, _ in results[:5]] == [0, 10, 20, 30, 40]
+        assert results[5][0] is None and "not found" in results[5][1]
+
+        # 5 calls in batches of 2, all at block 12
+        assert [len(p) for p in BatchNode.posts if isinstance(p, list)] == [2, 2, 1]
+        assert all(req["params"][1] == "0xc" for p in BatchNode.posts for req in p)
+
+
+class TestProviderPool:
+
+    @classmethod
+    def setup(cls):
+        EZO.log = logging.getLogger("ezotest")
+        ProviderPool.close()
+        cls.server = HTTPServer(("127.0.0.1", 0), BatchNode)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:{}".format(cls.server.server_port)
+
+    @classmethod
+    def teardown(cls):
+        ProviderPool.close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_01_connection_reused(self):
+        w3, err = ProviderPool.get(self.url, {})
+        assert err is None
+        again, err = ProviderPool.get(self.url, {})
+        assert again is w3
+        assert ProviderPool.session(self.url) is not None
+        assert ProviderPool.get("ftp://nowhere", {}) == (None, "Invalid Provider URL: ftp://nowhere")
+
+    def test_02_unhealthy_connection_replaced(self):
+        config = {"provider-health-interval": 0}
+        w3, err = ProviderPool.get(self.url, config)
+        healthy, err = ProviderPool.get(self.url, config)
+        assert healthy is w3
+
+        self.server.shutdown()
+        self.server.server_close()
+        replaced, err = ProviderPool.get(self.url, config)
+        assert err is None
+        assert replaced is not w3
+
+    def test_03_slow_node_check_does_not_block_other_nodes(self):
+        class SlowW3:
+            def isConnected(self):
+                time.sleep(0.5)
+                return True
+
+        w3, err = ProviderPool.get(self.url, {})
+        ProviderPool._providers["http://slow"] = (SlowW3(), None, 0)
+        checking = threading.Thread(target=ProviderPool.get, args=("http://slow", {"provider-health-interval": 0}))
+        checking.start()
+        time.sleep(0.05)
+
+        start = time.monotonic()
+        again, err = ProviderPool.get(self.url, {})
+        assert again is w3
+        assert time.monotonic() - start < 0.2
+        checking.join()
+
+
+class TestFailover:
+
+    @classmethod
+    def setup(cls):
+        EZO.log = logging.getLogger("ezotest")
+        ProviderPool.close()
+        BatchNode.posts = list()
+        cls.server = HTTPServer(("127.0.0.1", 0), BatchNode)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.up = "http://127.0.0.1:{}".format(cls.server.server_port)
+
+        # a port nothing listens on
+        dead = HTTPServer(("127.0.0.1", 0), BatchNode)
+        cls.down = "http://127.0.0.1:{}".format(dead.server_port)
+        dead.server_close()
+
+    @classmethod
+    def teardown(cls):
+        ProviderPool.close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_01_round_robin_and_circuit_breaking(self):
+        b = Balancer(["a", "b", "c"], errors=2, reset=0.1)
+        assert [b.pick() for _ in range(4)] == ["a", "b", "c", "a"]
+
+        b.failure("b")
+        assert "b" in [b.pick() for _ in range(3)]
+        b.failure("b")
+        assert "b" not in [b.pick() for _ in range(4)]
+        assert b.pick(exclude=["a", "c"]) == "b"
+        assert b.pick(exclude=["a", "b", "c"]) is None
+
+        time.sleep(0.1)
+        assert "b" in [b.pick() for _ in range(3)]
+
+    def test_02_least_latency(self):
+        b = Balancer(["a", "b"], strategy="least-latency")
+        b.success("a", 0.5)
+        assert b.pick() == "b"
+        b.success("b", 0.1)
+        assert b.pick() == "b"
+        for _ in range(10):
+            b.success("b", 2.0)
+        assert b.pick() == "a"
+
+    def test_03_requests_fail_over(self):
+        b = Balancer([self.down, self.up], errors=1, reset=60)
+        w3 = Web3(FailoverProvider(b, {"node-timeout": 2}))
+        assert w3.clientVersion == "BatchNode/v1"
+        assert w3.clientVersion == "BatchNode/v1"
+        # the dead node was tried once, then left out
+        assert b.pick() == self.up
+        assert b.latency[self.up] is not None
+
+        call = {"to": "0x" + "cd" * 20, "data": "0x12345678" + encode_abi(["uint256"], [4]).hex()}
+        results = FailoverProvider(b, {}).batch([("eth_call", [call, "latest"])])
+        assert results[0][0] == HexBytes(encode_abi(["uint256"], [40])).hex()
+
+    def test_04_filters_stay_on_their_node(self):
+        b = Balancer([self.up, self.down], errors=5)
+        provider = FailoverProvider(b, {})
+        resp = provider.make_request("eth_newFilter", [{}])
+        filter_id = resp["result"]
+        for _ in range(3):
+            provider.make_request("eth_getFilterChanges", [filter_id])
+        assert [p["method"] for p in BatchNode.posts if isinstance(p, dict)][-3:] == ["eth_getFilterChanges"] * 3
+
+    def test_05_account_requests_stay_on_their_node(self):
+        other = HTTPServer(("127.0.0.1", 0), BatchNode)
+        threading.Thread(target=other.serve_forever, daemon=True).start()
+        try:
+            b = Balancer([self.up, "http://127.0.0.1:{}".format(other.server_port)])
+            provider = FailoverProvider(b, {})
+            a, c = "0x" + "aa" * 20, "0x" + "cc" * 20
+            node_a = provider.make_request("personal_unlockAccount", [a, "pw", 300])["result"]
+            node_c = provider.make_request("personal_unlockAccount", [c, "pw", 300])["result"]
+            assert node_a != node_c
+            for _ in range(3):
+                assert provider.make_request("eth_sendTransaction", [{"from": "0x" + "AA" * 20}])["result"] == node_a
+                assert provider.make_request("eth_sendTransaction", [{"from": c}])["result"] == node_c
+        finally:
+            other.shutdown()
+            other.server_close()
+
+    def test_06_account_fails_over_with_its_unlock(self):
+        b = Balancer([self.down, self.up], errors=5)
+        provider = FailoverProvider(b, {"node-timeout": 2})
+        a = "0x" + "aa" * 20
+        provider._accounts[a] = self.down
+        with pytest.raises(Exception):
+            provider.make_request("eth_sendTransaction", [{"from": a}])
+        assert a not in provider._accounts
+
+        up = "0x{:x}".format(self.server.server_port)
+        assert provider.make_request("personal_unlockAccount", [a, "pw", 300])["result"] == up
+        assert provider.make_request("eth_sendTransaction", [{"from": a}])["result"] == up
@@ -22,3 +22,60 @@ def test_02_get_deploys():
     ks = views.get_deploys(None, ezo)
     assert len(ks) > 0
 
+
+
+class IndexedEzo:
+    db = None
+
+
+def index_db():
+    from core.lib import DB, Contract
+    import shutil
+    shutil.rmtree("/tmp/ezotest_views", ignore_errors=True)
+    ezo = IndexedEzo()
+    ezo.db = DB("pytest", "/tmp/ezotest_views")
+    DB.cache.clear()
+    for name, address in [("Alpha", "0xAAAA"), ("Beta", "0xBBBB")]:
+        d = {"contract-name": "<stdin>:" + name, "hash": "h" + name, "address": address, "target": "test"}
+        key = DB.pkey([EZO.DEPLOYED, name, "test", d["hash"]])
+        with ezo.db.batch() as b:
+            _, err = Contract.save_deployment(b, key, d)
+            assert err is None
+    return ezo
+
+
+def test_03_get_deploy_by_address():
+    ezo = index_db()
+    d, err = views.get_deploy_by_address("0xaaaa", "test", ezo)
+    assert err is None
+    assert d["contract-name"] == "<stdin>:Alpha"
+    d, err = views.get_deploy_by_address("0xaaaa", "other", ezo)
+    assert d is None
+    d, err = views.get_deploy_by_address("0xcccc", "test", ezo)
+    assert d is None
+
+
+def test_04_get_deploys_by_target_and_hash():
+    ezo = index_db()
+    ks, err = views.get_deploys_by_target("test", ezo)
+    assert err is None
+    assert len(ks) == 2
+    ks, err = views.get_deploys_by_hash("hBeta", ezo)
+    assert len(ks) == 1
+
+
+def test_05_delete_deployments_keeps_other_targets():
+    from core.lib import DB, Contract
+    ezo = index_db()
+    # the same address on a second target
+    d = {"contract-name": "<stdin>:Alpha", "hash": "hAlpha", "address": "0xAAAA", "target": "other"}
+    with ezo.db.batch() as b:
+        _, err = Contract.save_deployment(b, DB.pkey([EZO.DEPLOYED, "Alpha", "other", "hAlpha"]), d)
+        assert err is None
+
+    _, err = Contract.delete_deployments(ezo, "Alpha", target="test")
+    assert err is None
+    d, err = views.get_deploy_by_address("0xaaaa", "test", ezo)
+    assert d is None
+    d, err = views.get_deploy_by_address("0xaaaa", "other", ezo)
+    assert d["target"] == "other"
@@ -32,14 +32,14 @@ setuptools.setup(
     install_requires=['cement',
                       'configobj',
                       'cytoolz',
-                      'eth-abi',
-                      'eth-account',
+                      'eth-abi>=2.2.0,<3',
+                      'eth-account>=0.5.9,<0.6',
                       'eth-hash',
                       'eth-keyfile',
                       'eth-keys',
                       'eth-rlp',
                       'eth-utils',
-                      'hexbytes',
+                      'hexbytes>=0.2.0,<1',
                       'idna',
                       'inflection',
                       'lru-dict',
@@ -48,11 +48,11 @@ setuptools.setup(
                       'pycryptodome',
                       'requests',
                       'requests-toolbelt',
-                      'web3',
+                      'web3>=5.31.0,<6',
                       "toolz",
                       "tqdm",
                       "urllib3",
-                      "websockets",
+                      "websockets>=9.1,<10",
                       "xkcdpass",
                       "xxhash"
                        ]